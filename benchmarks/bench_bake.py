@@ -0,0 +1,40 @@
+"""Benchmark the baking rate of cmdy
+
+Baking (`cmdy(**baking_args)`) creates a new bakeable with its own classes,
+with the plugins vendored on first use:
+
+    python benchmarks/bench_bake.py [-n 1000]
+
+The import time can be inspected by:
+
+    python -X importtime -c "import cmdy"
+"""
+import argparse
+import time
+
+import cmdy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=1000, help="Number of bakes")
+    number = parser.parse_args().n
+
+    start = time.perf_counter()
+    for _ in range(number):
+        cmdy(cmdy_prefix="-")
+    elapsed = time.perf_counter() - start
+    print(f"bake:                {elapsed / number * 1e6:10.1f} us/bake")
+    print(f"                     {number / elapsed:10.1f} bakes/s")
+
+    start = time.perf_counter()
+    for _ in range(number):
+        baked = cmdy(cmdy_prefix="-")
+        for plugin in baked._plugins:
+            baked._plugins.vendor(plugin)
+    elapsed = time.perf_counter() - start
+    print(f"bake + all plugins:  {elapsed / number * 1e6:10.1f} us/bake")
+
+
+if __name__ == "__main__":
+    main()
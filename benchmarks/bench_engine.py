@@ -0,0 +1,51 @@
+"""Benchmark the engines to wait for the processes and read their pipes
+
+    python benchmarks/bench_engine.py [-n 200] [-l 2000]
+"""
+import argparse
+import time
+
+import cmdy
+
+
+def bench(name, func, number=1):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    elapsed = (time.perf_counter() - start) / number * 1e3
+    print(f"{name:<32} {elapsed:10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=200, help="Number of runs")
+    parser.add_argument(
+        "-l", type=int, default=2000, help="Number of lines to iterate"
+    )
+    args = parser.parse_args()
+
+    for engine in ("curio", "sync"):
+        prepared = cmdy.prepare(cmdy.true, _engine=engine)
+        bench(f"[{engine}] run true", prepared.run, args.n)
+        bench(
+            f"[{engine}] str of seq {args.l}",
+            lambda: cmdy.seq(args.l, _engine=engine).str(),
+        )
+        bench(
+            f"[{engine}] iterate seq {args.l}",
+            lambda: sum(1 for _ in cmdy.seq(args.l, _engine=engine).iter()),
+        )
+        bench(
+            f"[{engine}] iterate seq {args.l} (batch)",
+            lambda: sum(
+                len(lines)
+                for lines in cmdy.seq(args.l, _engine=engine).iter(
+                    batch=1000
+                )
+            ),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark a pipeline against the same one run by bash, and the
+throughput of the pipes with the default and a large capacity
+
+    python benchmarks/bench_pipeline.py [-n 5] [-s 200] [-t 2] [-p 1048576]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import cmdy
+
+
+def bench(name, func, number=1):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    elapsed = (time.perf_counter() - start) / number * 1e3
+    print(f"{name:<48} {elapsed:10.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=5, help="Number of runs")
+    parser.add_argument(
+        "-s", type=int, default=200, help="Size of the file in MB"
+    )
+    parser.add_argument(
+        "-t", type=int, default=2, help="Size of the data in GB to pipe"
+    )
+    parser.add_argument(
+        "-p",
+        type=int,
+        default=1 << 20,
+        help="The large capacity of the pipes in bytes",
+    )
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile() as big:
+        chunk = os.urandom(1 << 20)
+        for _ in range(args.s):
+            big.write(chunk)
+        big.flush()
+
+        bench(
+            "bash: cat | gzip | wc -c",
+            lambda: cmdy.bash(c=f"cat {big.name} | gzip -1 | wc -c").str(),
+            args.n,
+        )
+        for engine in ("curio", "sync"):
+            bench(
+                f"[{engine}] cat | gzip | wc -c",
+                lambda: (
+                    cmdy.cat(big.name).p()
+                    | cmdy.gzip("-1").p()
+                    | cmdy.wc(c=True, _engine=engine)
+                ).str(),
+                args.n,
+            )
+
+    # pipe throughput: the stages are cheap, the data is large
+    for pipe_size in (0, args.p):
+        bench(
+            f"head -c {args.t}G | cat, pipe size {pipe_size}",
+            lambda: (
+                cmdy.head(c=args.t << 30, _="/dev/zero").p()
+                | (cmdy.cat(_pipe_size=pipe_size).r() > cmdy.DEVNULL)
+            ).wait(),
+            args.n,
+        )
+        bench(
+            f"head -c {args.t}G | parent, pipe size {pipe_size}",
+            lambda: len(
+                cmdy.head(
+                    c=args.t << 30,
+                    _="/dev/zero",
+                    _pipe_size=pipe_size,
+                    _encoding=None,
+                ).buffer()
+            ),
+            args.n,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Benchmark the overhead of running a command with cmdy
+
+Compares plain `subprocess.Popen`, prepared commands, the explicit plan
+API and the fluent chain:
+
+    python benchmarks/bench_plan.py [-n 500]
+"""
+import argparse
+import subprocess
+import time
+
+import cmdy
+
+
+def bench(name, func, number, baseline=None):
+    func()  # warm up
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    elapsed = (time.perf_counter() - start) / number * 1e6
+    overhead = "" if baseline is None else f" (+{elapsed - baseline:.1f} us)"
+    print(f"{name:<24} {elapsed:10.1f} us/call{overhead}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-n", type=int, default=500, help="Number of calls")
+    number = parser.parse_args().n
+
+    plan = cmdy.plan(cmdy.true)
+    prepared = cmdy.prepare(cmdy.test, "-n", cmdy.slot("value"))
+    base = bench(
+        "subprocess.Popen",
+        lambda: subprocess.Popen(
+            ["true"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        ).communicate(),
+        number,
+    )
+    bench(
+        "prepared.run(...)",
+        lambda: prepared.run(value="x"),
+        number,
+        base,
+    )
+    bench(
+        "cmdy.plan(...).run()",
+        lambda: cmdy.plan(cmdy.true).run(),
+        number,
+        base,
+    )
+    bench("plan.run() (reused)", plan.run, number, base)
+    bench("cmdy.true()", lambda: cmdy.true(), number, base)
+
+
+if __name__ == "__main__":
+    main()
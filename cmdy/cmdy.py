@@ -1,22 +1,25 @@
 from shlex import quote
+from subprocess import PIPE
 from typing import TYPE_CHECKING
 
-from curio import subprocess
 from diot import Diot
-from varname import will
 
 from .cmdy_defaults import get_config
 from .cmdy_exceptions import CmdyExecNotFoundError, CmdyActionError
 from .cmdy_utils import (
+    copy_config,
     parse_args,
     compose_arg_segment,
     compose_cmd,
     property_or_method,
     parse_single_kwarg,
+    set_pipe_size,
+    will,
 )
 
 if TYPE_CHECKING:
     from .cmdy_bakeable import Bakeable
+    from curio.subprocess import Popen
 
 
 class Cmdy:
@@ -32,7 +35,9 @@ class Cmdy:
     def __repr__(self) -> str:
         return f"<Cmdy: {self._name} {self._args.args} @ {hex(id(self))}>"
 
-    def __call__(self, *args, **kwargs):
+    def _compose(self, args: tuple, kwargs: dict) -> Diot:
+        """Compose the ready arguments, configs and popen arguments
+        from the baked ones and the ones passed to the call"""
         config = get_config()
         args = parse_args(
             self._name, args, kwargs, config, self._bakeable._baking_args
@@ -40,7 +45,7 @@ class Cmdy:
         ready_args = self._args.args.copy() + args.args
         ready_kwargs = self._args.kwargs.copy()
         ready_kwargs.update(args.kwargs)
-        ready_config = config.copy()
+        ready_config = copy_config(config)
         ready_config.update(self._args.config)
         ready_config.update(args.config)
         ready_popen = self._args.popen.copy()
@@ -49,38 +54,37 @@ class Cmdy:
         # clear direct subcommand for reuse
         self._args.args = []
 
-        if ready_config.pop("sub", False):
-            return CmdyHoldingWithSub(
-                self._name,
-                Diot(
-                    args=ready_args,
-                    kwargs=ready_kwargs,
-                    config=ready_config,
-                    popen=ready_popen,
-                ),
-                self._bakeable,
-            )
+        return Diot(
+            args=ready_args,
+            kwargs=ready_kwargs,
+            config=ready_config,
+            popen=ready_popen,
+        )
 
+    def _with_exe(self, ready: Diot) -> Diot:
+        """Put the executable in front of the ready arguments"""
         # update the executable
-        exe = ready_config.pop("exe", None) or self._name
+        exe = ready.config.pop("exe", None) or self._name
+        ready.args = [str(exe)] + ready.args
+        return ready
+
+    def __call__(self, *args, **kwargs):
+        ready = self._compose(args, kwargs)
+
+        if ready.config.pop("sub", False):
+            return CmdyHoldingWithSub(self._name, ready, self._bakeable)
+
         # next attribute
-        next_attr = will(raise_exc=False)
+        next_attr = will()
 
         # Let CmdyHolding handle the result
         return self._bakeable.CmdyHolding(
-            Diot(
-                args=[str(exe)] + ready_args,
-                kwargs=ready_kwargs,
-                config=ready_config,
-                popen=ready_popen,
-            ),
-            self._bakeable,
-            next_attr,
+            self._with_exe(ready), self._bakeable, next_attr
         )
 
     def _(self, **kwargs):
         """Bake a command"""
-        if will(raise_exc=False):
+        if will():
             raise CmdyActionError(
                 "Baking Cmdy object is supposed to be reused."
             )
@@ -168,6 +172,14 @@ class CmdyHolding:
 
         return result
 
+    @classmethod
+    def _hold(cls, args: Diot, bakeable: "Bakeable"):
+        """Create a holding object without inspecting the actions to take
+        nor running it"""
+        holding = super().__new__(cls)
+        holding.__init__(args, bakeable)
+        return holding
+
     def __init__(self, args: Diot, bakeable: "Bakeable", will: str = None):
         # Attach the global EVENT here for later access
 
@@ -177,7 +189,10 @@ class CmdyHolding:
         self.shell = args.config.shell
         self.encoding = args.config.encoding
         self.okcode = args.config.okcode
+        self.pipefail = args.config.pipefail
+        self.pipe_size = args.config.pipe_size
         self.timeout = args.config.timeout
+        self.engine = args.config.engine
         self.raise_ = args.config["raise"]
         self.should_close_fds = Diot()
         # Should I wait for the results, or just run asyncronouslly
@@ -187,11 +202,18 @@ class CmdyHolding:
         self.should_wait = False
         self.did = self.curr = ""
         self.will = will
+        # Whether actions are detected from the fluent chain
+        # False for holdings created by CmdyPlan
+        self.fluent = True
 
         # pipes
-        self.stdin = subprocess.PIPE
-        self.stdout = subprocess.PIPE
-        self.stderr = subprocess.PIPE
+        self.stdin = PIPE
+        self.stdout = PIPE
+        self.stderr = PIPE
+        # data to feed to the stdin
+        self.input = None
+        # the relays to build on the output pipes ("stdout"/"stderr")
+        self.relays = {}
 
         args.popen.shell = False
 
@@ -208,9 +230,11 @@ class CmdyHolding:
     def reset(self):
         """Reset the holding object for reuse"""
         # pipes
-        self.stdin = subprocess.PIPE
-        self.stdout = subprocess.PIPE
-        self.stderr = subprocess.PIPE
+        self.stdin = PIPE
+        self.stdout = PIPE
+        self.stderr = PIPE
+        self.input = None
+        self.relays = {}
         self.did = self.curr = self.will = ""
 
         self.should_close_fds = Diot()
@@ -222,9 +246,12 @@ class CmdyHolding:
         """Get the stringified cmd"""
         return " ".join(quote(cmdpart) for cmdpart in self.cmd)
 
-    def _run(self):
+    def _spawn(self) -> "Popen":
+        """Start the process of the command with the pipes"""
+        from curio.subprocess import Popen
+
         try:
-            return subprocess.Popen(
+            return Popen(
                 self.cmd,
                 stdin=self.stdin,
                 stdout=self.stdout,
@@ -234,6 +261,25 @@ class CmdyHolding:
         except FileNotFoundError as fnfe:
             raise CmdyExecNotFoundError(str(fnfe)) from None
 
+    def _run(self):
+        proc = self._spawn()
+        if self.pipe_size:
+            # the pipes we created
+            popen = proc._popen
+            for pipe in (popen.stdin, popen.stdout, popen.stderr):
+                if pipe is not None:
+                    set_pipe_size(pipe.fileno(), self.pipe_size)
+
+        for name, make_relay in self.relays.items():
+            relay = make_relay(getattr(proc, name)).start()
+            # the outputs are captured from the relays
+            setattr(proc, name, relay.capture)
+            if relay.capture is None:
+                # consumed by the relay, as if redirected
+                setattr(self, name, relay)
+            self.should_close_fds[name] = relay
+        return proc
+
     def _onhold(self, check_event=True):
         """Tell if I am on hold
         We should be on hold to run if:
@@ -265,7 +311,7 @@ class CmdyHolding:
         self.did, self.curr, self.will = (
             self.curr,
             self.will,
-            will(2, raise_exc=False),
+            will(2),
         )
         if self._onhold():
             return self
@@ -282,7 +328,7 @@ class CmdyHolding:
         self.did, self.curr, self.will = (
             self.curr,
             self.will,
-            will(2, raise_exc=False),
+            will(2),
         )
 
         if self.data["async"] or len(self.data) > 2:
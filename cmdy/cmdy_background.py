@@ -0,0 +1,162 @@
+"""Commands running in background, waited by a shared reaper thread"""
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from concurrent.futures import as_completed as futures_as_completed
+from concurrent.futures import wait as wait_futures
+from threading import Thread
+from typing import TYPE_CHECKING, Iterable, Iterator, List
+
+from .cmdy_engine import reaper
+from .cmdy_exceptions import CmdyReturnCodeError, CmdyTimeoutError
+
+if TYPE_CHECKING:
+    from .cmdy_result import CmdyResult
+
+
+class CmdyFuture(Future):
+    """The future of a command running in background
+
+    Built by `.bg()` (`cmdy.sleep(1).bg()`), with the command (or the
+    pipeline) spawned already. The processes are waited, with their outputs
+    drained, by the reaper thread shared by all the commands running in
+    background, so no thread is taken for each of them.
+
+    `result()` returns the result of the command, or raises
+    CmdyReturnCodeError or CmdyTimeoutError, as `wait()` does.
+    It works with `concurrent.futures.wait()` and `as_completed()`, as well
+    as `cmdy.wait_all()` and `cmdy.as_completed()`.
+
+    Args:
+        result: The result of the command not waited yet, the last stage if
+            it is a pipeline
+    """
+
+    def __init__(self, result: "CmdyResult"):
+        super().__init__()
+        self.set_running_or_notify_cancel()
+        self.cmdy_result = result
+        self.results = (
+            result.pipeline.results if result.pipeline else [result]
+        )
+
+        streams = []
+        for stage in self.results:
+            streams.extend(stage._pipes()[0])
+        _, stdin, input_ = self.results[0]._pipes()
+        holding = result.holding
+        reaper().add(
+            [stage.proc for stage in self.results],
+            streams,
+            stdin,
+            input_,
+            holding.timeout,
+            self._done,
+        )
+
+    def __repr__(self):
+        state = "finished" if self.done() else "running"
+        return f"<CmdyFuture: {self.cmdy_result.cmd} {state}>"
+
+    @property
+    def pid(self) -> int:
+        """The pid of the process, the last stage if it is a pipeline"""
+        return self.cmdy_result.pid
+
+    def kill(self):
+        """Kill the processes, the future gets the return codes as usual"""
+        for stage in self.results:
+            if stage.proc._popen.poll() is None:
+                stage.proc.kill()
+
+    def _done(self, rcs: List[int], error: Exception):
+        """Called by the reaper when the processes finish
+
+        The files, relays and tees of the commands are closed in another
+        thread if any, since closing them may wait for their threads, which
+        would stall the other commands waited by the reaper.
+        """
+        if any(stage.holding.should_close_fds for stage in self.results):
+            Thread(
+                target=self._finish, args=(rcs, error), daemon=True
+            ).start()
+        else:
+            self._finish(rcs, error)
+
+    def _finish(self, rcs: List[int], error: Exception):
+        """Close the fds and resolve the future"""
+        result = self.cmdy_result
+        for stage in self.results:
+            try:
+                stage._close_fds()
+            except Exception as exc:  # pylint: disable=broad-except
+                # i.e. a sink of a tee failing
+                error = error or exc
+        for stage, rc in zip(self.results, rcs or ()):
+            stage._rc = rc
+            stage._input = None
+        try:
+            if error is not None:
+                raise error
+            if result.pipeline:
+                failed = result.pipeline.failed
+            elif result._rc not in result.holding.okcode:
+                failed = result
+            else:
+                failed = None
+            if failed is not None and result.holding.raise_:
+                raise CmdyReturnCodeError(failed)
+        except Exception as exc:  # pylint: disable=broad-except
+            self.set_exception(exc)
+        else:
+            self.set_result(result)
+
+
+def wait_all(
+    futures: Iterable[Future], timeout: float = None
+) -> List["CmdyResult"]:
+    """Wait for all the commands running in background
+
+    Args:
+        futures: The futures of the commands (`.bg()`)
+        timeout: The max seconds to wait, None to wait forever
+
+    Returns:
+        The results of the commands, in the order of the futures
+
+    Raises:
+        CmdyTimeoutError: When some of the commands don't finish in time.
+            They are not killed.
+        CmdyReturnCodeError: The error of the first failing command, after
+            all of them finish
+    """
+    futures = list(futures)
+    _, not_done = wait_futures(futures, timeout)
+    if not_done:
+        raise CmdyTimeoutError(
+            f"{len(not_done)} of {len(futures)} commands not finished after "
+            f"{timeout} seconds."
+        )
+    return [future.result() for future in futures]
+
+
+def as_completed(
+    futures: Iterable[Future], timeout: float = None
+) -> Iterator[Future]:
+    """Yield the futures of the commands running in background as they
+    finish
+
+    Args:
+        futures: The futures of the commands (`.bg()`)
+        timeout: The max seconds to wait, None to wait forever
+
+    Raises:
+        CmdyTimeoutError: When some of the commands don't finish in time.
+            They are not killed.
+    """
+    futures = list(futures)
+    try:
+        yield from futures_as_completed(futures, timeout)
+    except FuturesTimeoutError as error:
+        raise CmdyTimeoutError(
+            f"Commands not finished after {timeout} seconds."
+        ) from error
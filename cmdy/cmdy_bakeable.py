@@ -1,4 +1,7 @@
+import os
 from threading import Event
+from concurrent.futures import Future
+from typing import Any, Callable, Iterable, Iterator, List, Union
 
 from .cmdy_plugin import PluginFactory
 from .cmdy_plugins import register_plugins
@@ -8,11 +11,28 @@ from .cmdy_exceptions import (
     CmdyExecNotFoundError,
     CmdyReturnCodeError,
 )
-from .cmdy_defaults import STDIN, STDOUT, STDERR, DEVNULL
+from .cmdy_defaults import (
+    STDIN,
+    STDOUT,
+    STDERR,
+    BOTH,
+    DEVNULL,
+    PARTITION_CHUNK_SIZE,
+)
 from .cmdy_plugin import pluginable
 from .cmdy_result import CmdyResult, CmdyAsyncResult
-from .cmdy_utils import new_class
+from .cmdy_utils import new_class, will
 from .cmdy import Cmdy, CmdyHolding
+from .cmdy_pipeline import CmdyPipeline
+from .cmdy_background import CmdyFuture, as_completed, wait_all
+from .cmdy_fanout import CmdyFanout, CmdyPartition
+from .cmdy_pipepart import CmdyPipepart
+from .cmdy_interleave import CmdyInterleave
+from .cmdy_map import CmdyMap
+from .cmdy_merge import CmdyMerge
+from .cmdy_pystage import CmdyPyStage
+from .cmdy_plan import CmdyPlan
+from .cmdy_prepare import CmdyPrepared, CmdySlot
 
 
 class Bakeable:
@@ -28,9 +48,21 @@ class Bakeable:
             new_class(CmdyHolding, data={"__module__": "cmdy"})
         )
         self.Cmdy = Cmdy
+        self.CmdyPipeline = CmdyPipeline
+        self.CmdyFanout = CmdyFanout
+        self.CmdyFuture = CmdyFuture
+        self.CmdyPartition = CmdyPartition
+        self.CmdyPipepart = CmdyPipepart
+        self.CmdyInterleave = CmdyInterleave
+        self.CmdyMap = CmdyMap
+        self.CmdyMerge = CmdyMerge
+        self.CmdyPlan = CmdyPlan
+        self.CmdyPrepared = CmdyPrepared
+        self.CmdySlot = CmdySlot
         self.STDIN = STDIN
         self.STDOUT = STDOUT
         self.STDERR = STDERR
+        self.BOTH = BOTH
         self.DEVNULL = DEVNULL
         self._event = Event()
         self._baking_args = baking_args
@@ -38,18 +70,368 @@ class Bakeable:
         self._holding_right = []
         self._holding_finals = []
         self._result_finals = []
-        # init plugins
-        self._plugin_factory = PluginFactory(self)
-        self._plugins = register_plugins(self)
         self.CmdyAsyncResult = new_class(
             self.CmdyResult,
             "CmdyAsyncResult",
             {"__module__": "cmdy", **CmdyAsyncResult.__dict__},
         )
+        self.CmdyPyStage = new_class(
+            self.CmdyHolding,
+            "CmdyPyStage",
+            {"__module__": "cmdy", **CmdyPyStage.__dict__},
+        )
+        # init plugins, they are vendored on first use
+        self._plugin_factory = PluginFactory(self)
+        self._plugins = register_plugins(self)
 
     def __call__(self, **baking_args):
         return self.__class__(**baking_args)
 
+    def plan(self, cmd: Union[str, Cmdy], *args, **kwargs) -> CmdyPlan:
+        """Create an explicit execution plan of a command
+
+        Args:
+            cmd: The command or the name of it
+            *args: The non-keyword arguments for the command
+            **kwargs: The keyword arguments for the command
+
+        Returns:
+            The plan to be run by `plan.run()`
+        """
+        if isinstance(cmd, str):
+            cmd = self.Cmdy(cmd, bakeable=self)
+        return self.CmdyPlan(cmd, args, kwargs)
+
+    def prepare(
+        self, cmd: Union[str, Cmdy], *args, **kwargs
+    ) -> CmdyPrepared:
+        """Prepare a command to run many times with different values
+
+        Args:
+            cmd: The command or the name of it
+            *args: The non-keyword arguments for the command, could have
+                slots (`cmdy.slot(name)`)
+            **kwargs: The keyword arguments for the command, could have
+                slots as values
+
+        Returns:
+            The prepared command to be run by `prepared.run(**values)`
+        """
+        if isinstance(cmd, str):
+            cmd = self.Cmdy(cmd, bakeable=self)
+        return self.CmdyPrepared(cmd, args, kwargs)
+
+    def slot(self, name: str) -> CmdySlot:
+        """Create a slot for a prepared command
+
+        Args:
+            name: The name of the slot
+
+        Returns:
+            The slot, filled by the value passed by the name when the
+            prepared command runs
+        """
+        return self.CmdySlot(name)
+
+    def pystage(
+        self, func: Callable, lines: bool = True, **kwargs
+    ) -> CmdyHolding:
+        """Run a Python function as a stage of a pipeline
+
+        Example:
+            ```python
+            c = (
+                cmdy.cat("a.txt").p()
+                | cmdy.pystage(str.upper).p()
+                | cmdy.sort()
+            )
+            c.piped_strcmds == ["cat a.txt", "pystage str.upper", "sort"]
+            ```
+
+        Args:
+            func: The function called with each line (or chunk) from the
+                stdin, returning the data for the stdout, or None to drop
+                it. It runs in a thread.
+            lines: Whether to call the function with lines or chunks
+            **kwargs: The configs of the stage (i.e. `cmdy_encoding`)
+
+        Returns:
+            The stage, holding or running like a command
+        """
+        cmd = self.Cmdy("pystage", bakeable=self)
+        ready = cmd._compose(
+            (getattr(func, "__qualname__", None) or repr(func),), kwargs
+        )
+        ready.func = func
+        ready.lines = lines
+        return self.CmdyPyStage(cmd._with_exe(ready), self, will())
+
+    def fanout(self, *holdings: CmdyHolding) -> CmdyFanout:
+        """Fan out the output of a command to several commands
+
+        Example:
+            ```python
+            fan = cmdy.seq(10).p() | cmdy.fanout(cmdy.head(n=1), cmdy.wc())
+            fan[0].stdout == "1\\n"
+            ```
+
+        Args:
+            *holdings: The commands to get the output as their stdin,
+                holding while the piping is unconsumed
+
+        Returns:
+            The fan-out to pipe the command to
+        """
+        return self.CmdyFanout(*holdings)
+
+    def partition(
+        self,
+        producer: Union[CmdyHolding, CmdyPlan],
+        worker: Union[CmdyPlan, CmdyPrepared],
+        n: int = None,
+        by: Callable = None,
+        chunk_size: int = PARTITION_CHUNK_SIZE,
+    ) -> CmdyPartition:
+        """Split the output of a command across parallel workers
+
+        Example:
+            ```python
+            part = cmdy.partition(
+                cmdy.plan(cmdy.cat, "big.tsv"),
+                cmdy.plan(cmdy.awk, "$3 > 10"),
+                n=4,
+            ).run()
+            part.stdout  # the outputs of the workers concatenated
+            ```
+
+        Args:
+            producer: The plan or the holding object of the producer
+            worker: The plan or the prepared command of the workers
+            n: The number of the workers, defaults to the number of CPUs
+            by: A function taking a line (bytes, without the newline) and
+                returning its key, the lines with the same key go to the
+                same worker. The chunks go to the workers in turn if None.
+            chunk_size: The size of the chunks to split
+
+        Returns:
+            The partition to run by `run()`
+        """
+        return self.CmdyPartition(
+            producer,
+            worker,
+            (os.cpu_count() or 1) if n is None else n,
+            by,
+            chunk_size,
+        )
+
+    def pipepart(
+        self,
+        path: Union[str, os.PathLike],
+        worker: Union[CmdyPlan, CmdyPrepared],
+        jobs: int = None,
+        block_size: int = PARTITION_CHUNK_SIZE,
+    ) -> CmdyPipepart:
+        """Split a file into blocks on line boundaries, and feed each of
+        them to a copy of a command, like `parallel --pipepart`
+
+        Example:
+            ```python
+            part = cmdy.pipepart("big.txt", cmdy.plan(cmdy.wc, l=True))
+            for result in part:  # in the order of the blocks
+                print(result.stdout)
+            ```
+
+        Args:
+            path: The path of the file
+            worker: The plan or the prepared command to feed the blocks to
+            jobs: The max number of the commands running at a time,
+                defaults to the number of CPUs
+            block_size: The size of the blocks
+
+        Returns:
+            The blocks to iterate over the results, or `run()`
+        """
+        return self.CmdyPipepart(
+            path,
+            worker,
+            (os.cpu_count() or 1) if jobs is None else jobs,
+            block_size,
+        )
+
+    def map(
+        self,
+        cmd: Union[str, Cmdy, CmdyPrepared],
+        items: Iterable[Any],
+        jobs: int = None,
+        ordered: bool = True,
+        fail_fast: bool = True,
+        progress: Callable[[int, int], Any] = None,
+    ) -> CmdyMap:
+        """Run a command for each of the items, at most `jobs` at a time
+
+        Example:
+            ```python
+            for result in cmdy.map(cmdy.gzip, files, jobs=8):
+                print(result.rc)
+
+            view = cmdy.prepare(cmdy.samtools.view, cmdy.slot("bam"), c=True)
+            counts = [
+                int(result.stdout)
+                for result in cmdy.map(view, ({"bam": bam} for bam in bams))
+            ]
+            ```
+
+        Args:
+            cmd: A prepared command, run with each item as the values of
+                its slots, or a command (or the name of it), run with each
+                item as its arguments (a tuple, a dict of the keyword
+                arguments or a single argument)
+            items: The items to run the command with
+            jobs: The max number of the commands running at a time,
+                defaults to the number of CPUs
+            ordered: Whether to get the results in the order of the items,
+                otherwise as the commands finish
+            fail_fast: Whether to raise at the first failing command and
+                stop the others, otherwise to collect the failing results
+                in `failed`
+            progress: A function called with the number of the commands
+                finished and the number of the items (None if unknown)
+
+        Returns:
+            The map to iterate over the results, or `run()`
+        """
+        if isinstance(cmd, str):
+            cmd = self.Cmdy(cmd, bakeable=self)
+        return self.CmdyMap(
+            cmd,
+            items,
+            (os.cpu_count() or 1) if jobs is None else jobs,
+            ordered,
+            fail_fast,
+            progress,
+        )
+
+    def amap(
+        self,
+        cmd: Union[str, Cmdy, CmdyPrepared],
+        items: Iterable[Any],
+        jobs: int = None,
+        ordered: bool = True,
+        fail_fast: bool = True,
+        progress: Callable[[int, int], Any] = None,
+    ) -> CmdyMap:
+        """The async version of `map()`, with the commands waited in curio
+        tasks
+
+        Example:
+            ```python
+            async for result in cmdy.amap(cmdy.gzip, files, jobs=8):
+                print(await result.rc)
+            # or
+            results = await cmdy.amap(cmdy.gzip, files, jobs=8).arun()
+            ```
+
+        Returns:
+            The map to iterate over the results with `async for`, or
+            `await arun()`
+        """
+        amap = self.map(cmd, items, jobs, ordered, fail_fast, progress)
+        amap.is_async = True
+        return amap
+
+    def wait_all(
+        self, futures: Iterable[Future], timeout: float = None
+    ) -> List[CmdyResult]:
+        """Wait for all the commands running in background
+
+        Example:
+            ```python
+            futures = [cmdy.gzip(file).bg() for file in files]
+            results = cmdy.wait_all(futures, timeout=60)
+            ```
+
+        Args:
+            futures: The futures of the commands (`.bg()`)
+            timeout: The max seconds to wait, None to wait forever
+
+        Returns:
+            The results of the commands, in the order of the futures
+        """
+        return wait_all(futures, timeout)
+
+    def as_completed(
+        self, futures: Iterable[Future], timeout: float = None
+    ) -> Iterator[Future]:
+        """Yield the futures of the commands running in background as they
+        finish
+
+        Example:
+            ```python
+            futures = [cmdy.gzip(file).bg() for file in files]
+            for future in cmdy.as_completed(futures):
+                print(future.result().rc)
+            ```
+
+        Args:
+            futures: The futures of the commands (`.bg()`)
+            timeout: The max seconds to wait, None to wait forever
+        """
+        return as_completed(futures, timeout)
+
+    def merge_sorted(
+        self,
+        results: List[Union[CmdyResult, CmdyHolding, CmdyPlan]],
+        key: Callable = None,
+        reverse: bool = False,
+    ) -> CmdyMerge:
+        """Merge the sorted outputs of several commands as they come
+
+        Example:
+            ```python
+            merged = cmdy.merge_sorted(
+                [cmdy.plan(cmdy.sort, "a.txt"), cmdy.plan(cmdy.sort, "b.txt")]
+            )
+            for line in merged:
+                print(line, end="")
+            # or as the stdin of another command
+            cmdy.uniq().r(STDIN) < merged
+            ```
+
+        Args:
+            results: The commands, results not waited yet, holding
+                objects or plans, which are run
+            key: The function to get the key of a line to compare
+            reverse: Whether the outputs are sorted in descending order
+
+        Returns:
+            The merged lines to iterate over or to redirect from
+        """
+        return self.CmdyMerge(results, key, reverse)
+
+    def interleave(
+        self,
+        results: List[Union[CmdyResult, CmdyHolding, CmdyPlan]],
+        which: int = STDOUT,
+    ) -> CmdyInterleave:
+        """Iterate over the lines of many running commands as they come
+
+        Example:
+            ```python
+            results = [cmdy.tail(f=log).h() for log in logs]
+            for result, which, line in cmdy.interleave(results, BOTH):
+                print(result.pid, line, end="")
+            ```
+
+        Args:
+            results: The commands, results not waited yet, holding
+                objects or plans, which are run
+            which: The outputs to iterate over, STDOUT, STDERR or BOTH
+
+        Returns:
+            The `(result, which, line)` tuples to iterate over
+        """
+        return self.CmdyInterleave(results, which)
+
     def __getattr__(self, name: str):
         if name.startswith("__"):
             try:
@@ -1,10 +1,16 @@
-import inspect
+"""Defaults of cmdy
+
+Third-party and heavy modules are imported on first use across cmdy,
+to keep `import cmdy` fast.
+"""
+import os
+import time
 from os import devnull
 from functools import lru_cache
-from subprocess import Popen
+from threading import Lock
+from typing import List, Tuple
 
 from diot import Diot
-from simpleconf import ProfileConfig
 
 _DEFAULT_CONFIG = Diot(
     {
@@ -13,7 +19,10 @@ _DEFAULT_CONFIG = Diot(
         "dupkey": False,
         "exe": None,
         "encoding": "utf-8",
+        "engine": "sync",
         "okcode": [0],
+        "pipefail": True,
+        "pipe_size": 0,
         "prefix": "auto",
         "raise": True,
         "sep": " ",
@@ -23,21 +32,161 @@ _DEFAULT_CONFIG = Diot(
     }
 )
 
+# Size of the chunks read from the pipes at a time
+READ_SIZE = 65536
+
+# Number of chunks buffered for each sink of a tee
+TEE_QUEUE_SIZE = 16
+
+# Size of the chunks to split between the workers of a partition
+PARTITION_CHUNK_SIZE = 1 << 20
+
+# Seconds between the polls of the background processes that can't be
+# waited with a pidfd
+REAP_INTERVAL = 0.01
+
+# Number of the resolved configurations of the commands kept, the least
+# recently used ones are dropped, as every baking brings new ones
+CONFIG_CACHE_SIZE = 128
+
+# Engines to wait for the processes and read from their pipes, in sync mode
+ENGINES = ("sync", "curio")
+
 STDIN = -7
 STDOUT = -2
 STDERR = -8
+# Both the stdout and the stderr, to iterate over
+BOTH = -9
 DEVNULL = devnull
 
-# Sometimes we may occasionally use envs instead env
-POPEN_ARG_KEYS = inspect.getfullargspec(Popen).args + ["envs"]
-
 
 @lru_cache()
+def get_popen_arg_keys() -> List[str]:
+    """Get the names of the arguments of Popen"""
+    import inspect
+    from subprocess import Popen
+
+    # Sometimes we may occasionally use envs instead env
+    return inspect.getfullargspec(Popen).args + ["envs"]
+
+
+def __getattr__(name: str):
+    # POPEN_ARG_KEYS is computed on first access
+    if name == "POPEN_ARG_KEYS":
+        return get_popen_arg_keys()
+    raise AttributeError(name)
+
+
+CONFIG_FILES = ("~/.cmdy.toml", "./.cmdy.toml")
+# Environment variables with this prefix are loaded by CMDY.osenv
+CONFIG_ENV_PREFIX = "CMDY_"
+# The configuration sources are checked for changes at most once
+# in this number of seconds
+CONFIG_CHECK_INTERVAL = 1.0
+
+
+class ConfigSnapshot:
+    """A versioned snapshot of the configurations
+
+    The configurations are loaded from the default ones, the configuration
+    files and the environment variables. They are loaded again when the
+    files (mtime, inode or size) or the environment variables change,
+    which is checked at most once per `interval` seconds. Each loading
+    increases the generation, which the caches of the resolved
+    configurations can be keyed on.
+
+    Attributes:
+        config: The loaded configurations
+        generation: The generation of the configurations
+        interval: The interval in seconds to check the sources
+    """
+
+    def __init__(self, interval: float = CONFIG_CHECK_INTERVAL):
+        self.config = None
+        self.generation = 0
+        self.interval = interval
+        self._stamp = None
+        self._checked = 0.0
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"<ConfigSnapshot: generation={self.generation}>"
+
+    @staticmethod
+    def stamp() -> Tuple:
+        """Get the stamp of the configuration sources
+
+        Returns:
+            The (path, mtime, inode, size) of the configuration files,
+            with None for the missing ones, and the environment variables
+            for cmdy
+        """
+        files = []
+        for path in CONFIG_FILES:
+            path = os.path.abspath(os.path.expanduser(path))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                files.append((path, None))
+            else:
+                files.append(
+                    (path, stat.st_mtime_ns, stat.st_ino, stat.st_size)
+                )
+        envs = sorted(
+            (key, value)
+            for key, value in os.environ.items()
+            if key.startswith(CONFIG_ENV_PREFIX)
+        )
+        return tuple(files), tuple(envs)
+
+    def get(self) -> Diot:
+        """Get the configurations, loading them again if changed"""
+        now = time.monotonic()
+        if self.config is not None and now - self._checked < self.interval:
+            return self.config
+
+        with self._lock:
+            self._checked = now
+            stamp = self.stamp()
+            if self.config is None or stamp != self._stamp:
+                self.config = self.load()
+                self._stamp = stamp
+                self.generation += 1
+        return self.config
+
+    @staticmethod
+    def load() -> Diot:
+        """Load the configurations from the sources"""
+        from simpleconf import ProfileConfig
+
+        return ProfileConfig.load(
+            {"default": _DEFAULT_CONFIG},
+            *CONFIG_FILES,
+            f"{CONFIG_ENV_PREFIX[:-1]}.osenv",
+            ignore_nonexist=True,
+        )
+
+    def invalidate(self):
+        """Load the configurations again on next access"""
+        self.config = None
+
+
+CONFIG_SNAPSHOT = ConfigSnapshot()
+
+
 def get_config() -> Diot:
-    return ProfileConfig.load(
-        {"default": _DEFAULT_CONFIG},
-        "~/.cmdy.toml",
-        "./.cmdy.toml",
-        "CMDY.osenv",
-        ignore_nonexist=True,
-    )
+    """Get the configurations, see ConfigSnapshot"""
+    return CONFIG_SNAPSHOT.get()
+
+
+# compatible with the lru_cache'd get_config
+get_config.cache_clear = CONFIG_SNAPSHOT.invalidate
+
+
+def config_generation() -> int:
+    """Get the generation of the configurations
+
+    The sources are checked for changes if needed.
+    """
+    CONFIG_SNAPSHOT.get()
+    return CONFIG_SNAPSHOT.generation
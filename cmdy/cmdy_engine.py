@@ -0,0 +1,1696 @@
+"""Engines to wait for the processes and read from their pipes synchronously
+
+The `curio` engine runs a curio kernel for each wait and each line read.
+The `sync` engine uses selectors on the non-blocking pipes and
+`Popen.wait(timeout)` instead, without any event loop.
+"""
+import errno
+import io
+import os
+import selectors
+import subprocess
+import sys
+from codecs import getincrementaldecoder
+from collections import deque
+from functools import lru_cache
+from queue import Queue
+from threading import Lock, Thread
+from time import monotonic
+from typing import (
+    IO,
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    List,
+    Tuple,
+    Union,
+)
+
+from .cmdy_defaults import (
+    PARTITION_CHUNK_SIZE,
+    READ_SIZE,
+    REAP_INTERVAL,
+    STDERR,
+    STDOUT,
+    TEE_QUEUE_SIZE,
+)
+from .cmdy_exceptions import CmdyTimeoutError
+from .cmdy_utils import (
+    LineBatches,
+    SyncStreamFromAsync,
+    read_size,
+    split_lines,
+)
+
+if TYPE_CHECKING:
+    import curio
+    from curio.subprocess import Popen
+
+# Zeros to grow the buffers before reading into them
+_ZEROS = memoryview(bytes(1 << 24))
+
+
+class SelectorStream(LineBatches):
+    """Read lines from a pipe synchronously, using a selector
+
+    The pipe is a curio FileStream (`proc.stdout`) in non-blocking mode.
+    Its buffer is shared, so that the stream can be read by curio
+    afterwards (i.e. in async mode).
+
+    Args:
+        stream: The curio FileStream
+        encoding: The encoding to decode the lines, bytes returned if None
+    """
+
+    def __init__(self, stream: "curio.io.FileStream", encoding: str = None):
+        self.stream = stream
+        self.encoding = encoding
+        self.fd = stream.fileno()
+        self.eof = False
+        self._buffer = getattr(stream, "_buffer", bytearray())
+        # where to start looking for the next newline
+        self._scanned = 0
+        self._selector = None
+        self._lines = []
+        self.read_size = read_size(self.fd)
+
+    def __repr__(self):
+        return f"<SelectorStream: fd={self.fd}>"
+
+    def _fill(self, timeout: float = None) -> bool:
+        """Read a chunk from the pipe into the buffer
+
+        Args:
+            timeout: The timeout in seconds, None to block
+
+        Returns:
+            False if nothing available after timeout, otherwise True
+        """
+        try:
+            nread = read_into(self.fd, self._buffer, self.read_size)
+        except BlockingIOError:
+            if self._selector is None:
+                self._selector = selectors.DefaultSelector()
+                self._selector.register(self.fd, selectors.EVENT_READ)
+            if not self._selector.select(timeout):
+                return False
+            try:
+                nread = read_into(self.fd, self._buffer, self.read_size)
+            except BlockingIOError:  # pragma: no cover
+                return True
+
+        if not nread:
+            self.eof = True
+            self.close()
+        return True
+
+    def _decode(self, data: bytes) -> Union[str, bytes]:
+        return data.decode(self.encoding) if self.encoding else data
+
+    def next(self, timeout: float = None) -> Union[str, bytes]:
+        """Fetch the next line within given timeout
+        If nothing produced after the timeout, returns empty str or bytes
+        """
+        if self._lines:
+            return self._lines.pop(0)
+        deadline = None if not timeout else monotonic() + timeout
+        buffer = self._buffer
+        while True:
+            index = buffer.find(b"\n", self._scanned)
+            if index >= 0:
+                line = bytes(buffer[: index + 1])
+                del buffer[: index + 1]
+                self._scanned = 0
+                return self._decode(line)
+            self._scanned = len(buffer)
+
+            if self.eof:
+                if not buffer:
+                    raise StopIteration()
+                line = bytes(buffer)
+                buffer.clear()
+                self._scanned = 0
+                return self._decode(line)
+
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not self._fill(remaining):
+                    return "" if self.encoding else b""
+            else:
+                self._fill()
+
+    def __next__(self):
+        return self.next()  # pylint: disable=not-callable
+
+    def __iter__(self):
+        return self
+
+    def dump(self) -> Union[str, bytes]:
+        """Dump all the rest as a string or bytes"""
+        while not self.eof:
+            self._fill()
+        data = self._decode(bytes(self._buffer))
+        self._buffer.clear()
+        self._scanned = 0
+        if self._lines:
+            data = data[:0].join(self._lines) + data
+            self._lines = []
+        return data
+
+    def close(self):
+        """Close the selector"""
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+
+class TaggedStreams:
+    """Read lines from the stdout and the stderr pipes of a process at once,
+    tagged with STDOUT or STDERR, using a selector
+
+    Both pipes are read as the data comes, each into its own buffer (the
+    one of the curio FileStream), so the lines come in the order they are
+    produced, as far as the pipes can tell, and are never cut.
+
+    Args:
+        stdout: The stdout pipe, a curio FileStream
+        stderr: The stderr pipe, a curio FileStream
+        encoding: The encoding to decode the lines, bytes returned if None
+    """
+
+    def __init__(
+        self,
+        stdout: "curio.io.FileStream",
+        stderr: "curio.io.FileStream",
+        encoding: str = None,
+    ):
+        self.streams = {STDOUT: stdout, STDERR: stderr}
+        self.encoding = encoding
+        self.eof = set()
+        # the (which, lines) split but not fetched yet
+        self._chunks: "deque[Tuple[int, deque]]" = deque()
+        self._sizes = {}
+        self._selector = selectors.DefaultSelector()
+        for which, stream in self.streams.items():
+            fd = stream.fileno()
+            self._sizes[which] = read_size(fd)
+            self._selector.register(fd, selectors.EVENT_READ, which)
+
+    def __repr__(self):
+        fds = [stream.fileno() for stream in self.streams.values()]
+        return f"<TaggedStreams: fds={fds}>"
+
+    def _fill(self, timeout: float = None) -> bool:
+        """Read the chunks from the pipes ready into the buffers
+
+        Returns:
+            False if nothing available after timeout, otherwise True
+        """
+        events = self._selector.select(timeout)
+        if not events:
+            return False
+        for key, _ in events:
+            stream = self.streams[key.data]
+            try:
+                nread = read_into(
+                    key.fd, stream._buffer, self._sizes[key.data]
+                )
+            except BlockingIOError:  # pragma: no cover
+                continue
+            if not nread:
+                self._selector.unregister(key.fd)
+                self.eof.add(key.data)
+        if len(self.eof) == len(self.streams):
+            self.close()
+        return True
+
+    def _split(self, timeout: float, chunk_bytes: int):
+        """Read and split the lines into the chunks
+
+        A timeout of 0 only takes what the pipes have already, None waits
+        until a complete line comes.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            for which, stream in self.streams.items():
+                lines = split_lines(
+                    stream._buffer,
+                    self.encoding,
+                    chunk_bytes,
+                    which in self.eof,
+                )
+                if lines:
+                    self._chunks.append((which, deque(lines)))
+            if self._chunks:
+                return
+            if len(self.eof) == len(self.streams):
+                raise StopIteration()
+
+            if deadline is None:
+                self._fill()
+            elif not self._fill(max(deadline - monotonic(), 0)):
+                return
+
+    def next(
+        self, timeout: float = None
+    ) -> Tuple[int, Union[str, bytes]]:
+        """Fetch the next line within the given timeout
+
+        Returns:
+            The (which, line), None if nothing produced after the timeout
+        """
+        if not self._chunks:
+            self._split(timeout, None)
+            if not self._chunks:
+                return None
+        which, lines = self._chunks[0]
+        line = lines.popleft()
+        if not lines:
+            self._chunks.popleft()
+        return which, line
+
+    def next_lines(
+        self,
+        timeout: float = None,
+        batch: int = None,
+        chunk_bytes: int = None,
+    ) -> Tuple[int, List[Union[str, bytes]]]:
+        """Fetch the next lines of the same pipe within the given timeout
+
+        Args:
+            timeout: The timeout in seconds to wait for a complete line
+            batch: Fetch at most this number of lines
+            chunk_bytes: Split at most this number of bytes at a time
+
+        Returns:
+            The (which, lines), None if nothing produced after the timeout
+
+        Raises:
+            StopIteration: When all lines are fetched
+        """
+        if not self._chunks:
+            self._split(timeout, chunk_bytes)
+            if not self._chunks:
+                return None
+        which, lines = self._chunks[0]
+        if not batch or len(lines) <= batch:
+            self._chunks.popleft()
+            return which, list(lines)
+        return which, [lines.popleft() for _ in range(batch)]
+
+    def __next__(self):
+        return self.next()  # pylint: disable=not-callable
+
+    def __iter__(self):
+        return self
+
+    def close(self):
+        """Close the selector"""
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+
+
+def read_into(fd: int, buffer: bytearray, size: int) -> int:
+    """Read from the fd and append the data to the buffer directly, without
+    an intermediate bytes object
+
+    Args:
+        fd: The file descriptor
+        buffer: The buffer
+        size: The max number of bytes to read
+
+    Returns:
+        The number of bytes read, 0 on EOF
+
+    Raises:
+        BlockingIOError: When nothing available
+    """
+    start = len(buffer)
+    # grown in place, amortized by the over-allocation of bytearray
+    buffer.extend(_ZEROS[:size])
+    end = start
+    try:
+        with memoryview(buffer) as view, view[start:] as free:
+            end += os.readv(fd, [free])
+    finally:
+        del buffer[end:]
+    return end - start
+
+
+def read_all(stream: "curio.io.FileStream") -> bytearray:
+    """Read all the rest of the pipe into a bytearray, without an event loop
+
+    The buffer of the stream is taken over, and the data is read into it
+    directly by large `readv` calls.
+
+    Args:
+        stream: The curio FileStream
+
+    Returns:
+        The data
+    """
+    fd = stream.fileno()
+    data, stream._buffer = stream._buffer, bytearray()
+    size = read_size(fd)
+    selector = None
+    try:
+        while True:
+            try:
+                if not read_into(fd, data, size):
+                    return data
+            except BlockingIOError:
+                if selector is None:
+                    selector = selectors.DefaultSelector()
+                    selector.register(fd, selectors.EVENT_READ)
+                selector.select()
+    finally:
+        if selector is not None:
+            selector.close()
+
+
+def capture(stream: "curio.io.FileStream", engine: str) -> bytearray:
+    """Capture all the rest of the pipe with the engine
+
+    Args:
+        stream: The curio FileStream
+        engine: The engine, sync or curio
+
+    Returns:
+        The data
+    """
+    if engine == "sync":
+        return read_all(stream)
+
+    import curio
+
+    return curio.run(read_all_async(stream))
+
+
+async def read_all_async(stream: "curio.io.FileStream") -> bytearray:
+    """Read all the rest of the pipe into a bytearray in curio
+
+    See read_all for the arguments
+    """
+    data, stream._buffer = stream._buffer, bytearray()
+    size = read_size(stream.fileno())
+    while True:
+        chunk = await stream._read(size)
+        if not chunk:
+            return data
+        data.extend(chunk)
+
+
+@lru_cache()
+def _libc_tee() -> Callable:
+    """Get tee(2) from libc, which is not exposed by the os module
+
+    Returns:
+        The function, None if not available
+    """
+    try:
+        import ctypes
+
+        tee = ctypes.CDLL(None, use_errno=True).tee
+    except (ImportError, OSError, AttributeError):  # pragma: no cover
+        return None
+    tee.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_size_t, ctypes.c_uint]
+    tee.restype = ctypes.c_ssize_t
+    return tee
+
+
+def tee(src: int, dest: int, size: int) -> int:
+    """Duplicate the data in the pipe src to the pipe dest, without
+    consuming it, with tee(2)
+
+    Args:
+        src: The pipe to duplicate the data from
+        dest: The pipe to duplicate the data to
+        size: The max number of bytes to duplicate
+
+    Returns:
+        The number of bytes duplicated, 0 on EOF
+
+    Raises:
+        OSError: When failed or tee(2) not available
+    """
+    libc_tee = _libc_tee()
+    if libc_tee is None:  # pragma: no cover
+        raise OSError(errno.ENOSYS, "tee(2) is not available.")
+    import ctypes
+
+    while True:
+        ret = libc_tee(src, dest, size, 0)
+        if ret >= 0:
+            return ret
+        err = ctypes.get_errno()
+        if err != errno.EINTR:  # pragma: no cover
+            raise OSError(err, os.strerror(err))
+
+
+def write_all(fd: int, data: bytes):
+    """Write all the data to a blocking fd"""
+    written = 0
+    while written < len(data):
+        written += os.write(fd, data[written:])
+
+
+def _read_exactly(fd: int, size: int) -> bytes:
+    """Read exactly size bytes from a blocking fd, less only on EOF"""
+    chunks = []
+    while size:
+        data = os.read(fd, size)
+        if not data:
+            break
+        chunks.append(data)
+        size -= len(data)
+    return b"".join(chunks)
+
+
+class PipeRelay:
+    """Move the data from a pipe of a process to a file in a thread, with
+    a copy of it put into a capture pipe
+
+    The data is moved by splice(2) and duplicated by tee(2) in the kernel,
+    so that it never goes through the buffers of Python. Where they are
+    not available or not supported (i.e. for a file opened for appending),
+    the data is read and written in chunks instead.
+
+    The capture pipe gets an EOF when the data has all been moved. A slow
+    reader of it slows down the process, instead of the data piling up.
+
+    Args:
+        src: The pipe (curio FileStream) to move the data from
+        dest: The file object to move the data to
+        closing: Whether to close the file when closing the relay
+    """
+
+    def __init__(
+        self, src: "curio.io.FileStream", dest: IO, closing: bool = False
+    ):
+        from curio.io import FileStream
+
+        self.src = src
+        self.dest = dest
+        self.closing = closing
+        read_end, self._capture_w = os.pipe()
+        # the read end of the capture pipe
+        self.capture = FileStream(open(read_end, "rb", buffering=0))
+        self.error = None
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __repr__(self):
+        return f"<PipeRelay: {self.src.fileno()} -> {self.dest}>"
+
+    def start(self) -> "PipeRelay":
+        """Start moving the data"""
+        if hasattr(self.dest, "flush"):
+            self.dest.flush()
+        os.set_blocking(self.src.fileno(), True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        src, dest = self.src.fileno(), self.dest.fileno()
+        size = read_size(src)
+        try:
+            if not hasattr(os, "splice") or not self._splice(src, dest, size):
+                self._copy(src, dest, size)
+        except OSError as exc:  # pragma: no cover
+            # i.e. the disk is full, raised when closing
+            self.error = exc
+        finally:
+            os.close(self._capture_w)
+
+    def _splice(self, src: int, dest: int, size: int) -> bool:
+        """Move the data by splice(2) and tee(2)
+
+        Returns:
+            False if they are not supported and the rest of the data
+            should be copied
+        """
+        while True:
+            try:
+                left = tee(src, self._capture_w, size)
+            except OSError as exc:
+                if exc.errno in (errno.EINVAL, errno.ENOSYS):
+                    return False
+                raise  # pragma: no cover
+            if not left:
+                return True
+            while left:
+                try:
+                    left -= os.splice(src, dest, left)
+                except OSError as exc:
+                    if exc.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise  # pragma: no cover
+                    # the copy of the chunk is in the capture pipe already
+                    while left:
+                        data = os.read(src, left)
+                        write_all(dest, data)
+                        left -= len(data)
+                    return False
+
+    def _copy(self, src: int, dest: int, size: int):
+        """Move the data by reading and writing in chunks"""
+        while True:
+            data = os.read(src, size)
+            if not data:
+                return
+            write_all(dest, data)
+            write_all(self._capture_w, data)
+
+    def close(self):
+        """Wait until the data has all been moved, close the pipe, and the
+        file if we should
+
+        Raises:
+            OSError: When failed to move the data
+        """
+        self._thread.join()
+        close_pipe(self.src)
+        if self.closing:
+            self.dest.close()
+        if self.error is not None:  # pragma: no cover
+            raise self.error
+
+
+class PipeTee:
+    """Read a pipe of a process once in large chunks and write them to
+    several sinks, each in a thread
+
+    Each sink has a queue of at most `queue_size` chunks, so that a slow
+    sink blocks the reading, and the process when the pipe is full, instead
+    of the data piling up. The chunks are decoded once for all the sinks.
+
+    Args:
+        src: The pipe (curio FileStream) to read from
+        sinks: The sinks, file-like objects, file paths, callables taking
+            the data, STDOUT or STDERR (sys.stdout or sys.stderr)
+        encoding: The encoding to decode the data for the sinks, except
+            the binary files, which get the bytes
+        capture: Whether to put a copy of the data into a capture pipe
+        queue_size: The max number of chunks buffered for each sink
+    """
+
+    def __init__(
+        self,
+        src: "curio.io.FileStream",
+        sinks: List[Any],
+        encoding: str = None,
+        capture: bool = False,
+        queue_size: int = TEE_QUEUE_SIZE,
+    ):
+        self.src = src
+        self.sinks = sinks
+        self.encoding = encoding
+        # the read end of the capture pipe
+        self.capture = None
+        self._capture_w = None
+        if capture:
+            from curio.io import FileStream
+
+            read_end, self._capture_w = os.pipe()
+            self.capture = FileStream(open(read_end, "rb", buffering=0))
+        self.error = None
+        # the files opened by us
+        self._files = []
+        self._queues = []
+        self._threads = [Thread(target=self._read, daemon=True)]
+        for sink in sinks:
+            queue = Queue(queue_size)
+            self._queues.append(queue)
+            self._threads.append(
+                Thread(
+                    target=self._write,
+                    args=(queue, self._writer(sink)),
+                    daemon=True,
+                )
+            )
+
+    def __repr__(self):
+        return f"<PipeTee: {self.src.fileno()} -> {self.sinks}>"
+
+    def _writer(self, sink: Any) -> Callable:
+        """Get the function to write the (bytes, str) chunks to the sink"""
+        if isinstance(sink, int) and sink in (STDOUT, STDERR):
+            sink = sys.stdout if sink == STDOUT else sys.stderr
+        elif isinstance(sink, (str, os.PathLike)):
+            sink = open(
+                sink, "w" if self.encoding else "wb", encoding=self.encoding
+            )
+            self._files.append(sink)
+
+        if not hasattr(sink, "write"):
+            return lambda raw, text: sink(raw if text is None else text)
+
+        binary = isinstance(sink, (io.RawIOBase, io.BufferedIOBase))
+        if self.encoding is None and isinstance(sink, io.TextIOBase):
+            sink, binary = sink.buffer, True
+
+        def write(raw: bytes, text: str):
+            sink.write(raw if binary or text is None else text)
+            sink.flush()
+
+        return write
+
+    def start(self) -> "PipeTee":
+        """Start reading and writing"""
+        os.set_blocking(self.src.fileno(), True)
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def _read(self):
+        src = self.src.fileno()
+        size = read_size(src)
+        decoder = (
+            getincrementaldecoder(self.encoding)() if self.encoding else None
+        )
+        try:
+            while True:
+                raw = os.read(src, size)
+                text = decoder and decoder.decode(raw, not raw)
+                if raw or text:
+                    for queue in self._queues:
+                        queue.put((raw, text))
+                if not raw:
+                    return
+                if self._capture_w is not None:
+                    write_all(self._capture_w, raw)
+        except (OSError, UnicodeDecodeError) as exc:
+            self.error = exc
+        finally:
+            for queue in self._queues:
+                queue.put(None)
+            if self._capture_w is not None:
+                os.close(self._capture_w)
+
+    def _write(self, queue: Queue, write: Callable):
+        failed = False
+        while True:
+            chunk = queue.get()
+            if chunk is None:
+                return
+            # keep consuming after failing, not to block the others
+            if failed:
+                continue
+            try:
+                write(*chunk)
+            except Exception as exc:  # pylint: disable=broad-except
+                failed = True
+                self.error = self.error or exc
+
+    def close(self):
+        """Wait until the data has all been written, close the pipe, and
+        the files opened by us
+
+        Raises:
+            Exception: The first error raised by reading or by the sinks
+        """
+        for thread in self._threads:
+            thread.join()
+        close_pipe(self.src)
+        for file in self._files:
+            file.close()
+        if self.error is not None:
+            raise self.error
+
+
+class PipeFanout:
+    """Duplicate a pipe of a process into the stdin pipes of several
+    processes in a thread
+
+    The data is duplicated by tee(2) into the pipes and then dropped from
+    the source pipe, so that it never goes through the buffers of Python.
+    When a pipe takes only part of a chunk, or tee(2) is not available, the
+    data is read and written instead. Either way, at most a chunk is held,
+    the slowest process slows down the others and the source process.
+
+    A process exiting early (i.e. `head`) is dropped. When all of them are
+    gone, the source pipe is closed, so that the source process gets a
+    SIGPIPE, just as it does in a pipeline.
+
+    Args:
+        src: The pipe (curio FileStream) to duplicate
+        dests: The stdin pipes (curio FileStreams) of the processes
+    """
+
+    def __init__(
+        self,
+        src: "curio.io.FileStream",
+        dests: List["curio.io.FileStream"],
+    ):
+        self.src = src
+        self.dests = dests
+        self.error = None
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __repr__(self):
+        return (
+            f"<PipeFanout: {self.src.fileno()} -> "
+            f"{[dest.fileno() for dest in self.dests]}>"
+        )
+
+    def start(self) -> "PipeFanout":
+        """Start duplicating the data"""
+        for stream in (self.src, *self.dests):
+            os.set_blocking(stream.fileno(), True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        src = self.src.fileno()
+        dests = [dest.fileno() for dest in self.dests]
+        size = read_size(src)
+        zero_copy = hasattr(os, "splice") and _libc_tee() is not None
+        # to drop the chunks duplicated from the source
+        null = os.open(os.devnull, os.O_WRONLY)
+        try:
+            more = True
+            while more and dests:
+                if not zero_copy:
+                    more = self._copy_chunk(src, dests, size)
+                    continue
+                try:
+                    more = self._tee_chunk(src, dests, size, null)
+                except OSError as exc:
+                    if exc.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise  # pragma: no cover
+                    zero_copy = False
+        except OSError as exc:  # pragma: no cover
+            self.error = exc
+        finally:
+            os.close(null)
+            # EOF to the processes, SIGPIPE to the source if not finished
+            for stream in (self.src, *self.dests):
+                close_pipe(stream)
+
+    @staticmethod
+    def _tee_chunk(
+        src: int, dests: List[int], size: int, null: int
+    ) -> bool:
+        """Duplicate a chunk by tee(2), the dead pipes are removed
+
+        When tee(2) turns out not to be supported after the chunk is
+        duplicated into some of the pipes, the chunk is written to the
+        others before the error is raised, so that no pipe gets it twice.
+
+        Returns:
+            False on EOF
+
+        Raises:
+            OSError: EINVAL or ENOSYS when tee(2) is not supported, to
+                read and write the next chunks instead
+        """
+        chunk = None
+        short = {}
+        unsupported = None
+        for dest in list(dests):
+            if unsupported is not None:
+                short[dest] = 0
+                continue
+            try:
+                teed = tee(src, dest, size if chunk is None else chunk)
+            except BrokenPipeError:
+                dests.remove(dest)
+                continue
+            except OSError as exc:
+                if chunk is None or exc.errno not in (
+                    errno.EINVAL,
+                    errno.ENOSYS,
+                ):
+                    raise
+                unsupported = exc
+                short[dest] = 0
+                continue
+            if chunk is None:
+                chunk = teed
+                if not chunk:
+                    return False
+            elif teed < chunk:
+                short[dest] = teed
+
+        if chunk is None:
+            return False
+
+        if not short:
+            # drop the chunk from the source
+            left = chunk
+            while left:
+                left -= os.splice(src, null, left)
+            return True
+
+        data = _read_exactly(src, chunk)
+        for dest, teed in short.items():
+            try:
+                write_all(dest, data[teed:])
+            except BrokenPipeError:
+                dests.remove(dest)
+        if unsupported is not None:
+            raise unsupported
+        return True
+
+    @staticmethod
+    def _copy_chunk(src: int, dests: List[int], size: int) -> bool:
+        """Duplicate a chunk by reading and writing, the dead pipes are
+        removed
+
+        Returns:
+            False on EOF
+        """
+        data = os.read(src, size)
+        if not data:
+            return False
+        for dest in list(dests):
+            try:
+                write_all(dest, data)
+            except BrokenPipeError:
+                dests.remove(dest)
+        return True
+
+    def close(self):
+        """Wait until the data has all been duplicated
+
+        Raises:
+            OSError: When failed to duplicate the data
+        """
+        self._thread.join()
+        if self.error is not None:  # pragma: no cover
+            raise self.error
+
+
+class PipePartition:
+    """Split a pipe of a process into the stdin pipes of several processes
+    on line boundaries, in a thread
+
+    The data is read in chunks of about `chunk_size` bytes, cut at the last
+    newline. Without `by`, the chunks go to the processes in turn. With
+    `by`, the lines of a chunk are grouped by the hash of their keys, and
+    the groups are written to the processes at once. Writing blocks on a
+    full pipe, so at most a chunk is held.
+
+    A process exiting early is dropped, the lines for it are discarded with
+    `by`. When all of them are gone, the source pipe is closed, so that the
+    source process gets a SIGPIPE.
+
+    Args:
+        src: The pipe (curio FileStream) to split
+        dests: The stdin pipes (curio FileStreams) of the processes
+        by: A function taking a line (bytes, without the newline) and
+            returning its key, the lines with the same key go to the same
+            process
+        chunk_size: The size of the chunks to read before splitting
+    """
+
+    def __init__(
+        self,
+        src: "curio.io.FileStream",
+        dests: List["curio.io.FileStream"],
+        by: Callable = None,
+        chunk_size: int = PARTITION_CHUNK_SIZE,
+    ):
+        self.src = src
+        self.dests = dests
+        self.by = by
+        self.chunk_size = chunk_size
+        self.error = None
+        # the fds of the processes still running
+        self._alive = []
+        self._turn = 0
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __repr__(self):
+        return (
+            f"<PipePartition: {self.src.fileno()} -> "
+            f"{[dest.fileno() for dest in self.dests]}>"
+        )
+
+    def start(self) -> "PipePartition":
+        """Start splitting the data"""
+        for stream in (self.src, *self.dests):
+            os.set_blocking(stream.fileno(), True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        src = self.src.fileno()
+        size = read_size(src)
+        self._alive = [dest.fileno() for dest in self.dests]
+        buffer = bytearray()
+        try:
+            while self._alive:
+                data = os.read(src, size)
+                buffer += data
+                while buffer and (len(buffer) >= self.chunk_size or not data):
+                    cut = self._cut(buffer, bool(data))
+                    if not cut:
+                        break
+                    chunk = bytes(buffer[:cut])
+                    del buffer[:cut]
+                    if self.by is None:
+                        self._deal(chunk)
+                    else:
+                        self._group(chunk)
+                if not data:
+                    return
+        except Exception as exc:  # pylint: disable=broad-except
+            # i.e. raised by `by`
+            self.error = exc
+        finally:
+            # EOF to the processes, SIGPIPE to the source if not finished
+            for stream in (self.src, *self.dests):
+                close_pipe(stream)
+
+    def _cut(self, buffer: bytearray, more: bool) -> int:
+        """Find where to cut the next chunk, after a newline
+
+        Args:
+            buffer: The data read
+            more: Whether more data is coming, otherwise the rest of the
+                data is taken if no newline found
+
+        Returns:
+            The size of the chunk, 0 if a line is not complete yet
+        """
+        if not more and len(buffer) <= self.chunk_size:
+            return len(buffer)
+        cut = buffer.rfind(b"\n", 0, self.chunk_size) + 1
+        # a line longer than the chunk size
+        cut = cut or buffer.find(b"\n", self.chunk_size) + 1
+        return cut or (0 if more else len(buffer))
+
+    def _write(self, dest: int, data: bytes):
+        """Write the data to a process, dropped if exited"""
+        if dest not in self._alive:
+            return
+        try:
+            write_all(dest, data)
+        except BrokenPipeError:
+            self._alive.remove(dest)
+
+    def _deal(self, chunk: bytes):
+        """Write the chunk to the next process running"""
+        while self._alive:
+            self._turn %= len(self._alive)
+            dest = self._alive[self._turn]
+            self._write(dest, chunk)
+            # otherwise dropped, the next one moves here and takes the chunk
+            if dest in self._alive:
+                self._turn += 1
+                return
+
+    def _group(self, chunk: bytes):
+        """Write the lines of the chunk to the processes by their keys"""
+        count = len(self.dests)
+        groups = [[] for _ in range(count)]
+        lines = chunk.split(b"\n")
+        # empty if the chunk ends with a newline
+        last = lines.pop()
+        for line in lines:
+            groups[hash(self.by(line)) % count].append(line)
+        for i, group in enumerate(groups):
+            if group:
+                group.append(b"")
+                self._write(self.dests[i].fileno(), b"\n".join(group))
+        if last:
+            self._write(
+                self.dests[hash(self.by(last)) % count].fileno(), last
+            )
+
+    def close(self):
+        """Wait until the data has all been split
+
+        Raises:
+            Exception: When failed to split the data
+        """
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+
+class RangeFeeder:
+    """Feed a byte range of a file to the stdin pipe of a process in a
+    thread, then close the pipe
+
+    The data is sent by sendfile(2) in the kernel, or read and written
+    where it is not available. The feeding stops when the process exits
+    early.
+
+    Args:
+        dest: The stdin pipe (curio FileStream) of the process
+        fd: The fd of the file, opened for reading
+        start: The offset of the range
+        end: The end offset of the range, exclusive
+    """
+
+    def __init__(
+        self, dest: "curio.io.FileStream", fd: int, start: int, end: int
+    ):
+        self.dest = dest
+        self.fd = fd
+        self.offset = start
+        self.end = end
+        self.error = None
+        self._thread = Thread(target=self._run, daemon=True)
+
+    def __repr__(self):
+        return f"<RangeFeeder: {self.fd}[{self.offset}:{self.end}]>"
+
+    def start(self) -> "RangeFeeder":
+        """Start feeding the range"""
+        os.set_blocking(self.dest.fileno(), True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        dest = self.dest.fileno()
+        offset = self.offset
+        try:
+            if hasattr(os, "sendfile"):
+                try:
+                    while offset < self.end:
+                        sent = os.sendfile(
+                            dest, self.fd, offset, self.end - offset
+                        )
+                        if not sent:  # pragma: no cover
+                            return
+                        offset += sent
+                except OSError as exc:
+                    if exc.errno not in (errno.EINVAL, errno.ENOSYS):
+                        raise
+            size = read_size(dest)
+            while offset < self.end:
+                data = os.pread(self.fd, min(size, self.end - offset), offset)
+                if not data:  # pragma: no cover
+                    return
+                write_all(dest, data)
+                offset += len(data)
+        except BrokenPipeError:
+            pass
+        except OSError as exc:  # pragma: no cover
+            self.error = exc
+        finally:
+            close_pipe(self.dest)
+
+    def close(self):
+        """Wait until the range has been fed
+
+        Raises:
+            OSError: When failed to feed the range
+        """
+        self._thread.join()
+        if self.error is not None:  # pragma: no cover
+            raise self.error
+
+
+# The types of the streams for synchronous iteration
+SYNC_STREAMS = (SelectorStream, SyncStreamFromAsync, TaggedStreams)
+
+
+def sync_stream(
+    stream: "curio.io.FileStream", encoding: str, engine: str
+) -> Union[SelectorStream, SyncStreamFromAsync]:
+    """Get the stream to read the pipe synchronously with the engine
+
+    Args:
+        stream: The curio FileStream
+        encoding: The encoding to decode the lines
+        engine: The engine, sync or curio
+
+    Returns:
+        The stream object
+    """
+    if engine == "sync":
+        return SelectorStream(stream, encoding)
+    return SyncStreamFromAsync(stream, encoding)
+
+
+def kill_all(procs: List["Popen"]):
+    """Kill the processes not finished yet and reap them"""
+    for proc in procs:
+        if proc._popen.poll() is None:
+            proc.kill()
+            proc._popen.wait()
+
+
+def _kill(procs: List["Popen"], timeout: float):
+    """Kill the processes when the timeout is reached"""
+    kill_all(procs)
+    raise CmdyTimeoutError(f"Timeout after {timeout} seconds.") from None
+
+
+def _is_open(stream: "curio.io.FileStream") -> bool:
+    """Tell if the stream is not closed, by us or by curio"""
+    return stream._file is not None and not stream._file.closed
+
+
+def close_pipe(stream: "curio.io.FileStream"):
+    """Close our end of the pipe synchronously
+
+    For the stdin pipe, the process gets an EOF. For a pipe passed to
+    another process, only the process holds it afterwards.
+    """
+    if _is_open(stream):
+        stream._file.close()
+
+
+def feed_input(
+    stdin: "curio.io.FileStream",
+    input: bytes,  # pylint: disable=redefined-builtin
+) -> bytes:
+    """Feed the input to the stdin as much as the pipe takes now
+
+    Args:
+        stdin: The stdin pipe of the process
+        input: The data to feed
+
+    Returns:
+        The rest of the input, to be fed while waiting
+    """
+    if not input or stdin is None:
+        return input
+    try:
+        written = os.write(stdin.fileno(), input)
+    except BlockingIOError:  # pragma: no cover
+        return input
+    except BrokenPipeError:
+        close_pipe(stdin)
+        return None
+    if written == len(input):
+        close_pipe(stdin)
+        return None
+    return input[written:]
+
+
+def _poll(procs: List["Popen"], rcs: List[int], ended: List[float]):
+    """Record the return codes and the end times of the finished processes"""
+    for i, proc in enumerate(procs):
+        if rcs[i] is None:
+            rcs[i] = proc._popen.poll()
+            if rcs[i] is not None and ended is not None:
+                ended[i] = monotonic()
+
+
+def communicate_sync(
+    procs: List["Popen"],
+    streams: List["curio.io.FileStream"],
+    stdin: "curio.io.FileStream" = None,
+    timeout: float = None,
+    input: bytes = None,  # pylint: disable=redefined-builtin
+    ended: List[float] = None,
+) -> List[int]:
+    """Drain the pipes and feed the stdin concurrently until the processes
+    finish, without an event loop
+
+    The data is kept in the buffers of the streams, where the readers
+    of the streams find it afterwards. So the processes will never be
+    blocked by a full pipe while we are waiting for them.
+
+    Args:
+        procs: The curio Popen objects, i.e. the stages of a pipeline
+        streams: The pipes (curio FileStreams) to drain
+        stdin: The stdin pipe to feed and close, if any
+        timeout: The timeout in seconds, 0 or None for no timeout
+        input: The data to feed to the stdin
+        ended: A list to record the times when the processes were found
+            finished
+
+    Returns:
+        The return codes
+
+    Raises:
+        CmdyTimeoutError: When the timeout is reached. The processes are
+            killed.
+    """
+    deadline = monotonic() + timeout if timeout else None
+    rcs = [None] * len(procs)
+    sizes = {}
+    with selectors.DefaultSelector() as selector:
+        for stream in streams:
+            fd = stream.fileno()
+            sizes[fd] = read_size(fd)
+            selector.register(fd, selectors.EVENT_READ, stream)
+        if stdin is not None:
+            if input and _is_open(stdin):
+                selector.register(
+                    stdin.fileno(), selectors.EVENT_WRITE, stdin
+                )
+                input = memoryview(input)
+            else:
+                close_pipe(stdin)
+
+        while selector.get_map():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    _kill(procs, timeout)
+            for key, _ in selector.select(remaining):
+                stream = key.data
+                if stream is stdin:
+                    try:
+                        written = os.write(key.fd, input[:READ_SIZE])
+                    except BlockingIOError:  # pragma: no cover
+                        continue
+                    except BrokenPipeError:
+                        written = len(input)
+                    input = input[written:]
+                    if not input:
+                        selector.unregister(key.fd)
+                        close_pipe(stdin)
+                    continue
+
+                try:
+                    nread = read_into(key.fd, stream._buffer, sizes[key.fd])
+                except BlockingIOError:  # pragma: no cover
+                    continue
+                if not nread:
+                    selector.unregister(key.fd)
+                    # the process is likely exiting
+                    _poll(procs, rcs, ended)
+
+    for i, proc in enumerate(procs):
+        if rcs[i] is not None:
+            continue
+        remaining = None
+        if deadline is not None:
+            remaining = max(deadline - monotonic(), 1e-3)
+        try:
+            rcs[i] = proc._popen.wait(remaining)
+        except subprocess.TimeoutExpired:
+            _kill(procs, timeout)
+        if ended is not None:
+            ended[i] = monotonic()
+    return rcs
+
+
+def _pidfd(proc: "Popen") -> int:
+    """Open a pidfd of the process to wait for it with a selector, None
+    if not supported"""
+    pidfd_open = getattr(os, "pidfd_open", None)
+    if pidfd_open is None or proc.pid is None:  # pragma: no cover
+        return None
+    try:
+        return pidfd_open(proc.pid)
+    except OSError:  # pragma: no cover
+        # an old kernel, or the process is reaped already
+        return None
+
+
+class Reaper:
+    """A thread waiting for the processes running in background, with one
+    poll loop for all of them
+
+    Like `communicate_sync`, the output pipes are drained into the buffers
+    of the streams and the stdin is fed while waiting, but for all the jobs
+    at once. The processes are waited with pidfds where supported, and
+    polled every REAP_INTERVAL otherwise.
+
+    Jobs are added by `add()`, and `done(rcs, error)` of a job is called in
+    the thread when the processes finish, or with CmdyTimeoutError when the
+    timeout is reached (the processes are killed). A job failing to be
+    waited, or its `done` raising, gets the error by `done(None, error)`,
+    with its processes killed, so that the other jobs are not affected.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._added: List[Dict[str, Any]] = []
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._thread = Thread(
+            target=self._run, name="cmdy-reaper", daemon=True
+        )
+        self._thread.start()
+
+    def add(
+        self,
+        procs: List["Popen"],
+        streams: List["curio.io.FileStream"],
+        stdin: "curio.io.FileStream",
+        input: bytes,  # pylint: disable=redefined-builtin
+        timeout: float,
+        done: Callable[[List[int], Exception], Any],
+    ):
+        """Add a job to wait for
+
+        Args:
+            procs: The processes, i.e. the stages of a pipeline
+            streams: The pipes to drain
+            stdin: The stdin pipe to feed and close, if any
+            input: The data to feed to the stdin
+            timeout: The timeout in seconds, 0 or None for no timeout
+            done: The function called with the return codes, or the error
+        """
+        job = {
+            "procs": procs,
+            "rcs": [None] * len(procs),
+            "pidfds": [_pidfd(proc) for proc in procs],
+            "streams": streams,
+            "stdin": stdin if stdin is not None and _is_open(stdin) else None,
+            "input": memoryview(input) if input else None,
+            "timeout": timeout,
+            "deadline": monotonic() + timeout if timeout else None,
+            "done": done,
+            "fds": set(),
+        }
+        with self._lock:
+            self._added.append(job)
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:  # pragma: no cover
+            # woken up already
+            pass
+
+    def _register(self, selector: selectors.BaseSelector, job: Dict):
+        for stream in job["streams"]:
+            fd = stream.fileno()
+            selector.register(
+                fd, selectors.EVENT_READ, (job, stream, read_size(fd))
+            )
+            job["fds"].add(fd)
+        stdin = job["stdin"]
+        if stdin is not None:
+            if job["input"]:
+                job["stdin_fd"] = stdin.fileno()
+                selector.register(
+                    job["stdin_fd"], selectors.EVENT_WRITE, (job, stdin, 0)
+                )
+                job["fds"].add(job["stdin_fd"])
+            else:
+                close_pipe(stdin)
+        for pidfd in job["pidfds"]:
+            if pidfd is not None:
+                selector.register(pidfd, selectors.EVENT_READ, (job, None, 0))
+                job["fds"].add(pidfd)
+
+    @staticmethod
+    def _unregister(
+        selector: selectors.BaseSelector, job: Dict, fd: int = None
+    ):
+        """Unregister a fd of the job, or all of them"""
+        fds = list(job["fds"]) if fd is None else [fd]
+        for fd in fds:
+            # not registered if failed to register
+            if fd in selector.get_map():
+                selector.unregister(fd)
+            job["fds"].discard(fd)
+        if job.get("stdin_fd") in fds:
+            close_pipe(job["stdin"])
+        for i, pidfd in enumerate(job["pidfds"]):
+            if pidfd in fds:
+                os.close(pidfd)
+                job["pidfds"][i] = None
+
+    def _handle(self, selector: selectors.BaseSelector, key: Any):
+        job, stream, size = key.data
+        if stream is None:
+            # a process exited
+            self._unregister(selector, job, key.fd)
+        elif stream is job["stdin"]:
+            data = job["input"]
+            try:
+                written = os.write(key.fd, data[:READ_SIZE])
+            except BlockingIOError:  # pragma: no cover
+                return
+            except BrokenPipeError:
+                written = len(data)
+            job["input"] = data[written:]
+            if not job["input"]:
+                self._unregister(selector, job, key.fd)
+        else:
+            try:
+                nread = read_into(key.fd, stream._buffer, size)
+            except BlockingIOError:  # pragma: no cover
+                return
+            if not nread:
+                self._unregister(selector, job, key.fd)
+
+    def _checked(self, selector: selectors.BaseSelector, job: Dict) -> bool:
+        """Check if the job is done, or failed"""
+        if job.get("failed"):
+            return True
+        try:
+            return self._check(selector, job)
+        except Exception as error:  # pylint: disable=broad-except
+            self._fail(selector, job, error)
+            return True
+
+    def _check(self, selector: selectors.BaseSelector, job: Dict) -> bool:
+        """Check if the job is done, and tell it if so"""
+        rcs = job["rcs"]
+        for i, proc in enumerate(job["procs"]):
+            if rcs[i] is None:
+                rcs[i] = proc._popen.poll()
+
+        if all(rc is not None for rc in rcs) and not (
+            job["fds"] - set(job["pidfds"])
+        ):
+            self._unregister(selector, job)
+            job["done"](rcs, None)
+            return True
+
+        deadline = job["deadline"]
+        if deadline is not None and monotonic() >= deadline:
+            self._unregister(selector, job)
+            try:
+                _kill(job["procs"], job["timeout"])
+            except CmdyTimeoutError as error:
+                job["done"](None, error)
+            return True
+        return False
+
+    def _fail(
+        self, selector: selectors.BaseSelector, job: Dict, error: Exception
+    ):
+        """Tell the job the error, with its processes killed"""
+        job["failed"] = True
+        try:
+            self._unregister(selector, job)
+            kill_all(job["procs"])
+            job["done"](None, error)
+        except Exception:  # pylint: disable=broad-except
+            # nothing to tell, the job is done anyway
+            pass
+
+    def _timeout(self, jobs: List[Dict]) -> float:
+        """The timeout of the next select"""
+        timeout = None
+        now = monotonic()
+        for job in jobs:
+            if job["deadline"] is not None:
+                remaining = max(job["deadline"] - now, 0)
+                timeout = remaining if timeout is None else min(
+                    timeout, remaining
+                )
+            if any(
+                rc is None and pidfd is None
+                for rc, pidfd in zip(job["rcs"], job["pidfds"])
+            ):
+                timeout = REAP_INTERVAL if timeout is None else min(
+                    timeout, REAP_INTERVAL
+                )
+        return timeout
+
+    def _run(self):
+        jobs: List[Dict] = []
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wakeup_r, selectors.EVENT_READ)
+            while True:
+                for key, _ in selector.select(self._timeout(jobs)):
+                    if key.fd == self._wakeup_r:
+                        try:
+                            os.read(self._wakeup_r, READ_SIZE)
+                        except BlockingIOError:  # pragma: no cover
+                            pass
+                        continue
+                    job = key.data[0]
+                    if job.get("failed"):
+                        continue
+                    try:
+                        self._handle(selector, key)
+                    except Exception as error:  # pylint: disable=broad-except
+                        self._fail(selector, job, error)
+
+                with self._lock:
+                    added, self._added = self._added, []
+                for job in added:
+                    jobs.append(job)
+                    try:
+                        self._register(selector, job)
+                    except Exception as error:  # pylint: disable=broad-except
+                        self._fail(selector, job, error)
+
+                jobs = [
+                    job for job in jobs if not self._checked(selector, job)
+                ]
+
+
+@lru_cache()
+def reaper() -> Reaper:
+    """The reaper of the processes running in background, started on
+    first use"""
+    return Reaper()
+
+
+async def communicate_async(
+    procs: List["Popen"],
+    streams: List["curio.io.FileStream"],
+    stdin: "curio.io.FileStream" = None,
+    input: bytes = None,  # pylint: disable=redefined-builtin
+    ended: List[float] = None,
+) -> List[int]:
+    """Drain the pipes and feed the stdin concurrently in curio tasks
+    until the processes finish
+
+    See communicate_sync for the arguments. The timeout should be applied
+    by the caller.
+    """
+    import curio
+
+    rcs = [None] * len(procs)
+
+    async def drain(stream):
+        size = read_size(stream.fileno())
+        while True:
+            data = await stream._read(size)
+            if not data:
+                break
+            stream._buffer.extend(data)
+
+    async def feed():
+        try:
+            if input:
+                await stdin.write(input)
+        except BrokenPipeError:
+            pass
+        await stdin.close()
+
+    async def reap(i, proc):
+        rcs[i] = await proc.wait()
+        if ended is not None:
+            ended[i] = monotonic()
+
+    async with curio.TaskGroup() as group:
+        for stream in streams:
+            await group.spawn(drain, stream)
+        if stdin is not None and _is_open(stdin):
+            await group.spawn(feed)
+        for i, proc in enumerate(procs):
+            await group.spawn(reap, i, proc)
+
+    return rcs
+
+
+def communicate_curio(
+    procs: List["Popen"],
+    streams: List["curio.io.FileStream"],
+    stdin: "curio.io.FileStream" = None,
+    timeout: float = None,
+    input: bytes = None,  # pylint: disable=redefined-builtin
+    ended: List[float] = None,
+) -> List[int]:
+    """Drain the pipes and feed the stdin concurrently in a curio kernel
+
+    See communicate_sync for the arguments
+    """
+    import curio
+
+    coro = communicate_async(procs, streams, stdin, input, ended)
+    try:
+        if timeout:
+            return curio.run(curio.timeout_after(timeout, coro))
+        return curio.run(coro)
+    except curio.TaskTimeout:
+        _kill(procs, timeout)
+
+
+def communicate(
+    procs: List["Popen"],
+    streams: List["curio.io.FileStream"],
+    stdin: "curio.io.FileStream" = None,
+    timeout: float = None,
+    engine: str = "sync",
+    input: bytes = None,  # pylint: disable=redefined-builtin
+    ended: List[float] = None,
+) -> List[int]:
+    """Drain the pipes and feed the stdin concurrently with the engine
+    until the processes finish
+
+    See communicate_sync for the arguments
+    """
+    if engine == "sync":
+        return communicate_sync(procs, streams, stdin, timeout, input, ended)
+    return communicate_curio(procs, streams, stdin, timeout, input, ended)
+
+
+def forward_sync(
+    proc: "Popen",
+    outputs: Dict["curio.io.FileStream", Any],
+    encoding: str,
+    timeout: float,
+):
+    """Forward the pipes to the outputs as the data comes, until the pipes
+    are closed, without an event loop
+
+    Args:
+        proc: The curio Popen object
+        outputs: The pipes (curio FileStreams) and the text streams to
+            write to (i.e. `sys.stdout`)
+        encoding: The encoding to decode the data, written to the
+            `buffer` of the outputs if None
+        timeout: The timeout in seconds, 0 or None for no timeout
+
+    Raises:
+        CmdyTimeoutError: When the timeout is reached. The process is
+            killed.
+    """
+    deadline = monotonic() + timeout if timeout else None
+    decoders = {}
+    sizes = {}
+    with selectors.DefaultSelector() as selector:
+        for stream, output in outputs.items():
+            sizes[stream] = read_size(stream.fileno())
+            decoder = (
+                getincrementaldecoder(encoding)() if encoding else None
+            )
+            decoders[stream] = decoder
+            # data read by curio already
+            if stream._buffer:
+                _write_output(output, decoder, bytes(stream._buffer))
+                stream._buffer.clear()
+            selector.register(stream.fileno(), selectors.EVENT_READ, stream)
+
+        while selector.get_map():
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    _kill([proc], timeout)
+            for key, _ in selector.select(remaining):
+                stream = key.data
+                try:
+                    data = os.read(key.fd, sizes[stream])
+                except BlockingIOError:  # pragma: no cover
+                    continue
+                if not data:
+                    selector.unregister(key.fd)
+                _write_output(
+                    outputs[stream], decoders[stream], data, final=not data
+                )
+
+
+def _write_output(
+    output: Any, decoder: Any, data: bytes, final: bool = False
+):
+    """Write the data to the output, decoded by the decoder if any"""
+    if decoder is not None:
+        data = decoder.decode(data, final)
+        if data:
+            output.write(data)
+    elif data:
+        output.buffer.write(data)
+    output.flush()
@@ -0,0 +1,217 @@
+"""Fan-out of the output of a command to several commands, duplicated or
+partitioned"""
+from subprocess import PIPE
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Union
+
+from diot import Diot
+
+from .cmdy import CmdyHolding
+from .cmdy_defaults import PARTITION_CHUNK_SIZE, STDOUT
+from .cmdy_engine import PipeFanout, PipePartition, communicate
+from .cmdy_exceptions import CmdyActionError, CmdyReturnCodeError
+from .cmdy_pystage import SIGPIPE_RC
+
+if TYPE_CHECKING:
+    from .cmdy_result import CmdyResult
+
+
+class CmdyFanout:
+    """The consumers of the output of a command, each getting all of it
+
+    Built by `cmdy.fanout()` and run by piping a command to it:
+    `cmdy.x().p() | cmdy.fanout(cmdy.a(), cmdy.b())`, which works like
+    `x | tee >(a) >(b) >/dev/null` in a shell, without running `x` again or
+    staging its output in files. The consumers are holding while the
+    piping is unconsumed.
+
+    The producer and the consumers are waited at once, with the timeout
+    and the engine of the producer. The producer fails the fan-out with
+    `pipefail` (default) as the earlier stages of a pipeline do, except
+    when it gets a SIGPIPE since all the consumers exit early.
+
+    Args:
+        holdings: The holding objects of the consumers
+    """
+
+    def __init__(self, *holdings: CmdyHolding):
+        if not holdings:
+            raise CmdyActionError("No consumers to fan out to.")
+        for holding in holdings:
+            if not isinstance(holding, CmdyHolding):
+                raise CmdyActionError(
+                    "Can only fan out to holding commands, "
+                    "use .h() to hold them."
+                )
+            if holding.stdin != PIPE:
+                raise CmdyActionError("Cannot fan out to a redirected STDIN.")
+        self.holdings = list(holdings)
+        self.producer: "CmdyResult" = None
+        self.results: List["CmdyResult"] = []
+
+    def __repr__(self):
+        return f"<CmdyFanout: {[holding.cmd for holding in self.holdings]}>"
+
+    def __len__(self):
+        return len(self.holdings)
+
+    def __iter__(self) -> Iterator["CmdyResult"]:
+        return iter(self.results)
+
+    def __getitem__(self, index: int) -> "CmdyResult":
+        return self.results[index]
+
+    def run(self, holding: CmdyHolding) -> "CmdyFanout":
+        """Run the producer and the consumers, and wait for them
+
+        Args:
+            holding: The holding object of the producer, piping
+
+        Returns:
+            self, with the results of the consumers in `results`
+
+        Raises:
+            CmdyReturnCodeError: When a consumer, or the producer with
+                `pipefail`, fails and `raise` is True
+        """
+        which = holding.data.pipe.which
+        self.producer = holding.run(False)
+        # the stages of the pipeline if the producer is the last one
+        producers = (
+            self.producer.pipeline.results
+            if self.producer.pipeline
+            else [self.producer]
+        )
+        try:
+            for consumer in self.holdings:
+                self.results.append(consumer.run(False))
+        except BaseException:
+            for result in producers + self.results:
+                result.proc.kill()
+            raise
+
+        stream = (
+            self.producer.proc.stdout
+            if which == STDOUT
+            else self.producer.proc.stderr
+        )
+        relay = self._relay(
+            stream, [result.proc.stdin for result in self.results]
+        ).start()
+
+        streams = []
+        for result in producers + self.results:
+            streams.extend(result._pipes()[0])
+        _, stdin, input_ = producers[0]._pipes()
+        try:
+            rcs = communicate(
+                [result.proc for result in producers + self.results],
+                streams,
+                stdin,
+                holding.timeout,
+                holding.engine,
+                input_,
+            )
+            for result, rc in zip(producers + self.results, rcs):
+                result._rc = rc
+                result._input = None
+
+            failed = self.failed
+            if failed is not None and failed.holding.raise_:
+                raise CmdyReturnCodeError(failed)
+        finally:
+            relay.close()
+            for result in producers + self.results:
+                result._close_fds()
+        return self
+
+    def _relay(self, src: Any, dests: List[Any]) -> PipeFanout:
+        """Build the relay from the producer to the consumers"""
+        return PipeFanout(src, dests)
+
+    @property
+    def rcs(self) -> List[int]:
+        """The return codes of the consumers"""
+        return [result._rc for result in self.results]
+
+    @property
+    def failed(self) -> "CmdyResult":
+        """The result of the first consumer failing, or the producer with
+        `pipefail`, if any"""
+        for result in self.results:
+            if result._rc not in result.holding.okcode:
+                return result
+        producer = self.producer
+        if (
+            producer.holding.pipefail
+            and producer._rc not in producer.holding.okcode
+            and producer._rc != SIGPIPE_RC
+        ):
+            return producer
+        return None
+
+
+class CmdyPartition(CmdyFanout):
+    """The workers of the output of a command, each getting part of it
+
+    Built by `cmdy.partition()` and run by `run()`. The output of the
+    producer is split on line boundaries in large chunks, which go to the
+    workers in turn, or by the keys of the lines with `by`, so that a
+    filter (i.e. `awk`) can scale across cores.
+
+    Args:
+        producer: The producer, a plan (`cmdy.plan(...)`) or a holding
+            object (`cmdy.x().h()`)
+        worker: The plan or the prepared command (without slots) of the
+            workers, run `n` times
+        n: The number of the workers
+        by: A function taking a line (bytes, without the newline) and
+            returning its key, the lines with the same key go to the same
+            worker
+        chunk_size: The size of the chunks to split
+    """
+
+    def __init__(
+        self,
+        producer: Union[CmdyHolding, Any],
+        worker: Any,
+        n: int,
+        by: Callable = None,
+        chunk_size: int = PARTITION_CHUNK_SIZE,
+    ):
+        if n < 1:
+            raise ValueError("Expecting at least 1 worker.")
+        super().__init__(*(worker.holding() for _ in range(n)))
+        self._producer = producer
+        self.by = by
+        self.chunk_size = chunk_size
+
+    def __repr__(self):
+        return (
+            f"<CmdyPartition: {len(self)} x {self.holdings[0].cmd}>"
+        )
+
+    def _relay(self, src: Any, dests: List[Any]) -> PipePartition:
+        return PipePartition(src, dests, self.by, self.chunk_size)
+
+    def run(self) -> "CmdyPartition":  # pylint: disable=arguments-differ
+        """Run the producer and the workers, and wait for them
+
+        Returns:
+            self, with the results of the workers in `results`
+
+        Raises:
+            CmdyReturnCodeError: When a worker, or the producer with
+                `pipefail`, fails and `raise` is True
+        """
+        holding = self._producer
+        if not isinstance(holding, CmdyHolding):
+            holding = holding.holding()
+        holding.data.pipe = holding.data.get("pipe") or Diot()
+        holding.data.pipe.which = STDOUT
+        return super().run(holding)
+
+    @property
+    def stdout(self) -> Union[str, bytes]:
+        """The outputs of the workers concatenated, in the worker order"""
+        outputs = [result.stdout for result in self.results]
+        return ("" if isinstance(outputs[0], str) else b"").join(outputs)
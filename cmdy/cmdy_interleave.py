@@ -0,0 +1,219 @@
+"""The lines of many running commands, in the order they come"""
+import os
+import selectors
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Tuple, Union
+
+from .cmdy import CmdyHolding
+from .cmdy_defaults import BOTH, READ_SIZE, REAP_INTERVAL, STDERR, STDOUT
+from .cmdy_engine import _is_open, _pidfd, close_pipe, kill_all, read_into
+from .cmdy_exceptions import CmdyActionError, CmdyReturnCodeError
+from .cmdy_utils import read_size, split_lines
+
+if TYPE_CHECKING:
+    from .cmdy_result import CmdyResult
+
+
+class CmdyInterleave:
+    """The lines of the outputs of many running commands, interleaved
+
+    Built by `cmdy.interleave()`. Iterating over it yields the
+    `(result, which, line)` tuples, where `which` is STDOUT or STDERR, in
+    the order the lines come. The pipes of all the commands are watched
+    by one selector, and each pipe has its own buffer, so the lines are
+    never cut. The outputs not iterated over are drained as well, to be
+    fetched from the results afterwards.
+
+    A command is reaped as soon as its pipes are closed, with a pidfd
+    where supported, polled every REAP_INTERVAL otherwise, and its `rc` is
+    ready when its last line is yielded. The lines of all the commands are
+    yielded even if some fail, and the first failure is raised at the end.
+    The commands left are killed if the iteration stops early.
+
+    Args:
+        results: The commands, results not waited yet, holding objects or
+            plans, which are run
+        which: The outputs to iterate over, STDOUT, STDERR or BOTH
+    """
+
+    def __init__(
+        self,
+        results: List[Union["CmdyResult", CmdyHolding, Any]],
+        which: int = STDOUT,
+    ):
+        if which not in (STDOUT, STDERR, BOTH):
+            raise ValueError("Expecting STDOUT, STDERR or BOTH for `which`.")
+        self.results: List["CmdyResult"] = []
+        for result in results:
+            if callable(getattr(result, "holding", None)):
+                # a plan
+                result = result.holding()
+            if isinstance(result, CmdyHolding):
+                result = result.run(False)
+            if result.holding.data.get("async"):
+                raise CmdyActionError("Cannot interleave async commands.")
+            self.results.append(result)
+        self.which = which
+        self.failed: List["CmdyResult"] = []
+
+    def __repr__(self):
+        return f"<CmdyInterleave: {[result.cmd for result in self.results]}>"
+
+    def _register(
+        self, selector: selectors.BaseSelector, result: "CmdyResult"
+    ) -> Dict[str, Any]:
+        """Register the pipes of a command to the selector
+
+        Returns:
+            The state of the command, with the fds registered
+        """
+        state = {
+            "result": result,
+            "fds": set(),
+            "pidfd": None,
+            "waiting": False,
+        }
+        streams, stdin, input_ = result._pipes()
+        for stream in streams:
+            which = STDOUT if stream is result.proc.stdout else STDERR
+            fd = stream.fileno()
+            # the lines of the outputs not wanted are not split
+            wanted = self.which in (BOTH, which)
+            selector.register(
+                fd,
+                selectors.EVENT_READ,
+                (state, stream, which if wanted else None, read_size(fd)),
+            )
+            state["fds"].add(fd)
+        if stdin is not None:
+            if input_ and _is_open(stdin):
+                fd = stdin.fileno()
+                state["input"] = memoryview(input_)
+                selector.register(
+                    fd, selectors.EVENT_WRITE, (state, stdin, None, 0)
+                )
+                state["fds"].add(fd)
+            else:
+                close_pipe(stdin)
+            result._input = None
+        return state
+
+    @staticmethod
+    def _handle(
+        selector: selectors.BaseSelector, key: Any
+    ) -> List[Tuple["CmdyResult", int, Union[str, bytes]]]:
+        """Read from or write to a pipe that is ready
+
+        Returns:
+            The complete lines read
+        """
+        state, stream, which, size = key.data
+        result = state["result"]
+        if stream is None:
+            # the process exited
+            selector.unregister(key.fd)
+            os.close(key.fd)
+            state["pidfd"] = None
+            return []
+
+        if size == 0:
+            data = state["input"]
+            try:
+                written = os.write(key.fd, data[:READ_SIZE])
+            except BlockingIOError:  # pragma: no cover
+                return []
+            except BrokenPipeError:
+                written = len(data)
+            state["input"] = data[written:]
+            if not state["input"]:
+                selector.unregister(key.fd)
+                state["fds"].discard(key.fd)
+                close_pipe(stream)
+            return []
+
+        try:
+            nread = read_into(key.fd, stream._buffer, size)
+        except BlockingIOError:  # pragma: no cover
+            return []
+        if not nread:
+            selector.unregister(key.fd)
+            state["fds"].discard(key.fd)
+        if which is None:
+            return []
+        lines = split_lines(
+            stream._buffer, result.holding.encoding, None, not nread
+        )
+        return [(result, which, line) for line in lines]
+
+    def _reap(self, state: Dict[str, Any]) -> bool:
+        """Tell if the command of the state finished, recording its return
+        code if so"""
+        result = state["result"]
+        if not state["waiting"] or state["pidfd"] is not None:
+            return False
+        rc = result.proc._popen.poll()
+        if rc is None:
+            return False
+        result._rc = rc
+        result._close_fds()
+        if rc not in result.holding.okcode:
+            self.failed.append(result)
+        return True
+
+    def __iter__(
+        self,
+    ) -> Iterator[Tuple["CmdyResult", int, Union[str, bytes]]]:
+        """Yield the lines as they come
+
+        Raises:
+            CmdyReturnCodeError: When a command fails and `raise` is True,
+                after all the lines are yielded
+        """
+        self.failed = []
+        states = []
+        completed = False
+        with selectors.DefaultSelector() as selector:
+            try:
+                for result in self.results:
+                    states.append(self._register(selector, result))
+
+                while states:
+                    for state in states:
+                        if state["fds"] or state["waiting"]:
+                            continue
+                        # the pipes are closed, wait for the process to exit
+                        state["waiting"] = True
+                        state["pidfd"] = _pidfd(state["result"].proc)
+                        if state["pidfd"] is not None:
+                            selector.register(
+                                state["pidfd"],
+                                selectors.EVENT_READ,
+                                (state, None, None, 0),
+                            )
+                    states = [
+                        state for state in states if not self._reap(state)
+                    ]
+                    if not states:
+                        break
+
+                    polling = any(
+                        state["waiting"] and state["pidfd"] is None
+                        for state in states
+                    )
+                    for key, _ in selector.select(
+                        REAP_INTERVAL if polling else None
+                    ):
+                        yield from self._handle(selector, key)
+                completed = True
+            finally:
+                for state in states:
+                    if state["pidfd"] is not None:
+                        os.close(state["pidfd"])
+                if not completed:
+                    kill_all([state["result"].proc for state in states])
+                    for state in states:
+                        result = state["result"]
+                        result._rc = result.proc._popen.returncode
+
+        for result in self.failed:
+            if result.holding.raise_:
+                raise CmdyReturnCodeError(result)
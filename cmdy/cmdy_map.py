@@ -0,0 +1,295 @@
+"""A command run over many arguments, with bounded concurrency"""
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from threading import Lock
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Set,
+    Union,
+)
+
+from diot import Diot
+
+from .cmdy_exceptions import CmdyActionError, CmdyReturnCodeError
+from .cmdy_plan import CmdyPlan
+from .cmdy_prepare import CmdyPrepared
+
+if TYPE_CHECKING:
+    from .cmdy import Cmdy, CmdyHolding
+    from .cmdy_result import CmdyAsyncResult, CmdyResult
+
+
+def _copy_cmd(cmd: "Cmdy") -> "Cmdy":
+    """Copy a command with its own list of the subcommands"""
+    args = cmd._args
+    return cmd.__class__(
+        cmd._name,
+        cmd._bakeable,
+        Diot(
+            args=list(args.args),
+            kwargs=args.kwargs,
+            config=args.config,
+            popen=args.popen,
+        ),
+    )
+
+
+class CmdyMap:
+    """A command run once for each of the items, at most `jobs` at a time
+
+    Built by `cmdy.map()` (iterate over it, or `run()`) and `cmdy.amap()`
+    (`async for`, or `await arun()`). The outputs of the running commands
+    are drained while they run, so the results have the outputs ready.
+
+    With `ordered`, the results come out in the order of the items, with
+    at most `jobs * 2` of them held, so that a slow command holds back the
+    others instead of the finished ones piling up. Otherwise, they come out
+    as the commands finish.
+
+    With `fail_fast`, the first failing command raises, the commands
+    running are killed and the rest are not started. Otherwise, all the
+    commands run, and the failing results come out like the others and are
+    collected in `failed` as well.
+
+    Args:
+        cmd: A prepared command (`cmdy.prepare(...)`), run with each item,
+            a dict of the values of the slots. Or a command (`cmdy.gzip`),
+            run with each item as its arguments, a tuple of the non-keyword
+            arguments, a dict of the keyword arguments or a single argument
+        items: The items to run the command with
+        jobs: The max number of the commands running at a time
+        ordered: Whether to get the results in the order of the items
+        fail_fast: Whether to stop at the first failing command
+        progress: A function called with the number of the commands
+            finished and the number of the items (None if unknown) when a
+            command finishes
+        is_async: Whether to run the commands in async mode
+    """
+
+    def __init__(
+        self,
+        cmd: Union["Cmdy", CmdyPrepared],
+        items: Iterable[Any],
+        jobs: int,
+        ordered: bool = True,
+        fail_fast: bool = True,
+        progress: Callable[[int, int], Any] = None,
+        is_async: bool = False,
+    ):
+        if jobs < 1:
+            raise ValueError("Expecting at least 1 job.")
+        if not isinstance(cmd, CmdyPrepared):
+            # the direct subcommands (`cmdy.git.status`) are taken from the
+            # command once, as a call does, and given to each item
+            taken = _copy_cmd(cmd)
+            cmd._args.args = []
+            cmd = taken
+        self.cmd = cmd
+        self.items = items
+        self.jobs = jobs
+        self.ordered = ordered
+        self.fail_fast = fail_fast
+        self.progress = progress
+        self.is_async = is_async
+        self.total = len(items) if hasattr(items, "__len__") else None
+        self.done = 0
+        self.failed: List[Union["CmdyResult", "CmdyAsyncResult"]] = []
+        self._running: Set["CmdyResult"] = set()
+        self._stopped = False
+        # guards _running and _stopped between the threads
+        self._lock = Lock()
+
+    def __repr__(self):
+        return f"<CmdyMap: {self.cmd!r}, jobs={self.jobs}>"
+
+    def _holding(self, item: Any) -> "CmdyHolding":
+        """Get the holding object to run with an item"""
+        if isinstance(self.cmd, CmdyPrepared):
+            holding = self.cmd.holding(**item)
+        else:
+            if isinstance(item, dict):
+                args, kwargs = (), item
+            elif isinstance(item, tuple):
+                args, kwargs = item, {}
+            else:
+                args, kwargs = (item,), {}
+            # composing a command clears its subcommands, and the items may
+            # be composed by the threads at the same time
+            holding = CmdyPlan(_copy_cmd(self.cmd), args, kwargs).holding()
+        holding.data["async"] = self.is_async
+        return holding
+
+    def _finish(
+        self, result: Union["CmdyResult", "CmdyAsyncResult"]
+    ) -> Union["CmdyResult", "CmdyAsyncResult"]:
+        """Count a finished command and report the progress"""
+        if result._rc not in result.holding.okcode:
+            self.failed.append(result)
+        self.done += 1
+        if self.progress is not None:
+            self.progress(self.done, self.total)
+        return result
+
+    def _run_one(self, item: Any) -> "CmdyResult":
+        """Run the command with an item and wait for it, in a thread"""
+        if self._stopped:
+            return None
+        result = self._holding(item).run(False)
+        with self._lock:
+            self._running.add(result)
+            stopped = self._stopped
+        try:
+            if stopped:
+                # missed by the killing
+                result.proc.kill()
+            result.wait()
+        except CmdyReturnCodeError:
+            if self.fail_fast:
+                raise
+        finally:
+            with self._lock:
+                self._running.discard(result)
+        return result
+
+    def __iter__(self) -> Iterator["CmdyResult"]:
+        """Run the commands and yield the results
+
+        Raises:
+            CmdyReturnCodeError: When a command fails with `fail_fast`
+        """
+        if self.is_async:
+            raise CmdyActionError("Use `async for` for an async map.")
+        pending: "deque[Future]" = deque()
+        running: Set[Future] = set()
+        items = iter(self.items)
+        self._stopped = False
+        executor = ThreadPoolExecutor(self.jobs, "cmdy-map")
+        try:
+            while True:
+                for item in items:
+                    future = executor.submit(self._run_one, item)
+                    if self.ordered:
+                        # the bounded reorder buffer
+                        pending.append(future)
+                        if len(pending) >= self.jobs * 2:
+                            break
+                    else:
+                        running.add(future)
+                        if len(running) >= self.jobs:
+                            break
+
+                if self.ordered:
+                    if not pending:
+                        return
+                    yield self._finish(pending.popleft().result())
+                else:
+                    if not running:
+                        return
+                    done, running = wait_futures(
+                        running, return_when=FIRST_COMPLETED
+                    )
+                    for future in done:
+                        yield self._finish(future.result())
+        finally:
+            for future in pending:
+                future.cancel()
+            for future in running:
+                future.cancel()
+            with self._lock:
+                self._stopped = True
+                results = list(self._running)
+            for result in results:
+                result.proc.kill()
+            executor.shutdown(wait=True)
+
+    def run(self) -> List["CmdyResult"]:
+        """Run the commands and collect the results"""
+        return list(self)
+
+    async def _arun_one(self, item: Any) -> "CmdyAsyncResult":
+        """Run the command with an item and wait for it, in a curio task
+
+        The error with `fail_fast` is returned to be raised by the
+        iteration, instead of crashing the task.
+        """
+        result = self._holding(item).run(False)
+        try:
+            await result.wait()
+        except CmdyReturnCodeError as exc:
+            if self.fail_fast:
+                return exc
+        return result
+
+    def __aiter__(self) -> "CmdyMap":
+        """Run the commands in curio tasks and iterate over the results
+
+        Use `async with` to kill the commands left when stopping early:
+        `async with cmdy.amap(...) as amap: async for result in amap: ...`
+        """
+        import curio
+
+        if not self.is_async:
+            raise CmdyActionError("Use `for` for a sync map.")
+        self._items = iter(self.items)
+        self._group = curio.TaskGroup()
+        self._tasks: "deque[curio.Task]" = deque()
+        # the reorder buffer holds more tasks than the ones running
+        self._limit = curio.Semaphore(self.jobs)
+        return self
+
+    async def _arun_limited(self, item: Any) -> "CmdyAsyncResult":
+        async with self._limit:
+            return await self._arun_one(item)
+
+    async def __anext__(self) -> "CmdyAsyncResult":
+        """Get the next result
+
+        Raises:
+            CmdyReturnCodeError: When a command fails with `fail_fast`
+        """
+        window = self.jobs * 2 if self.ordered else self.jobs
+        for item in self._items:
+            self._tasks.append(
+                await self._group.spawn(self._arun_limited, item)
+            )
+            if len(self._tasks) >= window:
+                break
+
+        if not self._tasks:
+            await self._group.join()
+            raise StopAsyncIteration
+        if self.ordered:
+            task = self._tasks.popleft()
+            await task.wait()
+        else:
+            task = await self._group.next_done()
+            self._tasks.remove(task)
+        result = task.result
+        if isinstance(result, CmdyReturnCodeError):
+            await self.aclose()
+            raise result
+        return self._finish(result)
+
+    async def aclose(self):
+        """Cancel the tasks left, with their commands killed"""
+        group = getattr(self, "_group", None)
+        if group is not None:
+            await group.cancel_remaining()
+            self._items = iter(())
+            self._tasks.clear()
+
+    async def __aenter__(self) -> "CmdyMap":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def arun(self) -> List["CmdyAsyncResult"]:
+        """Run the commands in curio tasks and collect the results"""
+        return [result async for result in self]
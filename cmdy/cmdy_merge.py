@@ -0,0 +1,182 @@
+"""Streaming k-way merge of the sorted outputs of several commands"""
+import heapq
+import os
+from threading import Thread
+from typing import IO, TYPE_CHECKING, Any, Callable, Iterator, List, Union
+
+from .cmdy import CmdyHolding
+from .cmdy_defaults import READ_SIZE
+from .cmdy_engine import read_all, write_all, sync_stream
+from .cmdy_exceptions import CmdyReturnCodeError
+
+if TYPE_CHECKING:
+    import curio
+    from .cmdy_result import CmdyResult
+
+
+def _drain_into_buffer(stream: "curio.io.FileStream"):
+    """Read all the rest of the pipe into its own buffer"""
+    # read_all takes the buffer over, give the data back
+    data = read_all(stream)
+    stream._buffer.extend(data)
+
+
+class CmdyMerge:
+    """The lines of the sorted outputs of several commands, merged
+
+    Built by `cmdy.merge_sorted()`. The stdout of the commands are read
+    in chunks and split into lines, and the lines are merged with a heap,
+    so only a chunk of each output is held. The stderr of the commands are
+    drained by threads meanwhile, so that a command is not blocked by a
+    full stderr pipe, and can be fetched from the results afterwards. The
+    commands are waited when all the lines are merged, and killed if the
+    merging stops early.
+
+    Iterate over it for the lines, or redirect it to the stdin of another
+    command: `cmdy.uniq().r(STDIN) < merged`.
+
+    Args:
+        results: The commands, results not waited yet, holding objects or
+            plans, which are run
+        key: The function to get the key of a line to compare
+        reverse: Whether the outputs are sorted in descending order
+    """
+
+    def __init__(
+        self,
+        results: List[Union["CmdyResult", CmdyHolding, Any]],
+        key: Callable = None,
+        reverse: bool = False,
+    ):
+        self.results: List["CmdyResult"] = []
+        for result in results:
+            if callable(getattr(result, "holding", None)):
+                # a plan
+                result = result.holding()
+            if isinstance(result, CmdyHolding):
+                result = result.run(False)
+            self.results.append(result)
+        self.key = key
+        self.reverse = reverse
+        self.error = None
+        self._pipe: IO = None
+        self._thread: Thread = None
+
+    def __repr__(self):
+        return f"<CmdyMerge: {[result.cmd for result in self.results]}>"
+
+    @staticmethod
+    def _lines(result: "CmdyResult") -> Iterator[Union[str, bytes]]:
+        """Read the lines of the stdout of a command in chunks"""
+        holding = result.holding
+        stream = sync_stream(
+            result.proc.stdout, holding.encoding, holding.engine
+        )
+        newline = "\n" if holding.encoding else b"\n"
+        while True:
+            try:
+                lines = stream.next_lines()
+            except StopIteration:
+                return
+            # the last line may not end with a newline
+            if lines and not lines[-1].endswith(newline):
+                lines[-1] += newline
+            yield from lines
+
+    @staticmethod
+    def _drain(result: "CmdyResult") -> List[Thread]:
+        """Start the threads reading the outputs other than the stdout
+        into the buffers of the pipes"""
+        threads = []
+        streams, _, _ = result._pipes()
+        for stream in streams:
+            if stream is result.proc.stdout:
+                continue
+            thread = Thread(
+                target=_drain_into_buffer, args=(stream,), daemon=True
+            )
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def __iter__(self) -> Iterator[Union[str, bytes]]:
+        """Merge the lines
+
+        Raises:
+            CmdyReturnCodeError: When a command fails and `raise` is True
+        """
+        completed = False
+        threads = [
+            thread for result in self.results for thread in self._drain(result)
+        ]
+        try:
+            yield from heapq.merge(
+                *(self._lines(result) for result in self.results),
+                key=self.key,
+                reverse=self.reverse,
+            )
+            completed = True
+        finally:
+            for result in self.results:
+                if not completed and result.proc.poll() is None:
+                    result.proc.kill()
+            for thread in threads:
+                thread.join()
+            for result in self.results:
+                try:
+                    result.wait()
+                except CmdyReturnCodeError:
+                    if completed:
+                        raise
+
+    def pipe(self) -> IO:
+        """Get a pipe to read the merged lines from, i.e. as the stdin of
+        another command, written by a thread
+
+        Returns:
+            The read end of the pipe, a binary file object
+        """
+        read_end, write_end = os.pipe()
+        self._pipe = open(read_end, "rb", buffering=0)
+        self._thread = Thread(
+            target=self._write, args=(write_end,), daemon=True
+        )
+        self._thread.start()
+        return self._pipe
+
+    def _write(self, fd: int):
+        encoding = self.results[0].holding.encoding if self.results else None
+        lines = iter(self)
+        chunk = []
+        size = 0
+        try:
+            for line in lines:
+                if encoding:
+                    line = line.encode(encoding)
+                chunk.append(line)
+                size += len(line)
+                if size >= READ_SIZE:
+                    write_all(fd, b"".join(chunk))
+                    chunk, size = [], 0
+            write_all(fd, b"".join(chunk))
+        except BrokenPipeError:
+            # the reader exits early, stop the commands
+            lines.close()
+        except Exception as exc:  # pylint: disable=broad-except
+            self.error = exc
+        finally:
+            os.close(fd)
+
+    def close(self):
+        """Close our end of the pipe, wait until the lines are merged
+
+        Raises:
+            Exception: When failed to merge the lines, i.e. a command
+                fails
+        """
+        if self._pipe is None:
+            return
+        self._pipe.close()
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
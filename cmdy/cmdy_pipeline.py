@@ -0,0 +1,237 @@
+"""Pipelines of piped commands, spawned, waited and reaped as a group"""
+from time import monotonic
+from typing import TYPE_CHECKING, List
+
+from .cmdy_defaults import STDOUT
+from .cmdy_engine import close_pipe, communicate, communicate_async, kill_all
+from .cmdy_exceptions import CmdyReturnCodeError, CmdyTimeoutError
+from .cmdy_pystage import SIGPIPE_RC
+from .cmdy_utils import raise_return_code_error, set_pipe_size
+
+if TYPE_CHECKING:
+    from .cmdy import CmdyHolding
+    from .cmdy_result import CmdyAsyncResult, CmdyResult
+
+
+class CmdyPipeline:
+    """The stages of piped commands, connected by OS pipes
+
+    Built by `|` (`cmdy.cat("a.txt").p() | cmdy.gzip() | cmdy.wc(c=True)`)
+    and attached to the result of the last stage as `result.pipeline`.
+    All the stages are spawned before any of them is waited, the data
+    goes through the OS pipes directly, and the parent's copies of the
+    intermediate pipes are closed, so that a stage gets an EOF or a SIGPIPE
+    just as it does in a shell. The stages are then waited concurrently,
+    with their outputs not piped drained at the same time. If the last stage
+    is async (`.a()`), the result is awaited for the whole pipeline in the
+    event loop instead.
+
+    The timeout, the engine, `raise`, `pipefail` and `pipe_size` of the last
+    stage apply to the whole pipeline. With `pipefail` (default), the
+    pipeline fails at the rightmost stage with an unexpected return code,
+    except a stage with `raise` off, or one killed by SIGPIPE since a later
+    stage stops reading early (i.e. `yes | head`). Without it, only the last
+    stage counts, like a shell.
+
+    Args:
+        holding: The holding object of the last stage
+    """
+
+    def __init__(self, holding: "CmdyHolding"):
+        self.holdings: List["CmdyHolding"] = []
+        while holding is not None:
+            self.holdings.insert(0, holding)
+            pipe = holding.data.get("pipe")
+            holding = pipe.get("from") if pipe else None
+
+        last = self.holdings[-1]
+        self.pipefail = last.pipefail
+        self.pipe_size = last.pipe_size
+        self.results: List["CmdyResult"] = []
+        self._started: List[float] = []
+        self._ended: List[float] = [None] * len(self.holdings)
+
+    def __repr__(self):
+        return f"<CmdyPipeline: {[holding.cmd for holding in self.holdings]}>"
+
+    def __len__(self):
+        return len(self.holdings)
+
+    def run(self, wait: bool = None) -> "CmdyResult":
+        """Spawn all the stages
+
+        Args:
+            wait: Whether to wait for the pipeline, defaults to whether the
+                last stage should be waited
+
+        Returns:
+            The result of the last stage
+        """
+        prior = None
+        try:
+            for holding in self.holdings:
+                holding.data.pipe.pipeline = self
+                if prior is not None:
+                    which = prior.holding.data.pipe.which
+                    stream = (
+                        prior.proc.stdout
+                        if which == STDOUT
+                        else prior.proc.stderr
+                    )
+                    holding.stdin = stream
+                    set_pipe_size(stream.fileno(), self.pipe_size)
+                self._started.append(monotonic())
+                prior = holding.run(False)
+                self.results.append(prior)
+                if len(self.results) > 1:
+                    # the stage holds the pipe now
+                    close_pipe(stream)
+        except BaseException:
+            for result in self.results:
+                result.proc.kill()
+            raise
+
+        last = self.results[-1]
+        last.pipeline = self
+        if wait is None:
+            wait = last.holding.should_wait
+        if last.holding.data["async"]:
+            # to be awaited
+            return last
+        return last.wait() if wait else last
+
+    def wait(self) -> "CmdyResult":
+        """Wait for all the stages concurrently
+
+        Returns:
+            The result of the last stage
+
+        Raises:
+            CmdyReturnCodeError: When the pipeline fails and `raise` is True
+        """
+        last = self.results[-1]
+        streams = []
+        for result in self.results:
+            streams.extend(result._pipes()[0])
+        _, stdin, input_ = self.results[0]._pipes()
+        try:
+            rcs = communicate(
+                [result.proc for result in self.results],
+                streams,
+                stdin,
+                last.holding.timeout,
+                last.holding.engine,
+                input_,
+                self._ended,
+            )
+            for result, rc in zip(self.results, rcs):
+                result._rc = rc
+                result._input = None
+
+            failed = self.failed
+            if failed is not None and last.holding.raise_:
+                raise CmdyReturnCodeError(failed)
+        finally:
+            for result in self.results:
+                result._close_fds()
+        return last
+
+    async def wait_async(self) -> "CmdyAsyncResult":
+        """Wait for all the stages concurrently in curio tasks
+
+        Used when the last stage is async (`cmdy.x().p() | cmdy.y().a()`),
+        so the event loop is not blocked. All the stages are killed when
+        the pipeline times out or the waiting is cancelled.
+
+        Returns:
+            The result of the last stage
+
+        Raises:
+            CmdyTimeoutError: When the pipeline times out
+            CmdyReturnCodeError: When the pipeline fails and `raise` is True
+        """
+        import inspect
+
+        import curio
+
+        last = self.results[-1]
+        procs = [result.proc for result in self.results]
+        streams = []
+        for result in self.results:
+            streams.extend(result._pipes()[0])
+        _, stdin, input_ = self.results[0]._pipes()
+        coro = communicate_async(procs, streams, stdin, input_, self._ended)
+        timeout = last.holding.timeout
+        try:
+            if timeout:
+                rcs = await curio.timeout_after(timeout, coro)
+            else:
+                rcs = await coro
+        except curio.TaskTimeout:
+            kill_all(procs)
+            if not timeout:
+                # by an outer timeout
+                raise
+            raise CmdyTimeoutError(
+                f"Timeout after {timeout} seconds."
+            ) from None
+        except curio.CancelledError:
+            kill_all(procs)
+            raise
+        else:
+            for result, rc in zip(self.results, rcs):
+                result._rc = rc
+                result._input = None
+
+            failed = self.failed
+            if failed is not None and last.holding.raise_:
+                if isinstance(failed, failed.holding.bakeable.CmdyAsyncResult):
+                    await raise_return_code_error(failed)
+                raise CmdyReturnCodeError(failed)
+            return last
+        finally:
+            for result in self.results:
+                closing = result._close_fds()
+                if inspect.iscoroutine(closing):
+                    await closing
+
+    @property
+    def rcs(self) -> List[int]:
+        """The return codes of the stages, waits if not finished"""
+        if any(result._rc is None for result in self.results):
+            self.wait()
+        return [result._rc for result in self.results]
+
+    @property
+    def failed(self) -> "CmdyResult":
+        """The result of the stage making the pipeline fail, if any"""
+        rcs = self.rcs
+        last = len(rcs) - 1
+        stages = reversed(range(len(rcs))) if self.pipefail else [last]
+        for i in stages:
+            holding = self.results[i].holding
+            if rcs[i] in holding.okcode:
+                continue
+            if i < last and (not holding.raise_ or rcs[i] == SIGPIPE_RC):
+                continue
+            return self.results[i]
+        return None
+
+    @property
+    def rc(self) -> int:
+        """The return code of the pipeline
+
+        The one of the failing stage with `pipefail`, otherwise the one of
+        the last stage.
+        """
+        failed = self.failed
+        return (failed or self.results[-1])._rc
+
+    @property
+    def timings(self) -> List[float]:
+        """The elapsed seconds of the stages, from being spawned to being
+        found finished, None for those not finished yet"""
+        return [
+            None if ended is None else ended - started
+            for started, ended in zip(self._started, self._ended)
+        ]
@@ -0,0 +1,158 @@
+"""Parts of a file fed to parallel copies of a command, like
+`parallel --pipepart`"""
+import os
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from subprocess import PIPE
+from typing import TYPE_CHECKING, Any, Iterator, List, Tuple, Union
+
+from .cmdy_defaults import PARTITION_CHUNK_SIZE, READ_SIZE
+from .cmdy_engine import RangeFeeder, communicate
+from .cmdy_exceptions import CmdyActionError, CmdyReturnCodeError
+
+if TYPE_CHECKING:
+    from .cmdy_result import CmdyResult
+
+
+def line_ranges(path: str, block_size: int) -> List[Tuple[int, int]]:
+    """Split a file into byte ranges of about block_size, each ending
+    after a newline (except the last one if the file doesn't end with one)
+
+    Args:
+        path: The path of the file
+        block_size: The size of the blocks
+
+    Returns:
+        The (start, end) of the ranges, end exclusive
+    """
+    size = os.path.getsize(path)
+    ranges = []
+    start = 0
+    with open(path, "rb") as fin:
+        while start < size:
+            end = start + block_size
+            if end < size:
+                # find the newline at or after end - 1
+                fin.seek(end - 1)
+                while True:
+                    data = fin.read(READ_SIZE)
+                    if not data:
+                        end = size
+                        break
+                    newline = data.find(b"\n")
+                    if newline >= 0:
+                        end = fin.tell() - len(data) + newline + 1
+                        break
+            else:
+                end = size
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+class CmdyPipepart:
+    """A file split into blocks on line boundaries, each fed to a copy of
+    a command
+
+    Built by `cmdy.pipepart()`. The blocks are sent from the file to the
+    stdin of the commands with sendfile(2), and at most `jobs` commands run
+    at a time. The results come out in the order of the blocks, with at
+    most `jobs * 2` of them held, so that a slow block holds back the
+    others instead of the finished ones piling up.
+
+    Args:
+        path: The path of the file
+        worker: The plan or the prepared command (without slots) to feed
+            the blocks to
+        jobs: The max number of the commands running at a time
+        block_size: The size of the blocks
+    """
+
+    def __init__(
+        self,
+        path: Union[str, os.PathLike],
+        worker: Any,
+        jobs: int,
+        block_size: int = PARTITION_CHUNK_SIZE,
+    ):
+        if jobs < 1:
+            raise ValueError("Expecting at least 1 job.")
+        self.path = os.fspath(path)
+        self.worker = worker
+        self.jobs = jobs
+        self.ranges = line_ranges(self.path, block_size)
+
+    def __repr__(self):
+        return (
+            f"<CmdyPipepart: {self.path} x {len(self.ranges)} blocks, "
+            f"jobs={self.jobs}>"
+        )
+
+    def __len__(self):
+        return len(self.ranges)
+
+    def _run_block(self, fd: int, start: int, end: int) -> "CmdyResult":
+        """Run a command with a block as its stdin, and wait for it"""
+        holding = self.worker.holding()
+        if holding.stdin != PIPE:
+            raise CmdyActionError("Cannot feed a block to a redirected STDIN.")
+        result = holding.run(False)
+        feeder = RangeFeeder(result.proc.stdin, fd, start, end).start()
+        try:
+            result._rc = communicate(
+                [result.proc],
+                result._pipes()[0],
+                None,
+                holding.timeout,
+                holding.engine,
+            )[0]
+            if result._rc not in holding.okcode and holding.raise_:
+                raise CmdyReturnCodeError(result)
+        finally:
+            feeder.close()
+            result._close_fds()
+        return result
+
+    def __iter__(self) -> Iterator["CmdyResult"]:
+        """Run the commands and yield the results in the order of the
+        blocks
+
+        Raises:
+            CmdyReturnCodeError: When a command fails and `raise` is True.
+                The blocks not started yet are cancelled.
+        """
+        fd = os.open(self.path, os.O_RDONLY)
+        pending: "deque[Future]" = deque()
+        ranges = iter(self.ranges)
+        executor = ThreadPoolExecutor(self.jobs, "cmdy-pipepart")
+        try:
+            while True:
+                # the bounded reorder buffer
+                for start, end in ranges:
+                    pending.append(
+                        executor.submit(self._run_block, fd, start, end)
+                    )
+                    if len(pending) >= self.jobs * 2:
+                        break
+                if not pending:
+                    return
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            os.close(fd)
+
+    def run(self) -> List["CmdyResult"]:
+        """Run the commands and collect the results in the order of the
+        blocks"""
+        return list(self)
+
+    @property
+    def stdout(self) -> Union[str, bytes]:
+        """Run the commands and get their outputs concatenated in the order
+        of the blocks"""
+        outputs = [result.stdout for result in self]
+        if not outputs:
+            return ""
+        return ("" if isinstance(outputs[0], str) else b"").join(outputs)
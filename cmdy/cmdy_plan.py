@@ -0,0 +1,192 @@
+"""Explicit execution plans, without inspecting the fluent chain"""
+from subprocess import PIPE
+from typing import TYPE_CHECKING, Any, Union
+
+from diot import Diot
+
+from .cmdy_defaults import STDIN, STDOUT, STDERR
+from .cmdy_exceptions import CmdyActionError
+from .cmdy_plugins.redirect import redirect_pipe
+
+if TYPE_CHECKING:
+    from .cmdy import Cmdy, CmdyHolding
+    from .cmdy_bakeable import Bakeable
+    from .cmdy_result import CmdyResult, CmdyAsyncResult
+
+
+class CmdyPlan:
+    """An explicit execution plan of a command
+
+    The actions (redirect, pipe, iter, async, fg) are declared by the
+    methods of the plan instead of being detected from the fluent chain,
+    so that no frame is inspected. The plan goes straight to
+    `CmdyHolding.run` when `run()` is called.
+
+    Examples:
+        >>> plan = cmdy.plan(cmdy.ls, l=True) | cmdy.plan(cmdy.grep, "py")
+        >>> plan.redirect(stdout="/tmp/pyfiles.txt").run()
+        >>> for line in cmdy.plan(cmdy.ls).iter().run():
+        >>>     print(line, end="")
+
+    Args:
+        cmd: The command (i.e. `cmdy.ls`)
+        args: The non-keyword arguments for the command
+        kwargs: The keyword arguments for the command
+    """
+
+    def __init__(self, cmd: "Cmdy", args: tuple, kwargs: dict):
+        self.bakeable: "Bakeable" = cmd._bakeable
+        ready = cmd._compose(args, kwargs)
+        if ready.config.pop("sub", False):
+            raise CmdyActionError(
+                "Cannot plan a command with subcommands, "
+                "pass the subcommand as an argument instead."
+            )
+        self.args = cmd._with_exe(ready)
+        # composed once, copied for each run
+        self.template: "CmdyHolding" = self.bakeable.CmdyHolding._hold(
+            Diot(
+                args=self.args.args,
+                # compose_cmd consumes the kwargs, keep ours
+                kwargs=self.args.kwargs.copy(),
+                config=self.args.config,
+                popen=self.args.popen,
+            ),
+            self.bakeable,
+        )
+        self.template.fluent = False
+        self.redirects: list = []
+        self.piped_from: "CmdyPlan" = None
+        self.pipe_which = None
+        self.iter_which = None
+        self.iter_options = {}
+        self.foreground: Diot = None
+        self.is_async = False
+
+    def __repr__(self):
+        return f"<CmdyPlan: {self.args.args}>"
+
+    def redirect(
+        self,
+        stdin: Any = None,
+        stdout: Any = None,
+        stderr: Any = None,
+        append: bool = False,
+    ) -> "CmdyPlan":
+        """Redirect the pipes, the same as `.r(...) ^ ... > ...`
+
+        Args:
+            stdin: A file path, a file-like object or a CmdyResult object
+            stdout: A file path or a file-like object
+            stderr: A file path, a file-like object or STDOUT
+            append: Whether to append to the files
+
+        Returns:
+            The plan itself
+        """
+        files = ((STDIN, stdin), (STDOUT, stdout), (STDERR, stderr))
+        for which, file in files:
+            if file is not None:
+                self.redirects.append((which, file, append))
+        return self
+
+    def pipe(self, other: "CmdyPlan", which: int = STDOUT) -> "CmdyPlan":
+        """Pipe the output of this plan to the other plan
+
+        Args:
+            other: The plan to pipe to
+            which: Pipe STDOUT or STDERR
+
+        Returns:
+            The other plan
+        """
+        if which not in (STDOUT, STDERR):
+            raise CmdyActionError("Expecting STDOUT or STDERR for which.")
+        if self.iter_which or self.foreground or self.is_async:
+            raise CmdyActionError(
+                "Cannot pipe from an iterating, foreground or async plan."
+            )
+        self.pipe_which = which
+        other.piped_from = self
+        return other
+
+    __or__ = pipe
+
+    def iter(
+        self,
+        which: int = STDOUT,
+        batch: int = None,
+        chunk_bytes: int = None,
+    ) -> "CmdyPlan":
+        """Iterate over STDOUT or STDERR of the result
+
+        Args:
+            which: STDOUT or STDERR
+            batch: Yield lists of at most this number of lines
+            chunk_bytes: Yield lists of lines, split from chunks of at most
+                this number of bytes
+        """
+        self.iter_which = which
+        self.iter_options = {"batch": batch, "chunk_bytes": chunk_bytes}
+        return self
+
+    def async_(self) -> "CmdyPlan":
+        """Run the command in async mode"""
+        self.is_async = True
+        return self
+
+    def fg(
+        self, stdin: bool = False, poll_interval: float = 0.1
+    ) -> "CmdyPlan":
+        """Run the command in foreground"""
+        self.foreground = Diot(stdin=stdin, poll_interval=poll_interval)
+        return self
+
+    def holding(self) -> "CmdyHolding":
+        """Get the holding object with the actions of the plan applied"""
+        template = self.template
+        holding = object.__new__(template.__class__)
+        holding.__dict__.update(template.__dict__)
+        holding.reset()
+        holding._plugin_callframe = {}
+        holding.data["async"] = self.is_async
+        for which, file, append in self.redirects:
+            redirect_pipe(holding, which, file, append)
+        if self.piped_from:
+            self.bakeable._plugins.vendor("pipe")
+            prior = self.piped_from.holding()
+            prior.data.pipe = Diot(which=self.piped_from.pipe_which)
+            holding.data.pipe = Diot({"from": prior})
+        if self.foreground:
+            self.bakeable._plugins.vendor("fg")
+            holding.data.foreground = self.foreground.copy()
+        return holding
+
+    def run(
+        self, wait: bool = None
+    ) -> Union["CmdyResult", "CmdyAsyncResult"]:
+        """Run the plan
+
+        Args:
+            wait: Whether to wait for the command to finish. By default,
+                commands are waited unless iterating or in async mode
+
+        Returns:
+            The result
+        """
+        if wait is None:
+            wait = not self.iter_which and not self.is_async
+
+        holding = self.holding()
+        if (self.iter_which == STDOUT and holding.stdout != PIPE) or (
+            self.iter_which == STDERR and holding.stderr != PIPE
+        ):
+            raise CmdyActionError("Cannot iterate from a redirected PIPE.")
+
+        result = holding.run(wait and not self.is_async)
+        if self.iter_which:
+            self.bakeable._plugins.vendor("iter")
+            result.data.iter = Diot(
+                which=self.iter_which, **self.iter_options
+            )
+        return result
@@ -1,10 +1,8 @@
 from functools import wraps
 from typing import Callable
 
-from varname import will
-
 from .cmdy_exceptions import CmdyActionError
-from .cmdy_utils import property_or_method
+from .cmdy_utils import property_or_method, will
 
 
 def _method_enable(cls, names, func):
@@ -33,6 +31,12 @@ def _method_disable(cls, names, func):
             setattr(cls, name, cls._plugin_stacks[name].pop(0))
 
 
+def _extend_unique(actions: list, aliases: list):
+    """Extend the actions with the aliases that are not registered yet,
+    since they could have been registered from the plugin manifest"""
+    actions.extend(alias for alias in aliases if alias not in actions)
+
+
 def _plugin_funcname(func):
     """Get the function name defined in a plugin
     We will ignore the underscores on the right except for those
@@ -206,13 +210,13 @@ class PluginFactory:
         )
 
         if final:
-            finals.extend(aliases)
+            _extend_unique(finals, aliases)
 
         @wraps(func)
         def wrapper(self, *args, **kwargs):
             # Update actions
             self.did, self.curr = self.curr, self.will
-            self.will = will(2, raise_exc=False)
+            self.will = will(2) if self.fluent else ""
 
             if (
                 self.curr in finals
@@ -237,9 +241,9 @@ class PluginFactory:
             wrapper.disable = lambda: _method_disable(cls, aliases, wrapper)
 
         if cls is self.bakeable.CmdyHolding:
-            self.bakeable._holding_left.extend(aliases)
+            _extend_unique(self.bakeable._holding_left, aliases)
             if hold_right:
-                self.bakeable._holding_right.extend(aliases)
+                _extend_unique(self.bakeable._holding_right, aliases)
 
         return wrapper
 
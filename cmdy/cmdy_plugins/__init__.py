@@ -1,19 +1,212 @@
+"""Plugins shipped with cmdy
+
+The plugins are vendored lazily. The attributes they add to CmdyHolding
+and CmdyResult are listed in PLUGIN_MANIFEST and replaced by placeholders,
+a plugin is imported and vendored the first time one of them is accessed.
+"""
 from importlib import import_module
-from pathlib import Path
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Iterator
+
 from diot import Diot
 
+from ..cmdy_utils import SKIPPED_CODES
+
 if TYPE_CHECKING:
     from ..cmdy_bakeable import Bakeable
 
+# The attributes added to CmdyHolding/CmdyResult by the plugins and the
+# actions they register (see PluginFactory._plugin_then)
+# Attributes overriding existing ones (`run` of fg and pipe, `stdout` and
+# `stderr` of iter) are not listed, since they only make a difference after
+# the actions of the plugins are used.
+PLUGIN_MANIFEST = {
+    "bg": Diot(
+        holding=["background", "bg"],
+        result=[],
+        holding_left=["background", "bg"],
+        holding_right=[],
+        holding_finals=["background", "bg"],
+        result_finals=[],
+    ),
+    "fg": Diot(
+        holding=["foreground", "fg"],
+        result=[],
+        holding_left=["foreground", "fg"],
+        holding_right=[],
+        holding_finals=["foreground", "fg"],
+        result_finals=[],
+    ),
+    "iter": Diot(
+        holding=["iter", "it"],
+        result=["__iter__", "__next__", "next", "iter", "it"],
+        holding_left=["iter", "it"],
+        holding_right=[],
+        holding_finals=["iter", "it"],
+        result_finals=[],
+    ),
+    "pipe": Diot(
+        holding=["__or__", "pipe", "p", "piped_cmds", "piped_strcmds"],
+        result=["piped_cmds", "piped_strcmds"],
+        holding_left=["pipe", "p"],
+        holding_right=["pipe", "p"],
+        holding_finals=[],
+        result_finals=[],
+    ),
+    "redirect": Diot(
+        holding=[
+            "__gt__",
+            "__lt__",
+            "__xor__",
+            "__rshift__",
+            "redirect",
+            "r",
+            "redir",
+            "tee",
+        ],
+        result=[],
+        holding_left=["redirect", "r", "redir", "tee"],
+        holding_right=["redirect", "r", "redir"],
+        holding_finals=[],
+        result_finals=[],
+    ),
+    "value": Diot(
+        holding=[],
+        result=[
+            "str",
+            "astr",
+            "__contains__",
+            "__eq__",
+            "__ne__",
+            "__str__",
+            "__getattr__",
+            "int",
+            "aint",
+            "float",
+            "afloat",
+            "bytes",
+            "buffer",
+        ],
+        holding_left=[],
+        holding_right=[],
+        holding_finals=[],
+        result_finals=[],
+    ),
+}
+
+
+class LazyPluginAttribute:
+    """Placeholder of an attribute added by a plugin
+    The plugin is vendored when the attribute is first accessed
+
+    Args:
+        plugins: The plugin registry
+        plugin: The name of the plugin
+        name: The name of the attribute
+    """
+
+    def __init__(self, plugins: "PluginRegistry", plugin: str, name: str):
+        self.plugins = plugins
+        self.plugin = plugin
+        self.name = name
+
+    def __repr__(self):
+        return f"<LazyPluginAttribute: {self.plugin}.{self.name}>"
+
+    def __get__(self, obj: Any, objtype: type = None) -> Any:
+        self.plugins.vendor(self.plugin)
+        return getattr(objtype if obj is None else obj, self.name)
+
+
+# properties of the plugins are called inside __get__, which should be
+# skipped when detecting how they are called
+SKIPPED_CODES.add(LazyPluginAttribute.__get__.__code__)
+
+
+class PluginRegistry:
+    """The plugins of a bakeable
+
+    Placeholders of the attributes are put into the classes, and the
+    actions are registered from the manifest. Plugins are accessed by
+    `registry.<name>` or `registry[<name>]`, which vendors them if needed.
+
+    Args:
+        bakeable: The bakeable object
+    """
+
+    def __init__(self, bakeable: "Bakeable"):
+        self._bakeable = bakeable
+        self._vendored = {}
+
+        for plugin, manifest in PLUGIN_MANIFEST.items():
+            for name in manifest.holding:
+                setattr(
+                    bakeable.CmdyHolding,
+                    name,
+                    LazyPluginAttribute(self, plugin, name),
+                )
+            for name in manifest.result:
+                setattr(
+                    bakeable.CmdyResult,
+                    name,
+                    LazyPluginAttribute(self, plugin, name),
+                )
+            bakeable._holding_left.extend(manifest.holding_left)
+            bakeable._holding_right.extend(manifest.holding_right)
+            bakeable._holding_finals.extend(manifest.holding_finals)
+            bakeable._result_finals.extend(manifest.result_finals)
+
+    def __repr__(self):
+        return f"<PluginRegistry: vendored={list(self._vendored)}>"
+
+    def __contains__(self, name: str) -> bool:
+        return name in PLUGIN_MANIFEST
+
+    def __iter__(self) -> Iterator[str]:
+        # don't use iter(), which is shadowed by the plugin module
+        yield from PLUGIN_MANIFEST
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in PLUGIN_MANIFEST:
+            raise KeyError(name)
+        return self.vendor(name)
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in PLUGIN_MANIFEST:
+            raise AttributeError(name)
+        return self.vendor(name)
+
+    def vendor(self, name: str) -> Any:
+        """Import and vendor the plugin if it is not vendored yet
+
+        Args:
+            name: The name of the plugin
+
+        Returns:
+            The plugin object
+        """
+        if name in self._vendored:
+            return self._vendored[name]
+
+        # remove the placeholders, so that they are not taken as the
+        # original attributes when the plugin is enabled
+        bakeable = self._bakeable
+        for cls in (
+            bakeable.CmdyHolding,
+            bakeable.CmdyResult,
+            bakeable.CmdyAsyncResult,
+        ):
+            for attr, value in list(vars(cls).items()):
+                if (
+                    isinstance(value, LazyPluginAttribute)
+                    and value.plugin == name
+                ):
+                    delattr(cls, attr)
 
-def register_plugins(bakeable: "Bakeable"):
-    out = Diot()
-    for path in Path(__file__).parent.glob("*.py"):
-        if path.name.startswith("_"):
-            continue
+        module = import_module(f".{name}", package=__package__)
+        self._vendored[name] = module.vendor(bakeable)
+        return self._vendored[name]
 
-        module = import_module(f".{path.stem}", package=__package__)
-        out[path.stem] = module.vendor(bakeable)
 
-    return out
+def register_plugins(bakeable: "Bakeable") -> PluginRegistry:
+    """Register the plugins to the bakeable, without vendoring them"""
+    return PluginRegistry(bakeable)
@@ -0,0 +1,40 @@
+from typing import TYPE_CHECKING
+
+from ..cmdy_background import CmdyFuture
+from ..cmdy_exceptions import CmdyActionError
+
+if TYPE_CHECKING:
+    from ..cmdy_bakeable import Bakeable
+
+
+def vendor(bakeable: "Bakeable"):
+    """Vendor the plugins with the bakeable._plugin_factory"""
+
+    @bakeable._plugin_factory.register
+    class PluginBg:
+        """Plugin: bg
+        Running command in background, waited by the reaper thread"""
+
+        @bakeable._plugin_factory.hold_then("bg", final=True, hold_right=False)
+        def background(self):
+            """Run the command in background
+
+            Returns:
+                A future (concurrent.futures.Future) of the result
+            """
+            if self.data["async"]:
+                raise CmdyActionError(
+                    "Cannot run an async command in background, "
+                    "await it instead."
+                )
+            if self.data.get("pipe", {}).get("from"):
+                # consuming the piping
+                self.bakeable._event.clear()
+            elif self.bakeable._event.is_set():
+                raise CmdyActionError(
+                    "Cannot pipe to a command in background directly, "
+                    "hold it first: (cmdy.a().p() | cmdy.b().h()).bg()"
+                )
+            return CmdyFuture(self.run(False))
+
+    return PluginBg()
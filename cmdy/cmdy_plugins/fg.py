@@ -6,6 +6,7 @@ from typing import TYPE_CHECKING, Union
 import curio
 from curio import subprocess
 
+from ..cmdy_engine import forward_sync
 from ..cmdy_exceptions import CmdyTimeoutError
 
 if TYPE_CHECKING:
@@ -112,11 +113,19 @@ def vendor(bakeable: "Bakeable"):
             ret = orig_run(self, False)
 
             # we should handle timeout here, since we are not waiting
-            curio.run(
-                PluginFg._timeout_wrapper(
-                    ret, self.data.foreground.poll_interval
+            if self.engine == "sync" and not self.data["async"]:
+                forward_sync(
+                    ret.proc,
+                    {ret.proc.stdout: sys.stdout, ret.proc.stderr: sys.stderr},
+                    self.encoding,
+                    self.timeout,
+                )
+            else:
+                curio.run(
+                    PluginFg._timeout_wrapper(
+                        ret, self.data.foreground.poll_interval
+                    )
                 )
-            )
             # we can't in self.wait() in curio.run, because there is
             # already a curio kernel running inside CmdyResult.wait()
             return (
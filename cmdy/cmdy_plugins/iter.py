@@ -2,9 +2,9 @@ from typing import TYPE_CHECKING
 
 from curio import subprocess
 
-from ..cmdy_defaults import STDOUT, STDERR
+from ..cmdy_defaults import BOTH, STDOUT, STDERR
 from ..cmdy_exceptions import CmdyActionError
-from ..cmdy_utils import SyncStreamFromAsync
+from ..cmdy_engine import SYNC_STREAMS, TaggedStreams, sync_stream
 
 if TYPE_CHECKING:
     from ..cmdy_bakeable import Bakeable
@@ -13,6 +13,14 @@ if TYPE_CHECKING:
 def vendor(bakeable: "Bakeable"):
     """Vendor the plugins with the bakeable._plugin_factory"""
 
+    def tagged_streams(result):
+        """Get the stream of the (which, line) of both stdout and stderr,
+        shared by the two properties"""
+        result._stdout = result._stderr = TaggedStreams(
+            result.proc.stdout, result.proc.stderr, result.holding.encoding
+        )
+        return result._stdout
+
     @bakeable._plugin_factory.register
     class PluginIter:
         """Plugin: iter
@@ -40,8 +48,10 @@ def vendor(bakeable: "Bakeable"):
                 return orig_stdout.fget(self)
 
             which = self.data.iter.get("which", STDOUT)
-            self._stdout = SyncStreamFromAsync(
-                self.proc.stdout, self.holding.encoding
+            if which == BOTH:
+                return tagged_streams(self)
+            self._stdout = sync_stream(
+                self.proc.stdout, self.holding.encoding, self.holding.engine
             )
             if which != STDOUT:
                 self._stdout = self._stdout.dump()
@@ -64,8 +74,10 @@ def vendor(bakeable: "Bakeable"):
                 return orig_stderr.fget(self)
 
             which = self.data.iter.get("which", STDOUT)
-            self._stderr = SyncStreamFromAsync(
-                self.proc.stderr, self.holding.encoding
+            if which == BOTH:
+                return tagged_streams(self)
+            self._stderr = sync_stream(
+                self.proc.stderr, self.holding.encoding, self.holding.engine
             )
             if which != STDERR:
                 self._stderr = self._stderr.dump()
@@ -79,48 +91,78 @@ def vendor(bakeable: "Bakeable"):
         def next(self, timeout=None):
             """Get next row, with a timeout limit
             If nothing produced after the timeout, returns an empty string
+
+            In batch mode (`iter(batch=N)` or `iter(chunk_bytes=N)`), a list
+            of rows is returned, which is empty if nothing produced after
+            the timeout.
+
+            Iterating over both stdout and stderr (`iter(BOTH)`), a tuple of
+            STDOUT or STDERR and the row (or the list of rows in batch mode)
+            is returned, which is None if nothing produced after the timeout.
             """
-            which = self.data.get("iter", {}).get("which", STDOUT)
+            # Diot.get() makes a Diot of the default, avoid it for each line
+            iter_data = self.data.get("iter")
+            which = iter_data.get("which", STDOUT) if iter_data else STDOUT
             try:
                 if which == STDOUT:
-                    if not isinstance(self.stdout, SyncStreamFromAsync):
-                        raise TypeError(
-                            "CmdyResult object is not iterable "
-                            "synchronously"
-                        )
-                    return self.stdout.next(timeout)
-
-                if not isinstance(self.stderr, SyncStreamFromAsync):
+                    stream = self.stdout
+                else:
+                    stream = self.stderr
+                if not isinstance(stream, SYNC_STREAMS):
                     raise TypeError(
                         "CmdyResult object is not iterable " "synchronously"
                     )
-                return self.stderr.next(timeout)
+                if iter_data and (
+                    iter_data.get("batch") or iter_data.get("chunk_bytes")
+                ):
+                    return stream.next_lines(
+                        timeout, iter_data.batch, iter_data.chunk_bytes
+                    )
+                return stream.next(timeout)
             except StopIteration:
                 # self.data.iter = {}
                 self.wait()
                 raise
 
         @bakeable._plugin_factory.run_then("it")
-        def iter(self, which=None):  # pylint: disable=redefined-builtin
-            """Iterator over STDOUT or STDERR of a CmdyResult object"""
+        def iter(
+            self, which=None, batch=None, chunk_bytes=None
+        ):  # pylint: disable=redefined-builtin
+            """Iterator over STDOUT or STDERR of a CmdyResult object, or
+            both of them
+
+            Args:
+                which: STDOUT, STDERR, or BOTH to read them concurrently and
+                    iterate over the (STDOUT or STDERR, line) tuples in the
+                    order the lines come
+                batch: Yield lists of at most this number of lines
+                chunk_bytes: Yield lists of lines, split from chunks of
+                    at most this number of bytes
+            """
 
             which = which or STDOUT
             self.data.iter.which = which
+            self.data.iter.batch = batch
+            self.data.iter.chunk_bytes = chunk_bytes
 
             if (
-                which == STDOUT and self.holding.stdout != subprocess.PIPE
-            ) or (which == STDERR and self.holding.stderr != subprocess.PIPE):
+                which in (STDOUT, BOTH)
+                and self.holding.stdout != subprocess.PIPE
+            ) or (
+                which in (STDERR, BOTH)
+                and self.holding.stderr != subprocess.PIPE
+            ):
                 raise CmdyActionError("Cannot iterate from a redirected PIPE.")
 
             return self
 
         @bakeable._plugin_factory.hold_then("it", final=True, hold_right=False)
-        def iter_(self, which=None):
+        def iter_(self, which=None, batch=None, chunk_bytes=None):
             """Put holding on running and iterator over STDOUT or STDERR"""
             self.should_wait = False
 
             if self._onhold():
                 return self
-            return self.run().iter(which)
+            return self.run().iter(which, batch, chunk_bytes)
 
     return PluginIter()
@@ -91,6 +91,10 @@ def vendor(bakeable: "Bakeable"):
                     "to pipe from non-piping command"
                 )
 
+            if isinstance(other, bakeable.CmdyFanout):
+                self.bakeable._event.clear()
+                return other.run(self)
+
             assert isinstance(other, bakeable.CmdyHolding), (
                 "Can only pipe to " "a CmdyHolding object."
             )
@@ -130,24 +134,12 @@ def vendor(bakeable: "Bakeable"):
 
         @bakeable._plugin_factory.add_method(bakeable.CmdyHolding)
         def run(self, wait=None):
-            """From from prior piped command"""
-            orig_run = self._original("run")
-
-            if not self.data.get("pipe", {}).get("from"):
-                return orig_run(self, wait)
-
-            prior = self.data.pipe["from"]
-            prior_result = prior.run(False)
-            self.data.pipe["from"] = prior
-
-            self.stdin = (
-                prior_result.proc.stdout
-                if prior.data.pipe.which == STDOUT
-                else prior_result.proc.stderr
-            )
+            """Run the prior piped commands and this one as a pipeline"""
+            pipe = self.data.get("pipe")
+            # the stages are run by the pipeline
+            if pipe and pipe.get("from") and not pipe.get("pipeline"):
+                return bakeable.CmdyPipeline(self).run(wait)
 
-            ret = orig_run(self, wait)
-            prior_result.wait()
-            return ret
+            return self._original("run")(self, wait)
 
     return PluginPipe()
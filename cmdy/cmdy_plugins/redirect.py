@@ -1,12 +1,98 @@
+from functools import partial
+from subprocess import PIPE
 from typing import TYPE_CHECKING, Any
 
 from ..cmdy_defaults import STDIN, STDOUT, STDERR
+from ..cmdy_engine import PipeRelay, PipeTee
 from ..cmdy_exceptions import CmdyActionError
 
 if TYPE_CHECKING:
+    from ..cmdy import CmdyHolding
     from ..cmdy_bakeable import Bakeable
 
 
+def redirect_pipe(
+    holding: "CmdyHolding",
+    which: int,
+    file: Any,
+    append: bool = False,
+    capture: bool = False,
+):
+    """Redirect a pipe of the holding object to/from the file
+
+    Args:
+        holding: The holding object
+        which: STDIN, STDOUT or STDERR
+        file: A file path, a file-like object, a CmdyResult or CmdyMerge
+            object (STDIN) or STDOUT (STDERR)
+        append: Whether to append to the file
+        capture: Whether to capture the output as well (STDOUT/STDERR)
+    """
+    if which == STDIN:
+        if isinstance(file, holding.bakeable.CmdyResult):
+            if file._rc is not None and file.holding.stdout == PIPE:
+                # finished, the output has been drained from the pipe
+                holding.stdin = PIPE
+                holding.input = bytes(file._capture(STDOUT))
+            else:
+                holding.stdin = file.proc.stdout
+            holding.should_close_fds.stdin = None
+        elif isinstance(file, holding.bakeable.CmdyMerge):
+            holding.stdin = file.pipe()
+            holding.should_close_fds.stdin = file
+        elif hasattr(file, "read"):
+            holding.stdin = file
+            holding.should_close_fds.stdin = None
+        else:
+            holding.stdin = open(file, "r", encoding=holding.encoding)
+            holding.should_close_fds.stdin = holding.stdin
+
+    elif which == STDOUT:
+        if file == STDERR:
+            raise CmdyActionError("Cannot redirect STDOUT to STDERR.")
+        if hasattr(file, "read"):
+            holding.stdout = file
+            holding.should_close_fds.stdout = None
+        else:
+            holding.stdout = open(
+                file, "a" if append else "w", encoding=holding.encoding
+            )
+            holding.should_close_fds.stdout = holding.stdout
+    elif which == STDERR:
+        if file == STDOUT:
+            holding.stderr = STDOUT
+            holding.should_close_fds.stderr = None
+        elif hasattr(file, "read"):
+            holding.stderr = file
+            holding.should_close_fds.stderr = None
+        else:
+            holding.stderr = open(
+                file, "a" if append else "w", encoding=holding.encoding
+            )
+            holding.should_close_fds.stderr = holding.stderr
+    else:
+        raise CmdyActionError(
+            "Don't know what to redirect. "
+            "Expecting STDIN, STDOUT or STDERR"
+        )
+
+    if which == STDIN:
+        return
+
+    name = "stdout" if which == STDOUT else "stderr"
+    # the latest redirection wins
+    holding.relays.pop(name, None)
+    if capture and file != STDOUT:
+        # relayed to the file when running, with the pipe kept
+        file = getattr(holding, name)
+        holding.relays[name] = partial(
+            PipeRelay,
+            dest=file,
+            closing=holding.should_close_fds.get(name) is file,
+        )
+        setattr(holding, name, PIPE)
+
+
 def vendor(bakeable: "Bakeable"):
     """Vendor the plugins with the bakeable._plugin_factory"""
 
@@ -29,46 +115,13 @@ def vendor(bakeable: "Bakeable"):
                 )
             curr_pipe = which.pop(0)
             self.data.redirect.which = which
-
-            if curr_pipe == STDIN:
-                if isinstance(file, bakeable.CmdyResult):
-                    self.stdin = file.proc.stdout
-                    self.should_close_fds.stdin = None
-                elif hasattr(file, "read"):
-                    self.stdin = file
-                    self.should_close_fds.stdin = None
-                else:
-                    self.stdin = open(file, "r", encoding=self.encoding)
-                    self.should_close_fds.stdin = self.stdin
-
-            elif curr_pipe == STDOUT:
-                if file == STDERR:
-                    raise CmdyActionError("Cannot redirect STDOUT to STDERR.")
-                if hasattr(file, "read"):
-                    self.stdout = file
-                    self.should_close_fds.stdout = None
-                else:
-                    self.stdout = open(
-                        file, "a" if append else "w", encoding=self.encoding
-                    )
-                    self.should_close_fds.stdout = self.stdout
-            elif curr_pipe == STDERR:
-                if file == STDOUT:
-                    self.stderr = STDOUT
-                    self.should_close_fds.stderr = None
-                elif hasattr(file, "read"):
-                    self.stderr = file
-                    self.should_close_fds.stderr = None
-                else:
-                    self.stderr = open(
-                        file, "a" if append else "w", encoding=self.encoding
-                    )
-                    self.should_close_fds.stderr = self.stderr
-            else:
-                raise CmdyActionError(
-                    "Don't know what to redirect. "
-                    "Expecting STDIN, STDOUT or STDERR"
-                )
+            redirect_pipe(
+                self,
+                curr_pipe,
+                file,
+                append,
+                self.data.redirect.get("capture", False),
+            )
 
             # Since we are holding right, set did to ''
             # to let the right action run
@@ -107,8 +160,12 @@ def vendor(bakeable: "Bakeable"):
             return PluginRedirect._redirect(self, list(which), True, file)
 
         @bakeable._plugin_factory.hold_then("r,redir", hold_right=True)
-        def redirect(self, *which):
-            """Redirect the input/output"""
+        def redirect(self, *which, capture=False):
+            """Redirect the input/output
+
+            With `capture=True`, the outputs are captured as well, while
+            being moved to the files in the kernel where possible
+            """
 
             # We should wait for the command to finish, so that we
             # don't leave it piping in background
@@ -124,7 +181,43 @@ def vendor(bakeable: "Bakeable"):
 
             # initialize data
             self.data.redirect.which = list(which)
+            self.data.redirect.capture = capture
+
+            return self
+
+        @bakeable._plugin_factory.hold_then(hold_right=False)
+        def tee(self, stdout=None, stderr=None, capture=False):
+            """Send the outputs to the sinks as they come
+
+            The sinks of an output can be file-like objects, file paths,
+            callables taking the data, STDOUT or STDERR (sys.stdout or
+            sys.stderr). They get str if the command has an encoding, the
+            binary files get bytes. The output is read once and fanned out
+            to the sinks, each with a bounded buffer, so that a slow sink
+            slows down the command instead of the data piling up.
+
+            Args:
+                stdout: A sink or a list of sinks for the stdout
+                stderr: A sink or a list of sinks for the stderr
+                capture: Whether to capture the outputs as well
+            """
+            self.should_wait = True
+            for name, sinks in (("stdout", stdout), ("stderr", stderr)):
+                if sinks is None:
+                    continue
+                if getattr(self, name) != PIPE:
+                    raise CmdyActionError("Cannot tee a redirected pipe.")
+                if not isinstance(sinks, (list, tuple)):
+                    sinks = [sinks]
+                self.relays[name] = partial(
+                    PipeTee,
+                    sinks=list(sinks),
+                    encoding=self.encoding,
+                    capture=capture,
+                )
 
+            if not self._onhold():
+                return self.run()
             return self
 
     return PluginRedirect()
@@ -150,4 +150,31 @@ def vendor(bakeable: "Bakeable"):
             """Async version of float"""
             return float(await self.astr(which))
 
+        def _raw(
+            self: bakeable.CmdyResult,  # type: ignore
+            which: int,
+        ) -> bytearray:
+            which = which or STDOUT
+            if which not in (STDOUT, STDERR):
+                raise CmdyActionError("Expecting STDOUT or STDERR for which.")
+            if (
+                which == STDOUT and self.holding.stdout != subprocess.PIPE
+            ) or (which == STDERR and self.holding.stderr != subprocess.PIPE):
+                raise CmdyActionError(
+                    "Cannot fetch results from " "a redirected PIPE."
+                )
+
+            self.wait()
+            return self._capture(which)
+
+        @bakeable._plugin_factory.run_then
+        def bytes(self, which=None):  # pylint: disable=redefined-builtin
+            """Fetch the raw results as bytes"""
+            return bytes(PluginValue._raw(self, which))
+
+        @bakeable._plugin_factory.run_then
+        def buffer(self, which=None):
+            """Fetch the raw results as a memoryview, without copying"""
+            return memoryview(PluginValue._raw(self, which))
+
     return PluginValue()
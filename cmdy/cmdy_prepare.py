@@ -0,0 +1,190 @@
+"""Prepared commands, composed once and run with different slot values"""
+import re
+from typing import TYPE_CHECKING, Any, List, Union
+
+from diot import Diot
+
+from .cmdy_defaults import STDOUT, STDERR, config_generation
+from .cmdy_exceptions import CmdyActionError
+
+if TYPE_CHECKING:
+    from .cmdy import Cmdy, CmdyHolding
+    from .cmdy_bakeable import Bakeable
+    from .cmdy_result import CmdyResult, CmdyAsyncResult
+
+SLOT_MARKER = "\x00cmdy-slot:{}\x00"
+SLOT_REGEX = re.compile("\x00cmdy-slot:([^\x00]+)\x00")
+
+
+class CmdySlot:
+    """A placeholder of a value to be filled when a prepared command runs
+
+    A slot can be an argument, a value of a keyword argument, or part of
+    a string argument (`f"--region={cmdy.slot('region')}"`). It is put into
+    the command as a marker, which is replaced when the command runs.
+
+    Args:
+        name: The name of the slot, should be a valid identifier
+    """
+
+    def __init__(self, name: str):
+        if not name.isidentifier():
+            raise ValueError(f"Invalid slot name: {name!r}")
+        self.name = name
+
+    def __repr__(self):
+        return f"<CmdySlot: {self.name}>"
+
+    def __str__(self):
+        return SLOT_MARKER.format(self.name)
+
+
+class CmdyPrepared:
+    """A command composed once, to run many times with different values
+
+    The arguments and configurations are parsed and the command is composed
+    when it is prepared. Running it only fills the slots and spawns the
+    process from a copy of the prepared holding object. The command is
+    prepared again when the configurations change.
+
+    Examples:
+        >>> view = cmdy.prepare(
+        >>>     cmdy.samtools.view,
+        >>>     b=True,
+        >>>     _=[cmdy.slot("region"), cmdy.slot("bam")],
+        >>> )
+        >>> view.run(region="chr1", bam="a.bam")
+        >>> for line in view.iter().run(region="chr2", bam="b.bam"):
+        >>>     print(line, end="")
+
+    Args:
+        cmd: The command (i.e. `cmdy.ls`)
+        args: The non-keyword arguments for the command
+        kwargs: The keyword arguments for the command
+    """
+
+    def __init__(self, cmd: "Cmdy", args: tuple, kwargs: dict):
+        self.bakeable: "Bakeable" = cmd._bakeable
+        self.iter_which = None
+        self.iter_options = {}
+        self.is_async = False
+        # kept to prepare again when the configurations change
+        self._cmd = cmd
+        self._cmd_args = cmd._args.args[:]
+        self._args = args
+        self._kwargs = kwargs
+        self._prepare()
+
+    def _prepare(self):
+        """Compose the command and find the slots in it"""
+        self.generation = config_generation()
+        # _compose clears the subcommands
+        self._cmd._args.args = self._cmd_args[:]
+        ready = self._cmd._compose(self._args, self._kwargs.copy())
+        if ready.config.pop("sub", False):
+            raise CmdyActionError(
+                "Cannot prepare a command with subcommands, "
+                "pass the subcommand as an argument instead."
+            )
+        self.template: "CmdyHolding" = self.bakeable.CmdyHolding._hold(
+            self._cmd._with_exe(ready), self.bakeable
+        )
+        self.template.fluent = False
+
+        self.slots = set()
+        # index => str.format template of the parts with slots
+        self._fills = {}
+        for i, part in enumerate(self.template.cmd):
+            pieces = SLOT_REGEX.split(part)
+            if len(pieces) == 1:
+                continue
+            # the literals are at even positions and the slots at odd ones
+            self.slots.update(pieces[1::2])
+            self._fills[i] = "".join(
+                "{%s}" % piece
+                if j % 2
+                else piece.replace("{", "{{").replace("}", "}}")
+                for j, piece in enumerate(pieces)
+            )
+
+    def __repr__(self):
+        return f"<CmdyPrepared: {self.template.cmd}>"
+
+    def iter(
+        self,
+        which: int = STDOUT,
+        batch: int = None,
+        chunk_bytes: int = None,
+    ) -> "CmdyPrepared":
+        """Iterate over STDOUT or STDERR of the results
+
+        Args:
+            which: STDOUT or STDERR
+            batch: Yield lists of at most this number of lines
+            chunk_bytes: Yield lists of lines, split from chunks of at most
+                this number of bytes
+        """
+        if which not in (STDOUT, STDERR):
+            raise CmdyActionError("Expecting STDOUT or STDERR for which.")
+        self.iter_which = which
+        self.iter_options = {"batch": batch, "chunk_bytes": chunk_bytes}
+        return self
+
+    def async_(self) -> "CmdyPrepared":
+        """Run the command in async mode"""
+        self.is_async = True
+        return self
+
+    def compose(self, **values: Any) -> List[str]:
+        """Fill the slots of the command with the values
+
+        Args:
+            **values: The values of the slots
+
+        Returns:
+            The command to spawn
+        """
+        if values.keys() != self.slots:
+            missing = self.slots - values.keys()
+            unknown = values.keys() - self.slots
+            raise ValueError(
+                f"Values are expected for slots {sorted(self.slots)}, "
+                f"missing: {sorted(missing)}, unknown: {sorted(unknown)}."
+            )
+        cmd = self.template.cmd[:]
+        for i, fill in self._fills.items():
+            cmd[i] = fill.format_map(values)
+        return cmd
+
+    def holding(self, **values: Any) -> "CmdyHolding":
+        """Get a holding object to run with the slots filled"""
+        if config_generation() != self.generation:
+            self._prepare()
+        template = self.template
+        holding = object.__new__(template.__class__)
+        holding.__dict__.update(template.__dict__)
+        holding.cmd = self.compose(**values)
+        holding._plugin_callframe = {}
+        holding.should_close_fds = Diot()
+        holding.data = Diot({"async": self.is_async, "hold": False})
+        return holding
+
+    def run(self, **values: Any) -> Union["CmdyResult", "CmdyAsyncResult"]:
+        """Run the command with the slots filled
+
+        Commands are waited unless iterating or in async mode.
+
+        Args:
+            **values: The values of the slots
+
+        Returns:
+            The result
+        """
+        holding = self.holding(**values)
+        result = holding.run(not self.iter_which and not self.is_async)
+        if self.iter_which:
+            self.bakeable._plugins.vendor("iter")
+            result.data.iter = Diot(
+                which=self.iter_which, **self.iter_options
+            )
+        return result
@@ -0,0 +1,247 @@
+"""Python functions as stages of pipelines, running in threads"""
+import os
+import subprocess
+import traceback
+from codecs import getincrementaldecoder
+from threading import Lock, Thread
+from typing import IO, TYPE_CHECKING, Any, Callable, List, Tuple
+
+from diot import Diot
+
+from .cmdy_engine import write_all
+from .cmdy_utils import read_size, split_lines
+
+if TYPE_CHECKING:
+    from curio.subprocess import Popen
+    from .cmdy_bakeable import Bakeable
+
+# The return code of a stage whose output is closed early, like a process
+# killed by SIGPIPE
+SIGPIPE_RC = -13
+
+
+def _stage_end(pipe: Any, fd: int, reading: bool) -> Tuple[int, IO]:
+    """Get the fd for the stage to read from or write to, from the stdin,
+    stdout or stderr argument of subprocess.Popen
+
+    Args:
+        pipe: The argument
+        fd: The fd of ours to inherit when the argument is None
+        reading: Whether the stage reads from it
+
+    Returns:
+        The fd of the stage, and our end of the pipe if PIPE
+    """
+    if pipe == subprocess.PIPE:
+        read_end, write_end = os.pipe()
+        if reading:
+            return read_end, open(write_end, "wb", buffering=0)
+        return write_end, open(read_end, "rb", buffering=0)
+    if pipe == subprocess.DEVNULL:
+        flags = os.O_RDONLY if reading else os.O_WRONLY
+        return os.open(os.devnull, flags), None
+    if pipe is None:
+        return os.dup(fd), None
+    if isinstance(pipe, int):
+        return os.dup(pipe), None
+    return os.dup(pipe.fileno()), None
+
+
+class ThreadPopen:
+    """A Python function transforming the data from a pipe to another in
+    a thread, with the interface of subprocess.Popen used by cmdy
+
+    The function is called with each line (or each chunk) read, decoded
+    with the encoding if any, and returns the data to write, or None to
+    write nothing. Reading and writing block on the pipes, so that the
+    stage applies backpressure as a process does.
+
+    The return code is 0 when finished, 1 when the function raises, with
+    the traceback written to the stderr, -13 when the output is closed
+    early, and -9 when killed.
+
+    Args:
+        args: The command of the stage, for the errors
+        func: The function to transform the data
+        lines: Whether to call the function with lines or chunks
+        encoding: The encoding to decode the data and to encode the str
+            returned by the function
+        stdin: The stdin, as the argument of subprocess.Popen
+        stdout: The stdout, as the argument of subprocess.Popen
+        stderr: The stderr, as the argument of subprocess.Popen
+    """
+
+    def __init__(
+        self,
+        args: List[str],
+        func: Callable,
+        lines: bool = True,
+        encoding: str = None,
+        stdin: Any = None,
+        stdout: Any = None,
+        stderr: Any = None,
+    ):
+        self.args = args
+        self.func = func
+        self.lines = lines
+        self.encoding = encoding
+        self.pid = None
+        self.returncode = None
+        self._killed = False
+        # the fds of the stage, replaced when killed, closed when finished
+        self._fds: List[int] = []
+        self._fds_lock = Lock()
+
+        fds = []
+        try:
+            fd, self.stdin = _stage_end(stdin, 0, True)
+            fds.append(fd)
+            # the stream may be non-blocking, used by the engine before
+            os.set_blocking(fd, True)
+            fd, self.stdout = _stage_end(stdout, 1, False)
+            fds.append(fd)
+            if stderr == subprocess.STDOUT:
+                fd, self.stderr = os.dup(fds[1]), None
+            else:
+                fd, self.stderr = _stage_end(stderr, 2, False)
+            fds.append(fd)
+        except BaseException:
+            for fd in fds:
+                os.close(fd)
+            raise
+
+        self._fds = fds
+        self._thread = Thread(target=self._run, args=fds, daemon=True)
+        self._thread.start()
+
+    def __repr__(self):
+        return f"<ThreadPopen: {self.args} returncode={self.returncode}>"
+
+    def poll(self) -> int:
+        """Get the return code, None if not finished"""
+        return self.returncode
+
+    def wait(self, timeout: float = None) -> int:
+        """Wait for the function to finish, not waited if killed
+
+        Raises:
+            subprocess.TimeoutExpired: When not finished within timeout
+        """
+        if self._killed:
+            return self.returncode
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def kill(self):
+        """Let the stage go, with the return code -9
+
+        The thread can't be stopped while the function runs, so the fds of
+        the stage are replaced with /dev/null, to release the pipes for the
+        other stages to get an EOF or a SIGPIPE. The thread reads an EOF
+        and writes nothing afterwards, and stops after the chunk being
+        transformed.
+        """
+        with self._fds_lock:
+            if self.returncode is not None:
+                return
+            self._killed = True
+            self.returncode = -9
+            null = os.open(os.devnull, os.O_RDWR)
+            try:
+                for fd in self._fds:
+                    # atomically, not to let the fd be taken by others
+                    os.dup2(null, fd)
+            finally:
+                os.close(null)
+
+    terminate = kill
+
+    def _run(self, stdin: int, stdout: int, stderr: int):
+        try:
+            returncode = self._transform(stdin, stdout)
+        except BrokenPipeError:
+            returncode = SIGPIPE_RC
+        except Exception:  # pylint: disable=broad-except
+            returncode = 1
+            try:
+                write_all(stderr, traceback.format_exc().encode())
+            except OSError:  # pragma: no cover
+                pass
+        finally:
+            with self._fds_lock:
+                for fd in (stdin, stdout, stderr):
+                    os.close(fd)
+                self._fds = []
+                if self.returncode is None:
+                    self.returncode = returncode
+
+    def _transform(self, stdin: int, stdout: int) -> int:
+        size = read_size(stdin)
+        buffer = bytearray()
+        decoder = (
+            getincrementaldecoder(self.encoding)() if self.encoding else None
+        )
+        while not self._killed:
+            data = os.read(stdin, size)
+            if self.lines:
+                buffer += data
+                items = split_lines(buffer, self.encoding, None, not data)
+            elif decoder is not None:
+                items = [decoder.decode(data, not data)]
+            else:
+                items = [data]
+
+            outputs = []
+            for item in items:
+                if not item:
+                    continue
+                output = self.func(item)
+                if output is None:
+                    continue
+                if isinstance(output, str):
+                    output = output.encode(self.encoding or "utf-8")
+                outputs.append(output)
+            if outputs:
+                write_all(stdout, b"".join(outputs))
+            if not data:
+                return 0
+        return -9
+
+
+class CmdyPyStage:
+    """A Python function as a stage of a pipeline
+
+    Built by `cmdy.pystage(func)`. It is a holding object, so it can be
+    piped from and to (`.p()`) and redirected like a command, but instead
+    of spawning a process, the function runs in a thread between the pipes.
+    """
+
+    def __init__(self, args: Diot, bakeable: "Bakeable", will: str = None):
+        # the pluginable one of the bakeable, with the plugin hooks
+        bakeable.CmdyHolding.__init__(self, args, bakeable, will)
+        self.func = args.func
+        self.lines = args.lines
+
+    def __repr__(self):
+        return f"<CmdyPyStage: {self.cmd}>"
+
+    def _spawn(self) -> "Popen":
+        from curio.io import FileStream
+        from curio.subprocess import Popen
+
+        proc = Popen.__new__(Popen)
+        proc._popen = ThreadPopen(
+            self.cmd,
+            self.func,
+            self.lines,
+            self.encoding,
+            stdin=self.stdin,
+            stdout=self.stdout,
+            stderr=self.stderr,
+        )
+        for name in ("stdin", "stdout", "stderr"):
+            pipe = getattr(proc._popen, name)
+            setattr(proc, name, pipe and FileStream(pipe))
+        return proc
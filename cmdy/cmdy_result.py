@@ -1,13 +1,18 @@
-import inspect
+from collections import deque
 from shlex import quote
+from subprocess import PIPE
 
-import curio
-from curio import subprocess
 from diot import Diot
 
-from .cmdy_defaults import STDOUT
+from .cmdy_defaults import BOTH, STDOUT, STDERR
 from .cmdy_exceptions import CmdyTimeoutError, CmdyReturnCodeError
-from .cmdy_utils import SyncStreamFromAsync, raise_return_code_error
+from .cmdy_engine import (
+    capture,
+    communicate,
+    communicate_async,
+    feed_input,
+)
+from .cmdy_utils import raise_return_code_error, read_size, split_lines
 
 
 class CmdyResult:
@@ -19,10 +24,22 @@ class CmdyResult:
         self.holding = holding
         self.did = self.curr = ""
         self.will = holding.will
+        self.fluent = holding.fluent
         self._stdout = None
         self._stderr = None
+        # the raw outputs captured
+        self._raw = {}
         self.data = Diot()
         self._rc = None
+        # lines split but not fetched yet, iterating in batch mode async,
+        # or the (which, lines) iterating over both outputs async
+        self._lines = []
+        # the queue of the chunks read from both outputs async
+        self._both = None
+        # the rest of the input to feed to the stdin
+        self._input = feed_input(proc.stdin, holding.input)
+        # the pipeline if this is the last stage of one
+        self.pipeline = None
 
     def __repr__(self):
         return f"<CmdyResult: {self.cmd}>"
@@ -50,27 +67,53 @@ class CmdyResult:
         """Get the stringified cmd"""
         return " ".join(quote(cmdpart) for cmdpart in self.cmd)
 
+    def _piped(self) -> int:
+        """Which output is piped to the next command, if any"""
+        pipe = self.holding.data.get("pipe")
+        return pipe.get("which") if pipe else None
+
+    def _pipes(self):
+        """Get the output pipes to drain, the stdin pipe to close and the
+        input to feed to it while waiting
+
+        The output pipes redirected or piped to other commands are not
+        drained.
+        """
+        holding = self.holding
+        piped = self._piped()
+        streams = []
+        if holding.stdout == PIPE and piped != STDOUT:
+            streams.append(self.proc.stdout)
+        if holding.stderr == PIPE and piped != STDERR:
+            streams.append(self.proc.stderr)
+        stdin = self.proc.stdin if holding.stdin == PIPE else None
+        return streams, stdin, self._input
+
     def wait(self):
-        """Wait until command is done"""
-        timeout = self.holding.timeout
+        """Wait until command is done
+
+        The outputs are drained concurrently while waiting, so that the
+        command is not blocked by a full pipe. If this is the last stage of
+        a pipeline, all the stages are waited.
+        """
+        if self.pipeline is not None:
+            return self.pipeline.wait()
         try:
-            if timeout:
-                self._rc = curio.run(
-                    curio.timeout_after(timeout, self.proc.wait)
-                )
-            else:
-                self._rc = curio.run(self.proc.wait())
-        except curio.TaskTimeout:
-            self.proc.kill()
-            raise CmdyTimeoutError(
-                f"Timeout after {self.holding.timeout} seconds."
-            ) from None
-        else:
+            streams, stdin, input_ = self._pipes()
+            self._rc = communicate(
+                [self.proc],
+                streams,
+                stdin,
+                self.holding.timeout,
+                self.holding.engine,
+                input_,
+            )[0]
+            self._input = None
             if self._rc not in self.holding.okcode and self.holding.raise_:
                 raise CmdyReturnCodeError(self)
-            return self
         finally:
             self._close_fds()
+        return self
 
     def _close_fds(self):
         if not self.holding.should_close_fds:
@@ -79,33 +122,75 @@ class CmdyResult:
             if filed:
                 filed.close()
 
+    def _capture(
+        self, which: int = STDOUT, keep: bool = True
+    ) -> bytearray:
+        """Get the raw output of the command
+
+        The output is captured at once. `stdout` and `stderr` are decoded
+        from it without keeping it, so that the output is not held twice.
+        It is encoded back if asked for after decoded.
+
+        Args:
+            which: STDOUT or STDERR
+            keep: Whether to keep the raw output, for `bytes()` and
+                `buffer()` to return the same data without copying
+
+        Returns:
+            The raw output, None if the pipe is redirected
+        """
+        if which == STDOUT:
+            pipe, stream = self.holding.stdout, self.proc.stdout
+            decoded = self._stdout
+        else:
+            pipe, stream = self.holding.stderr, self.proc.stderr
+            decoded = self._stderr
+        if pipe != PIPE or which == self._piped():
+            # redirected or piped, we are unable to fetch the output
+            return None
+        raw = self._raw.get(which)
+        if raw is None:
+            if decoded is None:
+                raw = capture(stream, self.holding.engine)
+            elif self.holding.encoding:
+                raw = bytearray(decoded.encode(self.holding.encoding))
+            else:
+                raw = bytearray(decoded)
+            if keep:
+                self._raw[which] = raw
+        return raw
+
+    def _decode(self, raw: bytearray):
+        if self.holding.encoding:
+            return raw.decode(self.holding.encoding)
+        return bytes(raw)
+
     @property
     def stdout(self):
         """The stdout of the command"""
-        if self.holding.stdout != subprocess.PIPE:
-            # redirected, we are unable to fetch the stdout
-            return None
-
         if self._stdout is not None:
             return self._stdout
 
-        self._stdout = SyncStreamFromAsync(
-            self.proc.stdout, encoding=self.holding.encoding
-        ).dump()
+        if self._rc is None:
+            # both outputs drained, not to be blocked by the other one
+            self.wait()
+        raw = self._capture(STDOUT, False)
+        if raw is not None:
+            self._stdout = self._decode(raw)
         return self._stdout
 
     @property
     def stderr(self):
         """The stderr of the command"""
-        if self.holding.stderr != subprocess.PIPE:
-            # redirected, we are unable to fetch the stdout
-            return None
-
         if self._stderr is not None:
             return self._stderr
-        self._stderr = SyncStreamFromAsync(
-            self.proc.stderr, encoding=self.holding.encoding
-        ).dump()
+
+        if self._rc is None:
+            # both outputs drained, not to be blocked by the other one
+            self.wait()
+        raw = self._capture(STDERR, False)
+        if raw is not None:
+            self._stderr = self._decode(raw)
         return self._stderr
 
 
@@ -116,6 +201,8 @@ class CmdyAsyncResult:
         return f"<CmdyAsyncResult: {self.cmd}>"
 
     async def _close_fds(self):
+        import inspect
+
         if not self.holding.should_close_fds:
             return
         try:
@@ -131,9 +218,22 @@ class CmdyAsyncResult:
         return self
 
     async def __anext__(self):
-        which = self.data.get("iter", {}).get("which", STDOUT)
+        iter_data = self.data.get("iter")
+        which = iter_data.get("which", STDOUT) if iter_data else STDOUT
         stream = self.stdout if which == STDOUT else self.stderr
         try:
+            if which == BOTH:
+                return await self._anext_tagged(
+                    iter_data.batch or iter_data.chunk_bytes,
+                    iter_data.batch,
+                    iter_data.chunk_bytes,
+                )
+            if iter_data and (
+                iter_data.get("batch") or iter_data.get("chunk_bytes")
+            ):
+                return await self._anext_lines(
+                    stream, iter_data.batch, iter_data.chunk_bytes
+                )
             line = await stream.__anext__()
         except StopAsyncIteration:
             await self.wait()
@@ -142,20 +242,153 @@ class CmdyAsyncResult:
             line = line.decode(self.holding.encoding)
         return line
 
+    async def _anext_lines(self, stream, batch, chunk_bytes):
+        """Get the next lines in batch mode, see LineBatches.next_lines"""
+        if not self._lines:
+            eof = False
+            while True:
+                self._lines = split_lines(
+                    stream._buffer, self.holding.encoding, chunk_bytes, eof
+                )
+                if self._lines:
+                    break
+                if eof:
+                    raise StopAsyncIteration
+                data = await stream._read(read_size(stream.fileno()))
+                if data:
+                    stream._buffer.extend(data)
+                else:
+                    eof = True
+
+        if not batch or len(self._lines) <= batch:
+            lines, self._lines = self._lines, []
+        else:
+            lines = self._lines[:batch]
+            del self._lines[:batch]
+        return lines
+
+    @staticmethod
+    async def _read_tagged(which, stream, both):
+        """Read the chunks from an output into the queue, in a task"""
+        import curio
+
+        size = read_size(stream.fileno())
+        while True:
+            data = await stream._read(size)
+            try:
+                await both.queue.put((which, data))
+            except curio.CancelledError:
+                # not to lose it, see _stop_tagged
+                both.pending[which] = data
+                raise
+            if not data:
+                return
+
+    async def _stop_tagged(self):
+        """Cancel the tasks reading both outputs, and put the chunks read
+        but not fetched back to the buffers of the pipes"""
+        if self._both is None:
+            return
+        both, self._both = self._both, None
+        for task in both.tasks:
+            await task.cancel()
+        streams = {STDOUT: self.stdout, STDERR: self.stderr}
+        while not both.queue.empty():
+            which, data = await both.queue.get()
+            streams[which]._buffer.extend(data)
+        for which, data in both.pending.items():
+            streams[which]._buffer.extend(data)
+
+    async def _anext_tagged(self, batched, batch, chunk_bytes):
+        """Get the next (which, line) iterating over both outputs, or the
+        (which, lines) in batch mode, see TaggedStreams.next_lines
+
+        Both outputs are read by tasks as the data comes.
+        """
+        import curio
+
+        streams = {STDOUT: self.stdout, STDERR: self.stderr}
+        if self._both is None:
+            self._both = Diot(
+                queue=curio.Queue(len(streams)),
+                eof=set(),
+                tasks=[],
+                pending={},
+            )
+            for which, stream in streams.items():
+                task = await curio.spawn(
+                    self._read_tagged, which, stream, self._both, daemon=True
+                )
+                self._both.tasks.append(task)
+
+        while not self._lines:
+            for which, stream in streams.items():
+                lines = split_lines(
+                    stream._buffer,
+                    self.holding.encoding,
+                    chunk_bytes,
+                    which in self._both.eof,
+                )
+                if lines:
+                    self._lines.append((which, deque(lines)))
+            if self._lines:
+                break
+            if len(self._both.eof) == len(streams):
+                raise StopAsyncIteration
+            which, data = await self._both.queue.get()
+            if data:
+                streams[which]._buffer.extend(data)
+            else:
+                self._both.eof.add(which)
+
+        which, lines = self._lines[0]
+        if not batched:
+            line = lines.popleft()
+            if not lines:
+                self._lines.pop(0)
+            return which, line
+        if not batch or len(lines) <= batch:
+            self._lines.pop(0)
+            return which, list(lines)
+        return which, [lines.popleft() for _ in range(batch)]
+
+    def __await__(self):
+        return self.wait().__await__()
+
     async def wait(self):
+        """Wait until command is done, or all the stages if this is the
+        last stage of a pipeline
+
+        The process is killed when timed out or cancelled.
+        """
+        import curio
+
+        # not to read the outputs at the same time
+        await self._stop_tagged()
+        if self.pipeline is not None:
+            return await self.pipeline.wait_async()
+
         timeout = self.holding.timeout
 
+        coro = communicate_async([self.proc], *self._pipes())
         try:
             if timeout:
-                self._rc = await curio.timeout_after(timeout, self.proc.wait)
+                self._rc = (await curio.timeout_after(timeout, coro))[0]
             else:
-                self._rc = await self.proc.wait()
+                self._rc = (await coro)[0]
         except curio.TaskTimeout:
             self.proc.kill()
+            if not timeout:
+                # by an outer timeout
+                raise
             raise CmdyTimeoutError(
                 "Timeout after " f"{self.holding.timeout} seconds."
             ) from None
+        except curio.CancelledError:
+            self.proc.kill()
+            raise
         else:
+            self._input = None
             if self._rc not in self.holding.okcode and self.holding.raise_:
                 await raise_return_code_error(self)
             return self
@@ -1,55 +1,242 @@
 """Utilities for cmdy"""
-import inspect
+import sys
 import warnings
+from collections import OrderedDict
 from copy import copy
-from functools import wraps
+from functools import lru_cache, wraps
 from os import environ
-from typing import TYPE_CHECKING, List, Tuple, Union
+from threading import Lock
+from typing import TYPE_CHECKING, Callable, List, Tuple, Union
 
-import curio
-import executing
 from diot import Diot
-from simpleconf import ProfileConfig
 
-from .cmdy_defaults import POPEN_ARG_KEYS
+from .cmdy_defaults import (
+    CONFIG_CACHE_SIZE,
+    ENGINES,
+    READ_SIZE,
+    config_generation,
+    get_popen_arg_keys,
+)
 from .cmdy_exceptions import CmdyReturnCodeError
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
 if TYPE_CHECKING:
+    import curio
     from .cmdy_result import CmdyAsyncResult
 
+# fcntl commands to set and get the capacity of a pipe, Linux only
+F_SETPIPE_SZ = 1031
+F_GETPIPE_SZ = 1032
+PIPE_SIZE_SUPPORTED = fcntl is not None and sys.platform.startswith("linux")
+
+
+@lru_cache()
+def _pipe_max_size() -> int:
+    """The max capacity of a pipe that an unprivileged user can set"""
+    try:
+        with open("/proc/sys/fs/pipe-max-size") as fmax:
+            return int(fmax.read())
+    except (OSError, ValueError):  # pragma: no cover
+        return 1 << 20
+
+
+def set_pipe_size(fd: int, size: int) -> int:
+    """Set the capacity of a pipe, on Linux only
+
+    The size is capped by `/proc/sys/fs/pipe-max-size` unless we are
+    privileged.
+
+    Args:
+        fd: Either end of the pipe
+        size: The capacity in bytes, rounded up to a power of 2 pages by
+            the kernel
+
+    Returns:
+        The capacity set, None if not supported or failed
+    """
+    if not size or not PIPE_SIZE_SUPPORTED:
+        return None
+    try:
+        return fcntl.fcntl(fd, F_SETPIPE_SZ, size)
+    except PermissionError:
+        if size <= _pipe_max_size():  # pragma: no cover
+            return None
+        return set_pipe_size(fd, _pipe_max_size())
+    except OSError:  # pragma: no cover
+        # not a pipe, the data in it is larger than the size, etc
+        return None
+
+
+def read_size(fd: int) -> int:
+    """The size to read from a pipe at a time
+
+    It is the capacity of the pipe, so that a full pipe is emptied by one
+    read, but at least READ_SIZE.
+    """
+    if not PIPE_SIZE_SUPPORTED:  # pragma: no cover
+        return READ_SIZE
+    try:
+        return max(READ_SIZE, fcntl.fcntl(fd, F_GETPIPE_SZ))
+    except OSError:
+        # not a pipe
+        return READ_SIZE
+
 
 async def raise_return_code_error(aresult: "CmdyAsyncResult"):
     """Raise CmdyReturnCodeError from CmdyAsyncResult
     Compose a fake CmdyResult for CmdyReturnCodeError
     """
-    # this should be
+    # the outputs piped to the next stage of a pipeline are not readable
+    streams = aresult._pipes()[0]
+    stdout = aresult.stdout if aresult.stdout in streams else None
+    stderr = aresult.stderr if aresult.stderr in streams else None
     result = Diot(
         rc=aresult._rc,
         pid=aresult.pid,
         cmd=aresult.cmd,
         piped_strcmds=getattr(aresult, "piped_strcmds", None),
         holding=Diot(okcode=aresult.holding.okcode),
-        _stdout_str=(await aresult.stdout.read() if aresult.stdout else ""),
-        _stderr_str=(await aresult.stderr.read() if aresult.stderr else ""),
-        stdout=aresult.stdout,
-        stderr=aresult.stderr,
+        _stdout_str=(await stdout.read() if stdout else ""),
+        _stderr_str=(await stderr.read() if stderr else ""),
+        stdout=stdout,
+        stderr=stderr,
     )
 
     raise CmdyReturnCodeError(result)
 
 
-class SyncStreamFromAsync:
+def split_lines(
+    buffer: bytearray,
+    encoding: str = None,
+    chunk_bytes: int = None,
+    eof: bool = False,
+) -> List[Union[str, bytes]]:
+    """Cut the complete lines from the front of the buffer in bulk
+
+    The lines are decoded once as a chunk and then split.
+
+    Args:
+        buffer: The buffer, the lines cut are removed from it
+        encoding: The encoding to decode the lines, bytes kept if None
+        chunk_bytes: Cut at most this number of bytes, unless the first
+            line is longer than it. All complete lines are cut if None
+        eof: Whether the end of the stream is reached, so the incomplete
+            line at the end is cut as well
+
+    Returns:
+        The lines with line endings, empty if there isn't a complete line
+    """
+    if chunk_bytes and len(buffer) > chunk_bytes:
+        last = buffer.rfind(b"\n", 0, chunk_bytes)
+        if last < 0:
+            last = buffer.find(b"\n", chunk_bytes)
+    elif eof:
+        last = len(buffer) - 1
+    else:
+        last = buffer.rfind(b"\n")
+
+    if last < 0:
+        if not eof or not buffer:
+            return []
+        last = len(buffer) - 1
+
+    chunk = bytes(buffer[: last + 1])
+    del buffer[: last + 1]
+    if encoding:
+        chunk = chunk.decode(encoding)
+    newline = "\n" if encoding else b"\n"
+    # str.splitlines() splits on other line boundaries as well
+    lines = chunk.split(newline)
+    last_line = lines.pop()
+    lines = [line + newline for line in lines]
+    if last_line:
+        lines.append(last_line)
+    return lines
+
+
+class LineBatches:
+    """Fetch lines from a stream in batches
+
+    Subclasses should have `_buffer` (a bytearray of the data read but not
+    fetched yet), `eof`, `encoding`, `_lines` (a list of the lines split
+    but not fetched yet) and `_fill(timeout)`, which reads a chunk into
+    `_buffer` and returns False if nothing read within timeout.
+    """
+
+    def next_lines(
+        self,
+        timeout: float = None,
+        batch: int = None,
+        chunk_bytes: int = None,
+    ) -> List[Union[str, bytes]]:
+        """Fetch the next lines within the given timeout
+
+        Args:
+            timeout: The timeout in seconds to wait for a complete line
+            batch: Fetch at most this number of lines
+            chunk_bytes: Split at most this number of bytes at a time
+
+        Returns:
+            The lines, empty if nothing produced after the timeout
+
+        Raises:
+            StopIteration: When all lines are fetched
+        """
+        if not self._lines:
+            self._lines = self._split(timeout, chunk_bytes)
+        if not batch or len(self._lines) <= batch:
+            lines, self._lines = self._lines, []
+        else:
+            lines = self._lines[:batch]
+            del self._lines[:batch]
+        return lines
+
+    def _split(self, timeout: float, chunk_bytes: int) -> list:
+        """Read and split the lines"""
+        from time import monotonic
+
+        deadline = None if not timeout else monotonic() + timeout
+        while True:
+            lines = split_lines(
+                self._buffer, self.encoding, chunk_bytes, self.eof
+            )
+            if lines:
+                return lines
+            if self.eof:
+                raise StopIteration()
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return []
+            self._fill(remaining)
+
+
+class SyncStreamFromAsync(LineBatches):
     """Take an async iterable into a sync iterable
     We use curio.run to fetch next record each time
     A StopIteration raised when a StopAsyncIteration raises
     for the async iterable
     """
 
-    def __init__(self, astream: curio.io.FileStream, encoding: str = None):
+    def __init__(
+        self, astream: "curio.io.FileStream", encoding: str = None
+    ):
         self.astream = astream
         self.encoding = encoding
+        self.eof = False
+        self._buffer = astream._buffer
+        self._lines = []
+        self.read_size = read_size(astream.fileno())
 
     async def _fetch_next(self, timeout: float = None):
+        import curio
+
         await self.astream.flush()
         if timeout:
             ret = await curio.timeout_after(timeout, self.astream.__anext__)
@@ -61,6 +248,10 @@ class SyncStreamFromAsync:
         """Fetch the next record within give timeout
         If nothing produced after the timeout, returns empty str or bytes
         """
+        import curio
+
+        if self._lines:
+            return self._lines.pop(0)
         try:
             return curio.run(self._fetch_next(timeout))
         except StopAsyncIteration:
@@ -78,17 +269,140 @@ class SyncStreamFromAsync:
         """Dump all records as a string or bytes"""
         return ("" if self.encoding else b"").join(self)
 
+    def _fill(self, timeout: float = None) -> bool:
+        """Read a chunk into the buffer within the timeout"""
+        import curio
 
-def property_called_as_method(caller=1):
-    """Tell if a property is called by a method way"""
-    frame = inspect.stack()[caller + 1].frame
-    source = executing.Source.executing(frame)
-    node = source.node
+        try:
+            if timeout:
+                data = curio.run(
+                    curio.timeout_after(
+                        timeout, self.astream._read, self.read_size
+                    )
+                )
+            else:
+                data = curio.run(self.astream._read(self.read_size))
+        except curio.TaskTimeout:
+            return False
+        if data:
+            self._buffer.extend(data)
+        else:
+            self.eof = True
+        return True
+
+
+class CallSiteCache:
+    """Cache the introspection of the fluent chain by call site
+
+    The AST node that a frame is executing is determined by its code object
+    and the offset of its last instruction. So the answers of the
+    introspection (the next attribute and whether a property is called as
+    a method) can be computed once per call site and reused.
+
+    Attributes:
+        will: The cached next attributes
+        as_method: The cached answers of properties called as methods
+        hits: Number of times a cached answer is reused
+        misses: Number of times a frame has to be analyzed
+    """
+
+    def __init__(self):
+        self.will = {}
+        self.as_method = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return (
+            f"<CallSiteCache: hits={self.hits}, misses={self.misses}, "
+            f"size={len(self.will) + len(self.as_method)}>"
+        )
+
+    def clear(self):
+        """Clear the cached answers and the counters"""
+        self.will.clear()
+        self.as_method.clear()
+        self.hits = self.misses = 0
+
+
+CALLSITE_CACHE = CallSiteCache()
+# Code objects of the frames that don't count when looking for the caller,
+# i.e. the placeholders of lazily vendored plugins
+SKIPPED_CODES = set()
+
+
+def _caller_frame(depth: int):
+    """Get the frame at the depth (from the caller of this function),
+    skipping the frames of SKIPPED_CODES. None if the stack is not deep
+    enough"""
     try:
+        frame = sys._getframe(depth + 1)
+    except ValueError:
+        return None
+    while frame.f_code in SKIPPED_CODES:
+        frame = frame.f_back
+    return frame
+
+
+def _executing_node(frame):
+    """Get the AST node that the frame is executing"""
+    import executing
+
+    return executing.Source.executing(frame).node
+
 
-        return node.parent.func is node
-    except AttributeError:
+def will(frame: int = 1) -> str:
+    """Detect the attribute name right after a method/property call
+
+    Works like `varname.will(frame, raise_exc=False)`, but the answer is
+    cached by call site.
+
+    Args:
+        frame: At which frame this function is called.
+
+    Returns:
+        The attribute name right after the call or None if it can't be
+        detected (including not having one)
+    """
+    frameobj = _caller_frame(frame + 1)
+    if frameobj is None:
+        return None
+    key = (frameobj.f_code, frameobj.f_lasti)
+    try:
+        ret = CALLSITE_CACHE.will[key]
+    except KeyError:
+        import ast
+
+        CALLSITE_CACHE.misses += 1
+        node = _executing_node(frameobj)
+        parent = getattr(node, "parent", None)
+        ret = CALLSITE_CACHE.will[key] = (
+            parent.attr if isinstance(parent, ast.Attribute) else None
+        )
+    else:
+        CALLSITE_CACHE.hits += 1
+    return ret
+
+
+def property_called_as_method(caller=1):
+    """Tell if a property is called by a method way"""
+    frameobj = _caller_frame(caller + 1)
+    if frameobj is None:
         return False
+    key = (frameobj.f_code, frameobj.f_lasti)
+    try:
+        ret = CALLSITE_CACHE.as_method[key]
+    except KeyError:
+        CALLSITE_CACHE.misses += 1
+        node = _executing_node(frameobj)
+        try:
+            ret = node.parent.func is node
+        except AttributeError:
+            ret = False
+        CALLSITE_CACHE.as_method[key] = ret
+    else:
+        CALLSITE_CACHE.hits += 1
+    return ret
 
 
 def property_or_method(func):
@@ -108,6 +422,30 @@ def property_or_method(func):
     return wrapper
 
 
+@lru_cache(maxsize=4096)
+def _flag_form(
+    key: str, deform: Callable, prefix: str, sep: str
+) -> Tuple[str, str, str]:
+    """Get the deformed key, the prefix and the separator of a flag
+
+    Args:
+        key: The name of the argument
+        deform: The function to deform the key
+        prefix: The prefix config, could be "auto"
+        sep: The separator config, could be "auto"
+
+    Returns:
+        The deformed key, the prefix and the separator
+    """
+    if callable(deform):
+        key = deform(key)
+    if prefix == "auto":
+        prefix = "-" if len(key) == 1 else "--"  # '' has been pop'ed
+    if sep == "auto":
+        sep = " " if len(key) == 1 else "="
+    return key, prefix, sep
+
+
 def compose_arg_segment(cmd_args: dict, config: Diot) -> List[str]:
     """Compose a list of command-line arguments from the cmd_args
     by given argument composing configs, including prefix, sep and dupkey
@@ -152,21 +490,8 @@ def compose_arg_segment(cmd_args: dict, config: Diot) -> List[str]:
     )
 
     for key, value in cmd_args.items():
-        if callable(config.deform):
-            key = config.deform(key)
-        prefix = (
-            config.prefix
-            if config.prefix != "auto"
-            else "-"
-            if len(key) == 1  # '' has been pop'ed
-            else "--"
-        )
-        sep = (
-            config.sep
-            if config.sep != "auto"
-            else " "
-            if len(key) == 1
-            else "="
+        key, prefix, sep = _flag_form(
+            key, config.deform, config.prefix, config.sep
         )
         if not isinstance(value, list):
             value = [value]
@@ -194,7 +519,13 @@ def compose_arg_segment(cmd_args: dict, config: Diot) -> List[str]:
 
 
 def normalize_config(config: Diot):
-    """Normalize shell and okcode to list"""
+    """Normalize shell and okcode to list, pipe_size to int, and check the
+    engine"""
+    if "engine" in config and config.engine not in ENGINES:
+        raise ValueError(
+            f"Unknown engine {config.engine!r}, expecting one of {ENGINES}."
+        )
+
     if "okcode" in config:
         if isinstance(config.okcode, str):
             config.okcode = [okc.strip() for okc in config.okcode.split(",")]
@@ -202,6 +533,9 @@ def normalize_config(config: Diot):
             config.okcode = [config.okcode]
         config.okcode = [int(okc) for okc in config.okcode]
 
+    if config.get("pipe_size"):
+        config.pipe_size = int(config.pipe_size)
+
     if "shell" in config and config.shell:
         if config.shell is True:
             config.shell = ["/bin/bash", "-c"]
@@ -332,7 +666,7 @@ def parse_single_kwarg(
             key = key[1:]
             if key in global_config and key not in local_config:
                 local_config[key] = val
-            elif key in POPEN_ARG_KEYS and key not in popen_config:
+            elif key in get_popen_arg_keys() and key not in popen_config:
                 popen_config[key] = val
             else:
                 pure_cmd_kwargs["_" + key] = val
@@ -363,6 +697,155 @@ def parse_single_kwarg(
     return (pure_cmd_kwargs, local_config, popen_config)
 
 
+def copy_config(config: Diot) -> Diot:
+    """Shallow copy a Diot config
+
+    Unlike `Diot.copy()`, the values are not nested again, which is
+    expensive for the loaded configurations with all the profiles.
+
+    Args:
+        config: The config to copy
+
+    Returns:
+        The copied config
+    """
+    meta = config.__diot__
+    ret = Diot(
+        diot_nest=meta["nest"],
+        diot_transform=meta["transform"],
+        diot_missing=meta["missing"],
+    )
+    dict.update(ret, config)
+    ret.__diot__["keymaps"].update(meta["keymaps"])
+    return ret
+
+
+class ConfigCache:
+    """Cache the configurations resolved for the commands
+
+    Resolving the configurations of a command (using the default profile
+    and the profile of the command, and parsing the baked arguments) only
+    depends on the name of the command, the loaded configurations and the
+    baked arguments. So it is done once for each of them, and the calls
+    only merge their own keyword arguments. The entries are dropped when
+    the generation of the configurations changes, and the least recently
+    used ones when there are more than `maxsize` of them, as each baked
+    command brings its own.
+
+    Args:
+        maxsize: The maximum number of the entries
+
+    Attributes:
+        entries: The resolved configurations, keyed by the name of the
+            command and the ids of the configurations and baked arguments,
+            the most recently used last
+        maxsize: The maximum number of the entries
+        generation: The generation of the configurations of the entries
+        hits: Number of times the resolved configurations are reused
+        misses: Number of times the configurations have to be resolved
+    """
+
+    def __init__(self, maxsize: int = CONFIG_CACHE_SIZE):
+        self.entries = OrderedDict()
+        self.maxsize = maxsize
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        # resolve() runs from the threads of cmdy.map and partitions too
+        self._lock = Lock()
+
+    def __repr__(self):
+        return (
+            f"<ConfigCache: hits={self.hits}, misses={self.misses}, "
+            f"size={len(self.entries)}>"
+        )
+
+    def clear(self):
+        """Clear the resolved configurations and the counters"""
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = 0
+
+    def resolve(self, name: str, config: Diot, baked_args: Diot) -> Diot:
+        """Get the resolved configurations of a command
+
+        Args:
+            name: The name of the command
+            config: The loaded configurations
+            baked_args: The baked arguments
+
+        Returns:
+            A Diot with `global_config` (full configs), `nondefault_config`
+            (configs specified for the command), `kwargs`
+            (the pure baked keyword arguments) and `popen` (the baked popen
+            arguments, not fixed). They should not be modified.
+        """
+        with self._lock:
+            generation = config_generation()
+            if generation != self.generation:
+                self.entries.clear()
+                self.generation = generation
+
+            key = (name, id(config), id(baked_args))
+            entry = self.entries.get(key)
+            # keep the references, so that the ids are not reused
+            if (
+                entry is not None
+                and entry.config is config
+                and entry.baked_args is baked_args
+            ):
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry
+
+            self.misses += 1
+            entry = _resolve_config(name, config, baked_args)
+            self.entries[key] = entry
+            entry.config = config
+            entry.baked_args = baked_args
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+            return entry
+
+
+CONFIG_CACHE = ConfigCache()
+
+
+def _resolve_config(name: str, config: Diot, baked_args: Diot) -> Diot:
+    """Resolve the configurations of a command, see ConfigCache.resolve"""
+    from simpleconf import ProfileConfig
+
+    # without cmdy_ prefix
+    # full configs
+    global_config = ProfileConfig.use_profile(config, "default", copy=True)
+    # configs that only specified
+    if ProfileConfig.has_profile(config, name):
+        nondefault_config = ProfileConfig.use_profile(
+            config,
+            name,
+            base=None,
+            copy=True,
+        )
+    else:
+        nondefault_config = Diot()
+
+    kwargs, baked_config, baked_popen_args = parse_single_kwarg(
+        baked_args, is_root=True, global_config=global_config
+    )
+
+    global_config.update(baked_config)
+    nondefault_config.update(baked_config)
+    normalize_config(nondefault_config)
+    return Diot(
+        global_config=global_config,
+        nondefault_config=nondefault_config,
+        kwargs=kwargs,
+        popen=baked_popen_args,
+        diot_nest=False,
+    )
+
+
 def parse_args(
     name: str,
     args: tuple,
@@ -394,39 +877,26 @@ def parse_args(
             The cmdy configurations,
             The arguments will be passed to `Popen`
     """
-    ret_args: list = []
-    ret_kwargs: dict = {}
-
-    # without cmdy_ prefix
-    # full configs
-    global_config = ProfileConfig.use_profile(config, "default", copy=True)
-    # configs that only specified
-    if ProfileConfig.has_profile(config, name):
-        nondefault_config = ProfileConfig.use_profile(
-            config,
-            name,
-            base=None,
-            copy=True,
-        )
-    else:
-        nondefault_config = Diot()
-
-    ret_kwargs, baked_config, baked_popen_args = parse_single_kwarg(
-        baked_args, is_root=True, global_config=global_config
-    )
+    resolved = CONFIG_CACHE.resolve(name, config, baked_args)
 
-    global_config.update(baked_config)
-    nondefault_config.update(baked_config)
+    ret_args: list = []
+    ret_kwargs = resolved.kwargs.copy()
 
+    global_config = resolved.global_config
     pure_cmd_kwargs, local_config, popen_config = parse_single_kwarg(
         kwargs, is_root=True, global_config=global_config
     )
 
     ret_kwargs.update(pure_cmd_kwargs)
 
-    nondefault_config.update(local_config)
-    global_config.update(local_config)
+    nondefault_config = copy_config(resolved.nondefault_config)
+    if local_config:
+        nondefault_config.update(local_config)
+        normalize_config(nondefault_config)
+        global_config = copy_config(global_config)
+        global_config.update(local_config)
 
+    baked_popen_args = copy_config(resolved.popen)
     baked_popen_args.update(popen_config)
     popen_config = baked_popen_args
 
@@ -443,7 +913,7 @@ def parse_args(
                     UserWarning,
                 )
                 continue
-            lconfig = global_config.copy()
+            lconfig = copy_config(global_config)
             lconfig.update(local_config)
             ret_args.extend(compose_arg_segment(pure_cmd_kwargs_seg, lconfig))
         else:
@@ -453,7 +923,6 @@ def parse_args(
     #     pure_cmd_kwargs, global_config
     # ))
 
-    normalize_config(nondefault_config)
     fix_popen_config(popen_config)
     return Diot(
         args=ret_args,
@@ -525,7 +994,9 @@ def new_class(
     basedata = lambda b: {  # noqa: E731
         key: copy(val)
         for key, val in b.__dict__.items()
-        if not key.startswith("__") and not callable(val)
+        if not key.startswith("__")
+        and not callable(val)
+        and not isinstance(val, (classmethod, staticmethod))
     }
     classdata = {}
     for b in base:
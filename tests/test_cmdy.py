@@ -1,5 +1,7 @@
 import sys
 import tempfile
+import threading
+import time
 from contextlib import contextmanager
 from pathlib import Path
 
@@ -8,7 +10,14 @@ import pytest
 from diot import Diot
 
 import cmdy
-from cmdy.cmdy_defaults import DEVNULL, STDERR, STDIN, STDOUT, get_config
+from cmdy.cmdy_defaults import (
+    BOTH,
+    DEVNULL,
+    STDERR,
+    STDIN,
+    STDOUT,
+    get_config,
+)
 from cmdy.cmdy_exceptions import (
     CmdyActionError,
     CmdyExecNotFoundError,
@@ -149,6 +158,81 @@ def test_fg_wait(capsys):
     assert capsys.readouterr().out == "123\n"
 
 
+def test_bg():
+    start = time.time()
+    futures = [
+        cmdy.bash(c=f"sleep 0.{5 - i % 5}; echo {i}").bg() for i in range(20)
+    ]
+    assert repr(futures[0]).startswith("<CmdyFuture: ['bash'")
+    results = cmdy.wait_all(futures)
+    assert [result.stdout for result in results] == [
+        f"{i}\n" for i in range(20)
+    ]
+    assert time.time() - start < 5
+    assert all(future.done() for future in futures)
+
+    futures = [
+        cmdy.bash(c=f"sleep 0.{3 - i}; echo {i}").bg() for i in range(3)
+    ]
+    assert [
+        future.result().stdout for future in cmdy.as_completed(futures)
+    ] == ["2\n", "1\n", "0\n"]
+
+    # a pipeline, with the input fed
+    holding = cmdy.cat().h()
+    holding.input = b"1\n" * 100000
+    future = (holding.p() | cmdy.wc(l=True).h()).bg()
+    assert future.result().stdout.strip() == "100000"
+    assert future.result().pipeline.rcs == [0, 0]
+
+
+def test_bg_error():
+    future = cmdy.bash(c="echo 1; exit 3").bg()
+    with pytest.raises(CmdyReturnCodeError):
+        future.result()
+    assert future.cmdy_result.rc == 3
+
+    future = cmdy.sleep(10, cmdy_timeout=0.2).bg()
+    with pytest.raises(CmdyTimeoutError):
+        future.result()
+
+    future = cmdy.sleep(10).bg()
+    with pytest.raises(CmdyTimeoutError):
+        cmdy.wait_all([future], timeout=0.1)
+    with pytest.raises(CmdyTimeoutError):
+        list(cmdy.as_completed([future], timeout=0.1))
+    future.kill()
+    with pytest.raises(CmdyReturnCodeError):
+        future.result()
+
+    with pytest.raises(CmdyActionError):
+        cmdy.seq(3).p() | cmdy.cat().bg()
+    _CMDY_EVENT.clear()
+    with pytest.raises(CmdyActionError):
+        cmdy.echo().a().bg()
+
+
+def test_bg_bad_job():
+    def bad_sink(data):
+        raise ValueError("bad sink")
+
+    def slow_sink(data):
+        time.sleep(1)
+
+    # the error of a job goes to its future, the reaper keeps running
+    future = cmdy.seq(3).h().tee(stdout=bad_sink).bg()
+    with pytest.raises(ValueError, match="bad sink"):
+        future.result(timeout=3)
+    assert cmdy.echo(1).bg().result(timeout=3).stdout == "1\n"
+
+    # a slow sink doesn't stall the other jobs
+    slow = cmdy.echo(1).h().tee(stdout=slow_sink).bg()
+    start = time.time()
+    assert cmdy.echo(2).bg().result(timeout=3).stdout == "2\n"
+    assert time.time() - start < 0.5
+    assert slow.result(timeout=3).rc == 0
+
+
 def test_redirect(tmp_path):
     tmpfile = tmp_path / "test_redirect.txt"
     c = cmdy.echo(n="1234").r() > tmpfile
@@ -249,6 +333,94 @@ def test_redirect_mixed(tmp_path):
     assert outfile.read_text() == "123"
 
 
+@pytest.mark.parametrize("engine", ["sync", "curio"])
+def test_redirect_capture(tmp_path, engine):
+    outfile = tmp_path / "test_redirect_capture.txt"
+    c = cmdy.seq(100000, cmdy_engine=engine).r(capture=True) > outfile
+    assert c.stdout.splitlines()[-1] == "100000"
+    assert outfile.read_text() == c.stdout
+    assert c.holding.should_close_fds.stdout.dest.closed
+
+    # appending is not supported by splice(2), copied instead
+    c = cmdy.seq(3, cmdy_engine=engine).r(capture=True) >> outfile
+    assert c == "1\n2\n3\n"
+    assert outfile.read_text().endswith("100000\n1\n2\n3\n")
+
+    errfile = tmp_path / "test_redirect_capture_err.txt"
+    c = (
+        cmdy.bash(c="echo 1; echo 2 >&2").r(STDOUT, STDERR, capture=True)
+        ^ outfile
+        > errfile
+    )
+    assert c.stdout == outfile.read_text() == "1\n"
+    assert c.stderr == errfile.read_text() == "2\n"
+
+
+def test_redirect_capture_iter(tmp_path):
+    outfile = tmp_path / "test_redirect_capture_iter.txt"
+    c = cmdy.seq(5).h()
+    c = c.r(capture=True) > outfile
+    lines = list(c.run(False).iter())
+    assert lines == ["1\n", "2\n", "3\n", "4\n", "5\n"]
+    assert outfile.read_text() == "".join(lines)
+
+
+def test_tee(tmp_path, capsys):
+    outfile = tmp_path / "test_tee.txt"
+    chunks = []
+    with open(tmp_path / "test_tee.bin", "wb") as fbin:
+        c = cmdy.bash(c="seq 10000; echo err >&2").tee(
+            stdout=[chunks.append, outfile, fbin, STDOUT],
+            stderr=STDERR,
+        )
+    assert c.stdout is None
+    assert c.stderr is None
+    out = "".join(chunks)
+    assert out.splitlines()[-1] == "10000"
+    assert outfile.read_text() == out
+    assert (tmp_path / "test_tee.bin").read_bytes() == out.encode()
+    captured = capsys.readouterr()
+    assert captured.out == out
+    assert captured.err == "err\n"
+
+    c = cmdy.seq(3, cmdy_encoding=None).tee(stdout=chunks.append, capture=True)
+    assert c.stdout == chunks[-1] == b"1\n2\n3\n"
+
+    c = cmdy.seq(3).h()
+    c = c.r() > DEVNULL
+    with pytest.raises(CmdyActionError):
+        c.tee(stdout=STDERR)
+
+
+def test_tee_sink_error():
+    def sink(data):
+        raise ValueError("sink")
+
+    chunks = []
+    with pytest.raises(ValueError, match="sink"):
+        cmdy.seq(100000).tee(stdout=[sink, chunks.append])
+    # the other sinks are not affected
+    assert "".join(chunks).splitlines()[-1] == "100000"
+
+
+def test_tee_backpressure():
+    release = threading.Event()
+    size = []
+
+    def sink(data):
+        release.wait()
+        size.append(len(data))
+
+    c = cmdy.head(c=10000000, _=["/dev/zero"], cmdy_encoding=None).h()
+    c = c.tee(stdout=sink).run(False)
+    time.sleep(0.5)
+    # blocked by the sink, with the buffered data bounded
+    assert c.proc.poll() is None
+    release.set()
+    assert c.wait().rc == 0
+    assert sum(size) == 10000000
+
+
 def test_redirect_stderr(tmp_path):
     tmpfile = tmp_path / "test_redirect_stderr.txt"
     c = cmdy.echo("1234 1>&2", cmdy_shell=True).r(STDERR) > tmpfile
@@ -314,6 +486,83 @@ def test_iter_stderr():
     assert ret == ["123"]
 
 
+def test_iter_both():
+    script = "echo o1; sleep .1; echo e1 >&2; sleep .1; echo o2; printf e2 >&2"
+    c = cmdy.bash(c=script).iter(BOTH)
+    assert list(c) == [
+        (STDOUT, "o1\n"), (STDERR, "e1\n"), (STDOUT, "o2\n"), (STDERR, "e2")
+    ]
+    assert c.rc == 0
+    assert list(c.stderr) == []
+
+    c = cmdy.bash(c="sleep .3; seq 3; seq 2 >&2").iter(BOTH, batch=2)
+    assert c.next(timeout=0.01) is None
+    assert sorted(c) == [
+        (STDERR, ["1\n", "2\n"]),
+        (STDOUT, ["1\n", "2\n"]),
+        (STDOUT, ["3\n"]),
+    ]
+
+    # timeout=0 does not wait on an idle pipe
+    c = cmdy.bash(c="echo 1; exec sleep 10", cmdy_raise=False).iter(BOTH)
+    assert c.next() == (STDOUT, "1\n")
+    start = time.time()
+    assert c.next(timeout=0) is None
+    assert time.time() - start < 1
+    c.proc.kill()
+    assert list(c) == []
+
+    c = cmdy.echo(123, cmdy_shell=True).r(STDERR) > DEVNULL
+    with pytest.raises(CmdyActionError):
+        c.iter(BOTH)
+
+
+def test_iter_both_async():
+    script = "echo o1; sleep .1; echo e1 >&2; sleep .1; echo o2; printf e2 >&2"
+
+    async def main():
+        c = cmdy.bash(c=script).a().iter(BOTH)
+        lines = [line async for line in c]
+        c = cmdy.bash(c="seq 3; sleep .1; seq 2 >&2").a().iter(BOTH, batch=2)
+        batches = [lines async for lines in c]
+        return lines, batches, await c.rc
+
+    assert curio.run(main()) == (
+        [
+            (STDOUT, "o1\n"),
+            (STDERR, "e1\n"),
+            (STDOUT, "o2\n"),
+            (STDERR, "e2"),
+        ],
+        [
+            (STDOUT, ["1\n", "2\n"]),
+            (STDOUT, ["3\n"]),
+            (STDERR, ["1\n", "2\n"]),
+        ],
+        0,
+    )
+
+
+def test_iter_both_async_stopped():
+    async def main():
+        c = cmdy.bash(c="seq 3; sleep .1; echo e >&2").a().iter(BOTH)
+        async for line in c:
+            break
+        tasks = c._both.tasks
+        await c.wait()
+        # the lines split but not fetched are kept, the rest in the buffers
+        rest = [(which, list(lines)) for which, lines in c._lines]
+        stderr = bytes(c.stderr._buffer)
+        return line, [task.terminated for task in tasks], rest, stderr
+
+    assert curio.run(main()) == (
+        (STDOUT, "1\n"),
+        [True, True],
+        [(STDOUT, ["2\n", "3\n"])],
+        b"e\n",
+    )
+
+
 def test_module_baking():
     sh = cmdy(n=True)
     assert sh is not cmdy
@@ -0,0 +1,328 @@
+import time
+
+import curio
+from curio import subprocess
+import pytest
+
+import cmdy
+from cmdy.cmdy_defaults import READ_SIZE, STDERR, STDIN, STDOUT
+from cmdy.cmdy_engine import SelectorStream, communicate, read_all
+from cmdy.cmdy_exceptions import (
+    CmdyActionError,
+    CmdyReturnCodeError,
+    CmdyTimeoutError,
+)
+from cmdy.cmdy_utils import (
+    PIPE_SIZE_SUPPORTED,
+    SyncStreamFromAsync,
+    read_size,
+    set_pipe_size,
+)
+
+ENGINES = ["sync", "curio"]
+
+
+def test_selector_stream():
+    p = subprocess.Popen(
+        ["echo", "-e", "1\\n2\\n3"], stdout=subprocess.PIPE
+    )
+    stream = SelectorStream(p.stdout)
+    assert repr(stream).startswith("<SelectorStream: fd=")
+    assert stream.dump() == b"1\n2\n3\n"
+
+    p = subprocess.Popen(
+        ["echo", "-n", "-e", "1\\n2\\n3"], stdout=subprocess.PIPE
+    )
+    stream = SelectorStream(p.stdout, encoding="utf-8")
+    assert list(stream) == ["1\n", "2\n", "3"]
+    with pytest.raises(StopIteration):
+        next(stream)
+
+    p = subprocess.Popen(
+        ["bash", "-c", 'echo -e "1\\n2"; sleep .3; echo -n 3; echo 4'],
+        stdout=subprocess.PIPE,
+    )
+    tic = time.time()
+    stream = SelectorStream(p.stdout, encoding="utf-8")
+    assert next(stream) == "1\n"
+    assert next(stream) == "2\n"
+    assert stream.next(timeout=0.1) == ""
+    assert time.time() - tic < 0.3
+    assert stream.next() == "34\n"
+    assert time.time() - tic > 0.3
+
+
+def test_selector_stream_shares_buffer():
+    p = subprocess.Popen(
+        ["echo", "-e", "1\\n2\\n3"], stdout=subprocess.PIPE
+    )
+    p.stdout._buffer.extend(b"0\n")
+    stream = SelectorStream(p.stdout)
+    assert next(stream) == b"0\n"
+    assert next(stream) == b"1\n"
+    # the rest can be read by curio
+    assert curio.run(p.stdout.read()) == b"2\n3\n"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_run(engine):
+    ret = cmdy.echo("1\n2", cmdy_engine=engine)
+    assert ret.holding.engine == engine
+    assert ret == "1\n2\n"
+
+    ret = cmdy.bash(c="echo 1 1>&2; exit 1", _raise=False, _engine=engine)
+    assert ret.rc == 1
+    assert ret.stderr == "1\n"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_iter(engine):
+    ret = cmdy.seq(3, cmdy_engine=engine).iter()
+    stream_class = SelectorStream if engine == "sync" else SyncStreamFromAsync
+    assert isinstance(ret.stdout, stream_class)
+    assert list(ret) == ["1\n", "2\n", "3\n"]
+    assert ret.rc == 0
+
+    ret = cmdy.bash(c="echo 1 1>&2", cmdy_engine=engine).iter(STDERR)
+    assert list(ret) == ["1\n"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_timeout(engine):
+    tic = time.time()
+    with pytest.raises(CmdyTimeoutError):
+        cmdy.sleep(3, cmdy_timeout=0.1, cmdy_engine=engine)
+    assert time.time() - tic < 2
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_fg(engine, capsys):
+    cmdy.bash(
+        c="echo 1; sleep .1; echo 2 1>&2", cmdy_engine=engine
+    ).fg()
+    captured = capsys.readouterr()
+    assert captured.out == "1\n"
+    assert captured.err == "2\n"
+
+    with pytest.raises(CmdyTimeoutError):
+        cmdy.sleep(3, cmdy_timeout=0.1, cmdy_engine=engine).fg()
+
+
+def test_engine_unknown():
+    with pytest.raises(ValueError):
+        cmdy.echo(cmdy_engine="trio")
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_iter_batch(engine):
+    ret = cmdy.seq(5, cmdy_engine=engine).iter(batch=2)
+    assert list(ret) == [["1\n", "2\n"], ["3\n", "4\n"], ["5\n"]]
+    assert ret.rc == 0
+
+    ret = cmdy.seq(1000, cmdy_engine=engine).iter(chunk_bytes=10)
+    batches = list(ret)
+    assert all(sum(map(len, batch)) <= 10 for batch in batches)
+    assert [line for batch in batches for line in batch] == [
+        f"{i}\n" for i in range(1, 1001)
+    ]
+
+    ret = cmdy.printf("a\nbc\nd", cmdy_engine=engine, cmdy_encoding=None)
+    ret = ret.iter(chunk_bytes=1)
+    assert list(ret) == [[b"a\n"], [b"bc\n"], [b"d"]]
+
+    ret = cmdy.bash(c="echo 1 1>&2", cmdy_engine=engine).iter(
+        STDERR, batch=10
+    )
+    assert list(ret) == [["1\n"]]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_engine_iter_batch_timeout(engine):
+    ret = cmdy.bash(
+        c="echo 1; echo 2; sleep .5; echo 3", cmdy_engine=engine
+    ).iter(batch=1)
+    assert ret.next() == ["1\n"]
+    assert ret.next() == ["2\n"]
+    tic = time.time()
+    assert ret.next(timeout=0.1) == []
+    assert time.time() - tic < 0.4
+    # switching to line mode
+    assert ret.stdout.next() == "3\n"
+
+
+def test_iter_batch_async():
+    async def main(**kwargs):
+        ret = cmdy.seq(5).a().iter(**kwargs)
+        return [batch async for batch in ret]
+
+    assert curio.run(main(batch=2)) == [
+        ["1\n", "2\n"],
+        ["3\n", "4\n"],
+        ["5\n"],
+    ]
+    assert curio.run(main(chunk_bytes=4)) == [
+        ["1\n", "2\n"],
+        ["3\n", "4\n"],
+        ["5\n"],
+    ]
+
+
+def test_iter_batch_plan_and_prepared():
+    plan = cmdy.plan(cmdy.seq, 3).iter(batch=2)
+    assert list(plan.run()) == [["1\n", "2\n"], ["3\n"]]
+
+    prepared = cmdy.prepare(cmdy.seq, cmdy.slot("n")).iter(chunk_bytes=100)
+    assert list(prepared.run(n=3)) == [["1\n", "2\n", "3\n"]]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_capture(engine):
+    ret = cmdy.bash(
+        c="printf 'a\\xc3\\xa9'; printf b 1>&2", cmdy_engine=engine
+    )
+    assert ret.bytes() == b"a\xc3\xa9"
+    assert ret.stdout == "aé"
+    buffer = ret.buffer()
+    assert isinstance(buffer, memoryview)
+    assert buffer.tobytes() == b"a\xc3\xa9"
+    # not copied
+    assert buffer.obj is ret.buffer().obj
+    assert ret.bytes(STDERR) == b"b"
+    assert ret.str(STDERR) == "b"
+
+    ret = cmdy.echo(n="1", cmdy_encoding=None, cmdy_engine=engine)
+    assert ret.stdout == b"1"
+
+    with pytest.raises(CmdyActionError):
+        ret.bytes(1)
+    ret = cmdy.echo(1, cmdy_engine=engine).r(STDERR) ^ cmdy.DEVNULL
+    with pytest.raises(CmdyActionError):
+        ret.bytes(STDERR)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_capture_released(engine):
+    ret = cmdy.bash(c="printf 'a\\xc3\\xa9'", cmdy_engine=engine)
+    assert ret.stdout == "aé"
+    # not held twice
+    assert STDOUT not in ret._raw
+    assert ret.str() is ret.stdout
+    assert ret.bytes() == b"a\xc3\xa9"
+    buffer = ret.buffer()
+    assert buffer.obj is ret.buffer().obj
+
+    ret = cmdy.echo(n="1", cmdy_encoding=None, cmdy_engine=engine)
+    assert ret.stdout == b"1"
+    assert STDOUT not in ret._raw
+    assert ret.buffer().tobytes() == b"1"
+
+
+def test_read_all_large():
+    # more than the size of the pipe and READ_SIZE
+    proc = subprocess.Popen(
+        ["head", "-c", str(1 << 22), "/dev/zero"], stdout=subprocess.PIPE
+    )
+    # data read already
+    proc.stdout._buffer.extend(b"x")
+    data = read_all(proc.stdout)
+    proc._popen.wait()
+    assert len(data) == (1 << 22) + 1
+    assert data[:2] == b"x\0"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_drain_concurrently(engine):
+    # 100MB on both streams, much more than the pipe buffers
+    size = 100 << 20
+    ret = cmdy.bash(
+        c=f"head -c {size} /dev/zero & head -c {size} /dev/zero >&2; wait",
+        cmdy_encoding=None,
+        cmdy_engine=engine,
+    )
+    assert ret.rc == 0
+    assert len(ret.buffer()) == size
+    assert len(ret.buffer(STDERR)) == size
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_drain_property_not_waited(engine):
+    # stderr fills its pipe before stdout is closed
+    size = 1 << 20
+    ret = cmdy.bash(
+        c=f"head -c {size} /dev/zero >&2; echo out",
+        cmdy_engine=engine,
+        cmdy_encoding=None,
+        cmdy_timeout=10,
+    ).h()
+    ret = ret.run(False)
+    assert ret._rc is None
+    assert ret.stdout == b"out\n"
+    assert ret.rc == 0
+    assert len(ret.stderr) == size
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_drain_return_code_error(engine):
+    with pytest.raises(CmdyReturnCodeError) as exc:
+        cmdy.bash(
+            c="seq 100000 >&2; exit 1", cmdy_engine=engine, cmdy_timeout=10
+        )
+    assert "[100000 lines hidden.]" not in str(exc.value)
+    assert "[99968 lines hidden.]" in str(exc.value)
+
+
+def test_drain_async():
+    ret = cmdy.bash(c="seq 100000; seq 100000 >&2").a()
+    out = curio.run(ret.astr())
+    assert out == curio.run(ret.astr(STDERR))
+    assert out.splitlines()[-1] == "100000"
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_communicate_input(engine):
+    data = b"x" * (1 << 20)
+    proc = subprocess.Popen(
+        ["cat"],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    rcs = communicate(
+        [proc], [proc.stdout, proc.stderr], proc.stdin, 10, engine, data
+    )
+    assert rcs == [0]
+    assert proc.stdout._buffer == data
+    assert proc.stderr._buffer == b""
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_redirect_finished(engine):
+    # drained already when redirected
+    c = cmdy.cat().r(STDIN) < cmdy.seq(100000, cmdy_engine=engine)
+    assert c.str().splitlines()[-1] == "100000"
+
+
+@pytest.mark.skipif(
+    not PIPE_SIZE_SUPPORTED, reason="Pipe sizes can only be set on Linux"
+)
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pipe_size(engine):
+    ret = cmdy.seq(100000, cmdy_pipe_size=1 << 20, cmdy_engine=engine).h()
+    ret = ret.run()
+    assert read_size(ret.proc.stdout.fileno()) == 1 << 20
+    assert read_size(ret.proc.stderr.fileno()) == 1 << 20
+    assert ret.str().splitlines()[-1] == "100000"
+
+    # capped by the max size for unprivileged users
+    ret = cmdy.true(cmdy_pipe_size=1 << 30).h().run()
+    assert read_size(ret.proc.stdout.fileno()) >= 1 << 20
+
+    c = cmdy.seq(100000).p() | cmdy.wc(l=True, cmdy_pipe_size="1048576")
+    assert c.str().strip() == "100000"
+
+    assert set_pipe_size(0, 0) is None
+
+
+def test_read_size_not_pipe(tmp_path):
+    with open(tmp_path / "file", "w") as fout:
+        assert read_size(fout.fileno()) == READ_SIZE
@@ -0,0 +1,51 @@
+import subprocess
+import sys
+from pathlib import Path
+
+# Budget of `import cmdy` (cumulative, in microseconds), reported by
+# `python -X importtime`
+IMPORT_BUDGET = 250_000
+# Modules that should only be imported on first use
+LAZY_MODULES = ("curio", "simpleconf", "executing", "varname", "inspect")
+
+
+def _import_cmdy(code=""):
+    return subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, cmdy\n{code}",
+        ],
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def test_import_budget():
+    proc = _import_cmdy()
+    cumulative = [
+        int(line.split("|")[1])
+        for line in proc.stderr.splitlines()
+        if line.rstrip().endswith("| cmdy")
+    ]
+    assert cumulative and cumulative[0] < IMPORT_BUDGET
+
+
+def test_lazy_imports():
+    proc = _import_cmdy(
+        f"print([mod for mod in {LAZY_MODULES!r} if mod in sys.modules])"
+    )
+    assert proc.stdout.strip() == "[]"
+
+    proc = _import_cmdy(
+        "cmdy.true()\n"
+        f"print([mod for mod in {LAZY_MODULES!r} if mod in sys.modules])"
+    )
+    # executing is imported on first introspection
+    assert "executing" in proc.stdout
+    assert "curio" in proc.stdout
+    assert "simpleconf" in proc.stdout
@@ -0,0 +1,635 @@
+import errno
+import os
+import sys
+import time
+
+import curio
+import pytest
+
+import cmdy
+from cmdy.cmdy_defaults import BOTH, STDERR, STDIN, STDOUT
+from cmdy.cmdy_exceptions import CmdyReturnCodeError, CmdyTimeoutError
+from cmdy.cmdy_pipepart import line_ranges
+
+ENGINES = ["sync", "curio"]
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pipeline(engine):
+    c = (
+        cmdy.seq(1000).p()
+        | cmdy.grep("00").p()
+        | cmdy.wc(l=True, cmdy_engine=engine)
+    )
+    assert c.str().strip() == "10"
+    pipeline = c.pipeline
+    assert isinstance(pipeline, cmdy.CmdyPipeline)
+    assert len(pipeline) == 3
+    assert repr(pipeline).startswith("<CmdyPipeline: [['seq', '1000']")
+    assert pipeline.results[-1] is c
+    assert pipeline.rcs == [0, 0, 0]
+    assert pipeline.rc == 0
+    assert all(timing >= 0 for timing in pipeline.timings)
+    # piped outputs are not available
+    assert pipeline.results[0].stdout is None
+    assert pipeline.results[0].stderr == ""
+    assert cmdy.echo(1).pipeline is None
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pipeline_sigpipe(engine):
+    # yes gets SIGPIPE only when we don't hold the pipe
+    c = cmdy.yes().p() | cmdy.head(n=1, cmdy_engine=engine, cmdy_timeout=5)
+    assert c == "y\n"
+    assert c.pipeline.rcs[0] == -13
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pipeline_drain(engine):
+    # stderr of the first stage would fill up the pipe if not drained
+    c = cmdy.bash(c="seq 100000 >&2; echo 1").p() | cmdy.cat(
+        cmdy_engine=engine, cmdy_timeout=5
+    )
+    assert c == "1\n"
+    assert c.pipeline.results[0].stderr.splitlines()[-1] == "100000"
+
+
+def test_pipeline_pipe_stderr():
+    c = cmdy.bash(c="echo 1; echo 2 >&2").p(STDERR) | cmdy.cat()
+    assert c == "2\n"
+    assert c.pipeline.results[0].stdout == "1\n"
+    assert c.pipeline.results[0].stderr is None
+
+
+def test_pipefail():
+    # an earlier stage failing raises by default, as it always did
+    c = cmdy.bash(c="echo 1; exit 3").p() | cmdy.cat()
+    with pytest.raises(CmdyReturnCodeError) as exc:
+        c.wait()
+    assert "RETURN CODE 3" in str(exc.value)
+    assert "[STDOUT] <NA / ITERATED / REDIRECTED>" in str(exc.value)
+    with pytest.raises(CmdyReturnCodeError):
+        str(cmdy.bash(c="echo 1; exit 3").p() | cmdy.cat())
+
+    # unless raise is off for it
+    c = cmdy.bash(c="exit 3", cmdy_raise=False).p() | cmdy.cat()
+    assert c.rc == 0
+    assert c.pipeline.failed is None
+
+    # only the last stage counts without pipefail, like a shell
+    c = cmdy.bash(c="echo 1; exit 3").p() | cmdy.cat(cmdy_pipefail=False)
+    assert c == "1\n"
+    assert c.pipeline.rcs == [3, 0]
+    assert c.pipeline.rc == 0
+    assert c.pipeline.failed is None
+
+    c = cmdy.bash(c="exit 3").p() | cmdy.bash(c="cat; exit 4").p() | cmdy.cat(
+        cmdy_raise=False
+    )
+    assert c.rc == 0
+    assert c.pipeline.rc == 4
+    assert c.pipeline.failed is c.pipeline.results[1]
+
+    c = cmdy.bash(c="exit 3", cmdy_okcode=[0, 3]).p() | cmdy.cat()
+    assert c.pipeline.rc == 0
+
+
+def test_pipeline_timeout():
+    start = time.time()
+    c = cmdy.sleep(10).p() | cmdy.cat(cmdy_timeout=0.2)
+    with pytest.raises(CmdyTimeoutError):
+        c.wait()
+    assert c.pipeline.results[0].proc.poll() is not None
+    assert time.time() - start < 5
+
+
+def test_pipeline_async(tmp_path):
+    async def main():
+        c = cmdy.seq(1000).p() | cmdy.grep("00").p() | cmdy.wc(l=True).a()
+        assert isinstance(c, cmdy.CmdyAsyncResult)
+        assert await c is c
+        assert await c.stdout.read() == b"10\n"
+        assert c.pipeline.rcs == [0, 0, 0]
+
+        outfile = tmp_path / "out.txt"
+        await (cmdy.seq(3).p() | cmdy.cat().a().r(STDOUT) ^ outfile)
+        assert outfile.read_text() == "1\n2\n3\n"
+
+        c = cmdy.seq(3).p() | cmdy.cat().a()
+        assert [line async for line in c] == ["1\n", "2\n", "3\n"]
+        assert c.pipeline.rcs == [0, 0]
+
+    curio.run(main)
+
+
+def test_pipeline_async_concurrent():
+    async def one(i):
+        c = await (
+            cmdy.bash(c=f"sleep 0.5; echo {i}").p() | cmdy.cat().a()
+        )
+        return int(await c.stdout.read())
+
+    async def main():
+        async with curio.TaskGroup(wait=all) as group:
+            for i in range(20):
+                await group.spawn(one, i)
+        return sorted(group.results)
+
+    start = time.time()
+    assert curio.run(main) == list(range(20))
+    assert time.time() - start < 5
+
+
+def test_pipeline_async_timeout_cancel():
+    start = time.time()
+    c = cmdy.sleep(10).p() | cmdy.cat(cmdy_timeout=0.2).a()
+    with pytest.raises(CmdyTimeoutError):
+        curio.run(c.wait())
+    assert all(result.proc.poll() is not None for result in c.pipeline.results)
+
+    # cancelled as one unit
+    c = cmdy.yes().p() | cmdy.sleep(10).a()
+    with pytest.raises(curio.TaskTimeout):
+        curio.run(curio.timeout_after(0.2, c.wait()))
+    assert all(result.proc.poll() is not None for result in c.pipeline.results)
+    assert time.time() - start < 5
+
+
+def test_pipeline_async_fail():
+    c = cmdy.bash(c="exit 3").p() | cmdy.cat(cmdy_pipefail=True).a()
+    with pytest.raises(CmdyReturnCodeError):
+        curio.run(c.wait())
+    assert c.pipeline.rcs == [3, 0]
+
+    c = cmdy.seq(3).p() | cmdy.bash(c="cat; echo err >&2; exit 2").a()
+    with pytest.raises(CmdyReturnCodeError, match="err"):
+        curio.run(c.wait())
+
+
+def test_pipeline_not_found():
+    with pytest.raises(cmdy.CmdyExecNotFoundError):
+        cmdy.yes().p() | cmdy.cmdy_not_exist()
+
+
+@pytest.mark.parametrize("zero_copy", [True, False])
+def test_fanout(zero_copy, monkeypatch):
+    if not zero_copy:
+        monkeypatch.setattr(
+            sys.modules["cmdy.cmdy_engine"], "_libc_tee", lambda: None
+        )
+    fan = cmdy.seq(100000).p() | cmdy.fanout(
+        cmdy.wc(l=True), cmdy.head(n=2), cmdy.tail(n=1)
+    )
+    assert isinstance(fan, cmdy.CmdyFanout)
+    assert len(fan) == 3
+    assert repr(fan).startswith("<CmdyFanout: [['wc', '-l']")
+    assert fan.rcs == [0, 0, 0]
+    assert fan.producer.rc == 0
+    assert [result.stdout for result in fan] == [
+        "100000\n",
+        "1\n2\n",
+        "100000\n",
+    ]
+    assert fan[0].strip() == "100000"
+
+
+def test_fanout_tee_unsupported_midway(monkeypatch):
+    engine = sys.modules["cmdy.cmdy_engine"]
+    if not hasattr(os, "splice") or engine._libc_tee() is None:
+        pytest.skip("tee(2) is not available.")
+    tee = engine.tee
+    calls = []
+
+    def flaky_tee(src, dest, size):
+        # the second pipe of the first chunk
+        calls.append(dest)
+        if len(calls) == 2:
+            raise OSError(errno.EINVAL, "Invalid argument")
+        return tee(src, dest, size)
+
+    monkeypatch.setattr(engine, "tee", flaky_tee)
+    fan = cmdy.seq(100000).p() | cmdy.fanout(
+        cmdy.wc(c=True), cmdy.wc(c=True), cmdy.wc(c=True)
+    )
+    assert [result.stdout for result in fan] == ["588895\n"] * 3
+    # tee(2) not tried anymore
+    assert len(calls) == 2
+
+
+def test_fanout_pipeline():
+    fan = cmdy.seq(1000).p() | cmdy.grep("00").p() | cmdy.fanout(
+        cmdy.wc(l=True), cmdy.tail(n=1)
+    )
+    assert [result.stdout for result in fan] == ["10\n", "1000\n"]
+    assert fan.producer.pipeline.rcs == [0, 0]
+
+
+def test_fanout_early_exit():
+    fan = cmdy.yes().p() | cmdy.fanout(
+        cmdy.head(n=1), cmdy.head(n=2, cmdy_timeout=5)
+    )
+    assert fan.rcs == [0, 0]
+    assert [result.stdout for result in fan] == ["y\n", "y\ny\n"]
+    # SIGPIPE when all the consumers are gone
+    assert fan.producer.rc == -13
+    assert fan.failed is None
+
+
+def test_fanout_fail():
+    with pytest.raises(CmdyReturnCodeError):
+        cmdy.seq(10).p() | cmdy.fanout(cmdy.cat(), cmdy.bash(c="exit 3"))
+
+    fan = cmdy.bash(c="seq 10; exit 3", cmdy_pipefail=False).p() | (
+        cmdy.fanout(cmdy.cat())
+    )
+    assert fan.rcs == [0]
+    assert fan.producer.rc == 3
+
+    with pytest.raises(CmdyReturnCodeError):
+        cmdy.bash(c="seq 10; exit 3").p() | cmdy.fanout(cmdy.cat())
+
+
+def test_fanout_not_holding():
+    with pytest.raises(cmdy.CmdyActionError):
+        cmdy.fanout()
+    with pytest.raises(cmdy.CmdyActionError):
+        cmdy.fanout(cmdy.echo(1))
+
+
+def test_partition():
+    part = cmdy.partition(
+        cmdy.plan(cmdy.seq, 10000),
+        cmdy.plan(cmdy.cat),
+        n=3,
+        chunk_size=1000,
+    )
+    assert repr(part) == "<CmdyPartition: 3 x ['cat']>"
+    assert part.run() is part
+    assert part.rcs == [0, 0, 0]
+    # split on line boundaries
+    assert all(result.stdout.endswith("\n") for result in part)
+    assert sorted(part.stdout.split(), key=int) == [
+        str(i) for i in range(1, 10001)
+    ]
+    part = cmdy.partition(cmdy.plan(cmdy.seq, 3), cmdy.plan(cmdy.cat))
+    assert len(part) == os.cpu_count()
+
+
+def test_partition_by():
+    worker = cmdy.prepare(cmdy.sort, n=True)
+    part = cmdy.partition(
+        cmdy.bash(c="seq 1000; echo -n 1001").h(),
+        worker,
+        n=3,
+        by=lambda line: int(line) % 3,
+        chunk_size=100,
+    ).run()
+    for i, result in enumerate(part):
+        numbers = [int(line) for line in result.stdout.split()]
+        assert numbers == sorted(numbers)
+        assert {number % 3 for number in numbers} == {i}
+    assert len(part.stdout.split()) == 1001
+
+
+def test_partition_error():
+    with pytest.raises(ValueError):
+        cmdy.partition(cmdy.plan(cmdy.seq, 3), cmdy.plan(cmdy.cat), n=0)
+
+    with pytest.raises(ZeroDivisionError):
+        cmdy.partition(
+            cmdy.plan(cmdy.seq, 3), cmdy.plan(cmdy.cat), by=lambda line: 1 / 0
+        ).run()
+
+    # the chunks go to the others when a worker exits early
+    part = cmdy.partition(
+        cmdy.plan(cmdy.seq, 100000),
+        cmdy.plan(cmdy.head, n=1),
+        n=2,
+        chunk_size=1000,
+    ).run()
+    assert part.stdout == "1\n" + part[1].stdout
+    assert part.producer.rc == -13
+
+
+def test_line_ranges(tmp_path):
+    infile = tmp_path / "test_line_ranges.txt"
+    infile.write_bytes(b"1\n22\n" + b"3" * 10 + b"\n4")
+    ranges = line_ranges(infile, 3)
+    assert ranges == [(0, 5), (5, 16), (16, 17)]
+    assert line_ranges(infile, 100) == [(0, 17)]
+    infile.write_bytes(b"")
+    assert line_ranges(infile, 3) == []
+
+
+def test_pipepart(tmp_path):
+    infile = tmp_path / "test_pipepart.txt"
+    infile.write_text("".join(f"{i}\n" for i in range(100000)))
+    part = cmdy.pipepart(
+        infile, cmdy.plan(cmdy.cat), jobs=3, block_size=10000
+    )
+    assert repr(part).startswith("<CmdyPipepart: ")
+    assert len(part) > 50
+    # in the order of the blocks
+    assert part.stdout == infile.read_text()
+
+    results = cmdy.pipepart(
+        infile, cmdy.prepare(cmdy.wc, l=True), block_size=100000
+    ).run()
+    assert sum(int(result.stdout) for result in results) == 100000
+    assert all(result.rc == 0 for result in results)
+
+    # early exit
+    results = cmdy.pipepart(infile, cmdy.plan(cmdy.head, n=1)).run()
+    assert results[0].stdout == "0\n"
+
+
+def test_pipepart_error(tmp_path):
+    infile = tmp_path / "test_pipepart_error.txt"
+    infile.write_text("".join(f"{i}\n" for i in range(1000)))
+    with pytest.raises(ValueError):
+        cmdy.pipepart(infile, cmdy.plan(cmdy.cat), jobs=0)
+
+    part = cmdy.pipepart(
+        infile, cmdy.plan(cmdy.bash, c="exit 3"), jobs=1, block_size=10
+    )
+    with pytest.raises(CmdyReturnCodeError):
+        part.run()
+
+
+def test_merge_sorted():
+    merged = cmdy.merge_sorted(
+        [
+            cmdy.plan(cmdy.seq, 1, 3, 10000),
+            cmdy.seq(2, 3, 10000).h(),
+            cmdy.plan(cmdy.bash, c="seq 3 3 10000; echo -n 10001"),
+        ],
+        key=int,
+    )
+    assert repr(merged).startswith("<CmdyMerge: [['seq', '1', '3', '10000']")
+    assert list(merged) == [f"{i}\n" for i in range(1, 10002)]
+    assert [result.rc for result in merged.results] == [0, 0, 0]
+
+    merged = cmdy.merge_sorted(
+        [cmdy.plan(cmdy.seq, 9, -2, 1), cmdy.plan(cmdy.seq, 10, -2, 1)],
+        key=int,
+        reverse=True,
+    )
+    c = cmdy.head(n=3).r(STDIN) < merged
+    assert c == "10\n9\n8\n"
+
+
+def test_merge_sorted_stderr():
+    # more than the stderr pipe holds before any stdout
+    size = 1 << 20
+    merged = cmdy.merge_sorted(
+        [
+            cmdy.plan(
+                cmdy.bash, c=f"head -c {size} /dev/zero >&2; seq 1 2 5"
+            ),
+            cmdy.plan(cmdy.seq, 2, 2, 6),
+        ],
+        key=int,
+    )
+    assert list(merged) == [f"{i}\n" for i in range(1, 7)]
+    assert len(merged.results[0].stderr) == size
+
+
+def test_merge_sorted_early_stop():
+    merged = cmdy.merge_sorted([cmdy.plan(cmdy.yes), cmdy.plan(cmdy.yes)])
+    c = cmdy.head(n=3, cmdy_timeout=5).r(STDIN) < merged
+    assert c == "y\ny\ny\n"
+    assert all(result.rc < 0 for result in merged.results)
+
+    merged = cmdy.merge_sorted([cmdy.plan(cmdy.bash, c="echo 1; exit 3")])
+    with pytest.raises(CmdyReturnCodeError):
+        list(merged)
+
+
+def test_interleave():
+    results = [
+        cmdy.bash(c=f"echo out{i}; echo err{i} >&2; sleep 0.{i}; echo end{i}")
+        .h()
+        for i in range(1, 4)
+    ]
+    lines = list(cmdy.interleave(results, BOTH))
+    assert len(lines) == 9
+    # the slower commands come later
+    assert [line for _, which, line in lines[-3:]] == [
+        "end1\n", "end2\n", "end3\n"
+    ]
+    for result, which, line in lines:
+        i = line[-2]
+        assert line.startswith("err" if which == STDERR else ("out", "end"))
+        assert result.cmd[-1].startswith(f"echo out{i};")
+        assert result.rc == 0
+
+    interleaved = cmdy.interleave(
+        [cmdy.plan(cmdy.bash, c="echo 1; echo 2 >&2; exit 3")], STDERR
+    )
+    assert repr(interleaved).startswith("<CmdyInterleave: [['bash'")
+    lines = []
+    with pytest.raises(CmdyReturnCodeError):
+        for _, _, line in interleaved:
+            lines.append(line)
+    assert lines == ["2\n"]
+    assert interleaved.failed == interleaved.results
+    assert interleaved.results[0].stdout == "1\n"
+
+    with pytest.raises(ValueError):
+        cmdy.interleave([], STDIN)
+
+
+def test_interleave_early_stop():
+    interleaved = cmdy.interleave([cmdy.plan(cmdy.yes), cmdy.plan(cmdy.yes)])
+    lines = iter(interleaved)
+    assert next(lines)[2] == "y\n"
+    lines.close()
+    assert all(result.rc < 0 for result in interleaved.results)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pystage(engine):
+    c = (
+        cmdy.seq(3).p()
+        | cmdy.pystage(str.upper).p()
+        | cmdy.pystage(lambda line: None if line == "2\n" else line * 2).p()
+        | cmdy.cat(cmdy_engine=engine)
+    )
+    assert c == "1\n1\n3\n3\n"
+    assert c.piped_strcmds[:2] == ["seq 3", "pystage str.upper"]
+    assert c.pipeline.rcs == [0, 0, 0, 0]
+
+    # the last stage
+    c = cmdy.seq(3).p() | cmdy.pystage(lambda line: line.strip())
+    assert isinstance(c.holding, cmdy.CmdyPyStage)
+    assert c.wait() == "123"
+
+    # chunks of bytes
+    c = cmdy.seq(3).p() | cmdy.pystage(
+        lambda chunk: chunk[::-1], lines=False, cmdy_encoding=None
+    )
+    assert c.stdout == b"\n3\n2\n1"
+
+
+def test_pystage_error():
+    def fail(line):
+        raise ValueError("Bad line")
+
+    c = cmdy.seq(3).p() | cmdy.pystage(fail)
+    with pytest.raises(CmdyReturnCodeError, match="Bad line"):
+        c.wait()
+
+    c = (
+        cmdy.seq(3).p()
+        | cmdy.pystage(fail).p()
+        | cmdy.cat(cmdy_pipefail=True)
+    )
+    with pytest.raises(CmdyReturnCodeError):
+        c.wait()
+    assert c.pipeline.rcs == [0, 1, 0]
+
+    # the stage exits early when the output is closed
+    c = cmdy.yes().p() | cmdy.pystage(str.upper).p() | cmdy.head(n=2)
+    assert c == "Y\nY\n"
+    assert c.pipeline.rcs[1:] == [-13, 0]
+
+
+def test_pystage_timeout():
+    def block(line):
+        time.sleep(20)
+
+    start = time.time()
+    c = cmdy.seq(3).p() | cmdy.pystage(block, cmdy_timeout=0.5)
+    with pytest.raises(CmdyTimeoutError):
+        c.wait()
+    assert c.proc._popen.poll() == -9
+
+    # the pipes are released for the other stages
+    c = cmdy.yes().p() | cmdy.pystage(block).p() | cmdy.cat(cmdy_timeout=0.5)
+    with pytest.raises(CmdyTimeoutError):
+        c.wait()
+    rcs = [result.proc._popen.poll() for result in c.pipeline.results]
+    # cat may get the EOF before it is killed
+    assert rcs[:2] == [-9, -9] and rcs[2] in (-9, 0)
+    assert time.time() - start < 5
+
+
+def test_map():
+    batch = cmdy.map(
+        cmdy.bash,
+        [("-c", f"sleep 0.{3 - i}; echo {i}") for i in range(4)],
+        jobs=2,
+    )
+    assert repr(batch).startswith("<CmdyMap: <Cmdy: bash")
+    assert [result.stdout for result in batch] == ["0\n", "1\n", "2\n", "3\n"]
+
+    batch = cmdy.map(
+        "bash",
+        [{"c": f"sleep 0.{3 - i}; echo {i}"} for i in range(4)],
+        jobs=4,
+        ordered=False,
+    )
+    assert [result.stdout for result in batch.run()] == [
+        "3\n",
+        "2\n",
+        "1\n",
+        "0\n",
+    ]
+
+    echo = cmdy.prepare(cmdy.echo, cmdy.slot("value"))
+    progress = []
+    batch = cmdy.map(
+        echo,
+        ({"value": i} for i in range(5)),
+        jobs=2,
+        progress=lambda done, total: progress.append((done, total)),
+    )
+    assert [result.stdout for result in batch] == [f"{i}\n" for i in range(5)]
+    assert progress == [(i, None) for i in range(1, 6)]
+
+    with pytest.raises(ValueError):
+        cmdy.map(cmdy.true, [], jobs=0)
+
+
+def test_map_subcommand():
+    echo = cmdy.echo
+    batch = cmdy.map(echo.sub, ["a", "b", "c", "d"], jobs=4)
+    assert [result.cmd for result in batch.run()] == [
+        ["echo", "sub", item] for item in "abcd"
+    ]
+    # taken from the command, as a call does
+    assert echo._args.args == []
+    assert echo().cmd == ["echo"]
+
+
+def test_map_fail():
+    start = time.time()
+    batch = cmdy.map("bash", [{"c": "exit 3"}] + [{"c": "sleep 10"}] * 5)
+    with pytest.raises(CmdyReturnCodeError):
+        batch.run()
+    assert time.time() - start < 5
+
+    batch = cmdy.map(
+        "bash", [{"c": f"exit {i % 2}"} for i in range(4)], fail_fast=False
+    )
+    assert [result.rc for result in batch.run()] == [0, 1, 0, 1]
+    assert len(batch.failed) == 2
+
+
+def test_map_stop():
+    # stopped while the threads start and finish commands
+    start = time.time()
+    for _ in range(10):
+        batch = cmdy.map(
+            "bash", [{"c": "exit 3"}] + [{"c": "true"}] * 30, jobs=8
+        )
+        with pytest.raises(CmdyReturnCodeError):
+            batch.run()
+        assert not batch._running
+    batch = cmdy.map("sleep", [0] + [10] * 7, jobs=8)
+    for result in batch:
+        break
+    assert not batch._running
+    assert time.time() - start < 5
+
+
+def test_amap():
+    async def main():
+        batch = cmdy.amap(
+            cmdy.bash,
+            [("-c", f"sleep 0.{3 - i}; echo {i}") for i in range(4)],
+            jobs=4,
+            ordered=False,
+        )
+        results = [await result.stdout.read() async for result in batch]
+        assert results == [b"3\n", b"2\n", b"1\n", b"0\n"]
+
+        batch = cmdy.amap("bash", [{"c": "exit 3"}] + [{"c": "sleep 10"}] * 5)
+        with pytest.raises(CmdyReturnCodeError):
+            await batch.arun()
+
+        batch = cmdy.amap(
+            "bash",
+            [{"c": f"exit {i % 2}"} for i in range(4)],
+            fail_fast=False,
+        )
+        assert [await result.rc for result in await batch.arun()] == [
+            0,
+            1,
+            0,
+            1,
+        ]
+        assert len(batch.failed) == 2
+
+        async with cmdy.amap("sleep", [0, 10, 10], jobs=3) as batch:
+            async for result in batch:
+                break
+
+    start = time.time()
+    curio.run(main)
+    assert time.time() - start < 5
+
+    with pytest.raises(cmdy.CmdyActionError):
+        iter(cmdy.amap("true", [()])).__next__()
+    with pytest.raises(cmdy.CmdyActionError):
+        cmdy.map("true", [()]).__aiter__()
@@ -0,0 +1,100 @@
+import curio
+import pytest
+
+import cmdy
+import cmdy.cmdy_utils
+from cmdy.cmdy_defaults import STDERR, STDOUT
+from cmdy.cmdy_exceptions import CmdyActionError, CmdyReturnCodeError
+
+
+@pytest.fixture
+def no_introspection(monkeypatch):
+    def _executing_node(frame):
+        raise AssertionError("Frames should not be inspected.")
+
+    monkeypatch.setattr(cmdy.cmdy_utils, "_executing_node", _executing_node)
+
+
+def test_plan_run(no_introspection):
+    plan = cmdy.plan(cmdy.echo, n=True, _="1")
+    assert repr(plan) == "<CmdyPlan: ['echo']>"
+    ret = plan.run()
+    assert isinstance(ret, cmdy.CmdyResult)
+    assert ret.cmd == ["echo", "-n", "1"]
+    assert ret == "1"
+    assert ret.int() == 1
+    # plans can be rerun
+    assert plan.run().cmd == ["echo", "-n", "1"]
+
+
+def test_plan_by_name(no_introspection):
+    assert cmdy.plan("echo", n=True, _="2").run() == "2"
+
+
+def test_plan_sub_error():
+    with pytest.raises(CmdyActionError):
+        cmdy.plan(cmdy.git, _sub=True)
+
+
+def test_plan_rc_error(no_introspection):
+    with pytest.raises(CmdyReturnCodeError):
+        cmdy.plan(cmdy.bash, c="exit 1").run()
+
+    assert cmdy.plan(cmdy.bash, c="exit 1", _raise=False).run().rc == 1
+
+
+def test_plan_pipe(no_introspection):
+    plan = cmdy.plan(cmdy.echo, "1\n2\n3") | cmdy.plan(cmdy.grep, 2)
+    ret = plan.run()
+    assert ret == "2\n"
+    assert ret.piped_strcmds == ["echo '1\n2\n3'", "grep 2"]
+
+    plan = cmdy.plan(cmdy.bash, c="echo 1 1>&2").pipe(
+        cmdy.plan(cmdy.cat), STDERR
+    )
+    assert plan.run() == "1\n"
+
+    with pytest.raises(CmdyActionError):
+        cmdy.plan(cmdy.echo).pipe(cmdy.plan(cmdy.cat), 1)
+    with pytest.raises(CmdyActionError):
+        cmdy.plan(cmdy.echo).iter() | cmdy.plan(cmdy.cat)
+
+
+def test_plan_redirect(no_introspection, tmp_path):
+    infile = tmp_path / "in.txt"
+    outfile = tmp_path / "out.txt"
+    infile.write_text("123\n")
+    ret = cmdy.plan(cmdy.cat).redirect(stdin=infile, stdout=outfile).run()
+    assert ret.stdout is None
+    assert outfile.read_text() == "123\n"
+
+    cmdy.plan(cmdy.cat).redirect(
+        stdin=infile, stdout=outfile, append=True
+    ).run()
+    assert outfile.read_text() == "123\n123\n"
+
+    ret = cmdy.plan(cmdy.bash, c="echo 1 1>&2").redirect(stderr=STDOUT).run()
+    assert ret == "1\n"
+
+
+def test_plan_iter(no_introspection):
+    ret = cmdy.plan(cmdy.echo, "1\n2").iter().run()
+    assert list(ret) == ["1\n", "2\n"]
+
+    ret = cmdy.plan(cmdy.bash, c="echo 1 1>&2").iter(STDERR).run()
+    assert list(ret) == ["1\n"]
+
+    with pytest.raises(CmdyActionError):
+        cmdy.plan(cmdy.echo).redirect(stdout="/dev/null").iter().run()
+
+
+def test_plan_async(no_introspection):
+    ret = cmdy.plan(cmdy.echo, "1").async_().run()
+    assert isinstance(ret, cmdy.CmdyAsyncResult)
+    assert curio.run(ret.astr()) == "1\n"
+
+
+def test_plan_fg(no_introspection, capsys):
+    ret = cmdy.plan(cmdy.echo, "123").fg().run()
+    assert isinstance(ret, cmdy.CmdyResult)
+    assert capsys.readouterr().out == "123\n"
@@ -350,3 +350,65 @@ def test_run_then_async():
     c = bakeable.echo('12 1>&2', cmdy_shell=True).async_().iter(bakeable.STDERR)
     clist = curio.run(c.list())
     assert clist == ['12']
+
+
+def test_lazy_plugins():
+    from cmdy.cmdy_plugins import LazyPluginAttribute
+
+    bakeable = cmdy()
+    assert repr(bakeable._plugins) == "<PluginRegistry: vendored=[]>"
+    assert isinstance(
+        vars(bakeable.CmdyResult)["str"], LazyPluginAttribute
+    )
+    assert "pipe" in bakeable._plugins
+    assert list(bakeable._plugins) == [
+        "bg", "fg", "iter", "pipe", "redirect", "value"
+    ]
+
+    # actions are known before vendoring
+    c = bakeable.echo(123).p()
+    assert isinstance(c, bakeable.CmdyHolding)
+    assert "pipe" in repr(bakeable._plugins)
+    assert (c | bakeable.cat()) == "123\n"
+    assert "value" in repr(bakeable._plugins)
+    assert "fg" not in repr(bakeable._plugins)
+
+    assert bakeable._plugins["iter"] is bakeable._plugins.iter
+    with pytest.raises(KeyError):
+        bakeable._plugins["x"]
+    with pytest.raises(AttributeError):
+        bakeable._plugins.x
+
+
+def test_plugin_manifest():
+    from cmdy.cmdy_plugins import PLUGIN_MANIFEST, LazyPluginAttribute
+
+    bakeable = cmdy()
+    actions = {
+        key: list(getattr(bakeable, key))
+        for key in (
+            "_holding_left",
+            "_holding_right",
+            "_holding_finals",
+            "_result_finals",
+        )
+    }
+    for name, manifest in PLUGIN_MANIFEST.items():
+        before = {
+            cls: set(vars(cls))
+            for cls in (bakeable.CmdyHolding, bakeable.CmdyResult)
+        }
+        bakeable._plugins.vendor(name)
+        for cls, attrs in (
+            (bakeable.CmdyHolding, manifest.holding),
+            (bakeable.CmdyResult, manifest.result),
+        ):
+            for attr in attrs:
+                assert not isinstance(vars(cls)[attr], LazyPluginAttribute)
+            # everything the plugin adds is in the manifest
+            # except the overridden ones
+            assert set(vars(cls)) - before[cls] <= {"run"}
+
+    # no new actions registered by the plugins
+    for key, value in actions.items():
+        assert getattr(bakeable, key) == value
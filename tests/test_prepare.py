@@ -0,0 +1,132 @@
+import sys
+
+import curio
+import pytest
+
+import cmdy
+import cmdy.cmdy_utils
+from cmdy.cmdy_defaults import STDERR
+from cmdy.cmdy_exceptions import CmdyActionError, CmdyReturnCodeError
+
+
+@pytest.fixture
+def no_parsing(monkeypatch):
+    """Forbid parsing or composing anything from now on, for running
+    prepared commands"""
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Commands should not be parsed or composed.")
+
+    def forbid():
+        monkeypatch.setattr(cmdy.cmdy_utils, "_executing_node", fail)
+        # both where they are defined and where they are imported,
+        # cmdy.cmdy itself being a command of the bakeable
+        for module in (cmdy.cmdy_utils, sys.modules["cmdy.cmdy"]):
+            monkeypatch.setattr(module, "parse_args", fail)
+            monkeypatch.setattr(module, "compose_cmd", fail)
+            monkeypatch.setattr(module, "compose_arg_segment", fail)
+
+    return forbid
+
+
+def test_slot():
+    assert repr(cmdy.slot("x")) == "<CmdySlot: x>"
+    with pytest.raises(ValueError):
+        cmdy.slot("a b")
+
+
+def test_prepare_run():
+    prepared = cmdy.prepare(
+        cmdy.echo,
+        f"{{{cmdy.slot('a')}}}",
+        n=True,
+        _=[cmdy.slot("b"), "x"],
+    )
+    assert prepared.slots == {"a", "b"}
+    assert "CmdyPrepared" in repr(prepared)
+    ret = prepared.run(a=1, b="{2}")
+    assert ret.cmd == ["echo", "{1}", "-n", "{2}", "x"]
+    assert ret == "{1} -n {2} x\n"
+    ret = prepared.run(a="y", b=3)
+    assert ret.cmd == ["echo", "{y}", "-n", "3", "x"]
+
+    with pytest.raises(ValueError):
+        prepared.run(a=1)
+    with pytest.raises(ValueError):
+        prepared.run(a=1, b=2, c=3)
+
+
+def test_prepare_no_parsing(no_parsing):
+    prepared = cmdy.prepare("echo", n=True, _=cmdy.slot("x"))
+    no_parsing()
+    for i in range(3):
+        assert prepared.run(x=i) == str(i)
+    # while the commands not prepared are
+    with pytest.raises(AssertionError):
+        cmdy.echo(n=True)
+
+
+def test_prepare_kwarg_slot():
+    prepared = cmdy.prepare(
+        cmdy.bash, c=cmdy.slot("code"), _raise=False
+    )
+    assert prepared.run(code="exit 2").rc == 2
+    assert prepared.run(code="exit 0").rc == 0
+
+    with pytest.raises(CmdyReturnCodeError):
+        cmdy.prepare(cmdy.bash, c=cmdy.slot("code")).run(code="exit 1")
+
+
+def test_prepare_sub_error():
+    with pytest.raises(CmdyActionError):
+        cmdy.prepare(cmdy.git, _sub=True)
+
+
+def test_prepare_iter():
+    prepared = cmdy.prepare(cmdy.seq, cmdy.slot("n")).iter()
+    assert list(prepared.run(n=3)) == ["1\n", "2\n", "3\n"]
+    assert list(prepared.run(n=2)) == ["1\n", "2\n"]
+
+    prepared = cmdy.prepare(
+        cmdy.bash, c=cmdy.slot("code")
+    ).iter(STDERR)
+    assert list(prepared.run(code="echo 1 1>&2")) == ["1\n"]
+
+    with pytest.raises(CmdyActionError):
+        prepared.iter(1)
+
+
+def test_prepare_async():
+    prepared = cmdy.prepare(cmdy.echo, cmdy.slot("x")).async_()
+
+    async def main():
+        results = [prepared.run(x=i) for i in range(3)]
+        assert all(isinstance(ret, cmdy.CmdyAsyncResult) for ret in results)
+        return [await ret.rc for ret in results] + [
+            await ret.stdout.read() for ret in results
+        ]
+
+    assert curio.run(main()) == [0, 0, 0, b"0\n", b"1\n", b"2\n"]
+
+    prepared.iter()
+
+    async def lines():
+        return [line async for line in prepared.run(x="1\n2")]
+
+    assert curio.run(lines()) == ["1\n", "2\n"]
+
+
+def test_prepare_config_changed(monkeypatch):
+    from cmdy.cmdy_defaults import CONFIG_SNAPSHOT
+
+    prepared = cmdy.prepare(cmdy.git.branch, cmdy.slot("x"))
+    template = prepared.template
+    assert prepared.compose(x="a") == ["git", "branch", "a"]
+    prepared.holding(x="b")
+    assert prepared.template is template
+
+    monkeypatch.setattr(
+        CONFIG_SNAPSHOT, "generation", CONFIG_SNAPSHOT.generation + 1
+    )
+    assert prepared.holding(x="c").cmd == ["git", "branch", "c"]
+    assert prepared.template is not template
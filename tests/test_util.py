@@ -3,7 +3,7 @@ import time
 import curio
 from diot import Diot
 from simpleconf import ProfileConfig
-from cmdy.cmdy_defaults import get_config
+from cmdy.cmdy_defaults import ConfigSnapshot, get_config
 from cmdy.cmdy_utils import (
     parse_args,
     SyncStreamFromAsync,
@@ -13,6 +13,12 @@ from cmdy.cmdy_utils import (
     fix_popen_config,
     property_called_as_method,
     property_or_method,
+    will,
+    CALLSITE_CACHE,
+    CONFIG_CACHE,
+    ConfigCache,
+    copy_config,
+    split_lines,
 )
 
 CONFIG = get_config()
@@ -45,6 +51,36 @@ def testproperty_or_method():
     assert x == 2
 
 
+def test_callsite_cache():
+    class C:
+        def m(self):
+            self.next_attr = will()
+            return self
+
+        def n(self):
+            return self.next_attr
+
+    CALLSITE_CACHE.clear()
+    c = C()
+    nexts = [c.m().n() for _ in range(10)]
+    assert nexts == ["n"] * 10
+    assert CALLSITE_CACHE.misses == 1
+    assert CALLSITE_CACHE.hits == 9
+    assert "hits=9" in repr(CALLSITE_CACHE)
+
+    # a different call site
+    c.m()
+    assert c.next_attr is None
+    assert CALLSITE_CACHE.misses == 2
+
+    CALLSITE_CACHE.clear()
+    assert CALLSITE_CACHE.hits == CALLSITE_CACHE.misses == 0
+
+    # stack not deep enough
+    assert will(1000) is None
+    assert property_called_as_method(1000) is False
+
+
 @pytest.mark.parametrize(
     "cmd_args,config,expected",
     [
@@ -224,6 +260,114 @@ def test_parse_args_config():
     assert args.config["l"] is True
 
 
+def test_parse_args_cached():
+    CONFIG_CACHE.clear()
+    config = ProfileConfig.load(
+        {
+            "default": ProfileConfig.use_profile(CONFIG, "default", copy=True),
+            "ls": {"okcode": "0,1", "shell": ["sh"]},
+        }
+    )
+    baked = Diot(popen_cwd="/tmp", x=1)
+    first = parse_args("ls", (), {"cmdy_okcode": 2}, config, baked)
+    second = parse_args("ls", ({"y": 2},), {}, config, baked)
+    assert CONFIG_CACHE.misses == 1
+    assert CONFIG_CACHE.hits == 1
+    assert "hits=1" in repr(CONFIG_CACHE)
+
+    assert first.config.okcode == [2]
+    assert second.config.okcode == [0, 1]
+    assert second.config.shell == ["sh", "-c"]
+    assert first.kwargs == second.kwargs == {"x": 1}
+    assert second.args == ["-y", "2"]
+    assert first.popen == second.popen == {"cwd": "/tmp"}
+    # not shared between calls
+    first.popen.cwd = "/"
+    assert parse_args("ls", (), {}, config, baked).popen.cwd == "/tmp"
+
+    # different baked args
+    parse_args("ls", (), {}, config, Diot())
+    assert CONFIG_CACHE.misses == 2
+    CONFIG_CACHE.clear()
+    assert CONFIG_CACHE.hits == CONFIG_CACHE.misses == 0
+
+
+def test_config_cache_bounded():
+    cache = ConfigCache(maxsize=2)
+    config = ProfileConfig.load(
+        {"default": ProfileConfig.use_profile(CONFIG, "default", copy=True)}
+    )
+    baked = [Diot(x=i) for i in range(3)]
+    cache.resolve("ls", config, baked[0])
+    cache.resolve("ls", config, baked[1])
+    # the first one used recently
+    cache.resolve("ls", config, baked[0])
+    cache.resolve("ls", config, baked[2])
+    assert len(cache.entries) == 2
+    assert [entry.baked_args for entry in cache.entries.values()] == [
+        baked[0],
+        baked[2],
+    ]
+    assert cache.hits == 1
+    cache.resolve("ls", config, baked[1])
+    assert cache.misses == 4
+
+
+def test_config_cache_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = ConfigCache(maxsize=4)
+    config = ProfileConfig.load(
+        {"default": ProfileConfig.use_profile(CONFIG, "default", copy=True)}
+    )
+    baked = [Diot(x=i) for i in range(16)]
+
+    def resolve(i):
+        for _ in range(50):
+            cache.resolve("ls", config, baked[i % 16])
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(resolve, range(64)))
+    assert len(cache.entries) == 4
+    assert cache.hits + cache.misses == 64 * 50
+
+
+def test_config_snapshot(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    snapshot = ConfigSnapshot(interval=0)
+    config = snapshot.get()
+    assert snapshot.generation == 1
+    assert "generation=1" in repr(snapshot)
+    assert snapshot.get() is config
+
+    (tmp_path / ".cmdy.toml").write_text("[ls]\nl = true\n")
+    config = snapshot.get()
+    assert snapshot.generation == 2
+    assert config._SIMPLECONF_POOL.ls.l is True
+
+    monkeypatch.setenv("CMDY_LS_A", "1")
+    assert snapshot.get() is not config
+    assert snapshot.generation == 3
+
+    snapshot.invalidate()
+    snapshot.get()
+    assert snapshot.generation == 4
+
+    # not checked within the interval
+    snapshot.interval = 60
+    monkeypatch.setenv("CMDY_LS_A", "2")
+    snapshot.get()
+    assert snapshot.generation == 4
+
+
+def test_copy_config():
+    copied = copy_config(CONFIG)
+    copied.okcode = [1]
+    assert CONFIG.okcode == [0]
+    assert copied["okcode"] == [1]
+    assert copied["raise"] is CONFIG["raise"]
+
+
 def test_parse_args_warnings():
 
     with pytest.warns(UserWarning):
@@ -243,6 +387,24 @@ def test_parse_args_exception():
         parse_args("", [{"popen_cwd": ""}], {}, CONFIG, {})
 
 
+@pytest.mark.parametrize(
+    "data,encoding,chunk_bytes,eof,expected,rest",
+    [
+        (b"a\nb\nc", None, None, False, [b"a\n", b"b\n"], b"c"),
+        (b"a\nb\nc", None, None, True, [b"a\n", b"b\n", b"c"], b""),
+        (b"a\nb\nc", "utf-8", 3, False, ["a\n"], b"b\nc"),
+        (b"abc\nd\n", "utf-8", 2, False, ["abc\n"], b"d\n"),
+        (b"a\rb\n", "utf-8", None, False, ["a\rb\n"], b""),
+        (b"abc", None, None, False, [], b"abc"),
+        (b"", None, None, True, [], b""),
+    ],
+)
+def test_split_lines(data, encoding, chunk_bytes, eof, expected, rest):
+    buffer = bytearray(data)
+    assert split_lines(buffer, encoding, chunk_bytes, eof) == expected
+    assert buffer == rest
+
+
 def test_asnyc_to_sync():
 
     p = curio.subprocess.Popen(